@@ -25,7 +25,7 @@ urlpatterns = [
     path('toc/<source>', views.toc, name='toc'),
     path('cite', views.cite, name='cite'),
     path('cite/<citation>', views.cite, name='cite'),
-    path('search/<words>', views.search, name='search'),
+    path('search/<path:words>', views.search, name='search'),
     path('synonyms/<word>', views.synonyms, name='synonyms'),
     path('versions', views.versions, name='versions'),
     path('item_debug/<int:version_id>', views.item_debug, name='item_debug'),
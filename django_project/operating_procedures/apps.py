@@ -1,4 +1,13 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+def set_journal_mode(sender, connection, **kwargs):
+    r'''Puts sqlite in WAL mode, so that the views can read while a loader is writing.
+    '''
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
 
 
 class OperatingProceduresConfig(AppConfig):
@@ -7,3 +16,6 @@ class OperatingProceduresConfig(AppConfig):
     #name = 'op'
     label = 'opp'
     verbose_name = 'opp_verbose'
+
+    def ready(self):
+        connection_created.connect(set_journal_mode)
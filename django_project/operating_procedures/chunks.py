@@ -268,7 +268,7 @@ def make_chunk(parent_item, annotation, text_chunks, def_as_link=False):
                       note=parent_item.get_note(annotation.info),
                       term=text_chunks)]
     if annotation.type == 'definition':
-        def_item = models.Item.objects.get(id=int(annotation.info))
+        def_item = annotation.get_definition()
         if def_as_link:
             return [chunk('definition_link', term=text_chunks,
                           link=reverse('cite', args=[def_item.citation]))]
@@ -384,10 +384,11 @@ def chunk_paragraph(paragraph, wordrefs=(), def_as_link=False):
                  body_order=paragraph.body_order)
 
 
-def chunk_table(table, def_as_link=False):
+def chunk_table(table, def_as_link=False, wordrefs=()):
     ans = chunk('table', has_header=table.has_header, rows=[], body_order=table.body_order)
     for row, cells in groupby(table.tablecell_set.all(), key=attrgetter('row')):
-        ans.rows.append(list(map(methodcaller('get_blocks', def_as_link=def_as_link),
+        ans.rows.append(list(map(methodcaller('get_blocks', def_as_link=def_as_link,
+                                              wordrefs=wordrefs),
                                  cells)))
     return ans
 
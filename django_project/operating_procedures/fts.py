@@ -0,0 +1,203 @@
+# fts.py
+
+r'''An optional search backend using an SQLite FTS5 table per Version.
+
+load_words fills opp_fts_<version> with the text of every paragraph in the version
+(including the paragraphs in table cells), when the database is SQLite with FTS5 (see
+write_table).  When Enabled is set (OPP_FTS = True in settings), search gets the
+matches for each query.Term with an FTS5 MATCH (see get_matches) rather than from
+segments.get_occurrences.
+
+Each word of a Term is expanded to its synonyms (from Synonym) in the MATCH:
+
+    unit               -- ("unit" OR "dwelling")
+    "common elements"  -- ("common elements" OR "common element")
+    unit NEAR/3 owner  -- (("unit" AND "owner") OR ("dwelling" AND "owner"))
+
+FTS5 doesn't know about sentences, so a phrase may match across the end of a sentence
+where the index wouldn't.  The words matched are found with highlight(), and turned
+into occurrences (see postings) so that they feed the existing ranking and
+search_highlight chunking.  These occurrences have a sentence_number of 0, and number
+the words matched in each paragraph from 1.
+
+FTS5's NEAR counts every token between the words (numbers, and the words that
+load_words skips, like "a"), across sentences, so its distances aren't query.Near's.
+So a NEAR only uses the MATCH to find the paragraphs with both words.  Their text is
+then tokenized by load_words.get_tokens, and matched by query.Near.match, just as the
+index is.
+
+As with the index, the paragraphs in table cells are searched too.
+'''
+
+from itertools import product
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from operating_procedures import models, query, synonym_map
+from operating_procedures.scripts import load_words
+
+
+Enabled = getattr(settings, 'OPP_FTS', False)
+
+Fts5 = None      # does SQLite have FTS5 compiled in?  (see available)
+
+Tables = set()   # versions known to have an FTS5 table
+
+Start_mark = '\x02'
+End_mark = '\x03'
+
+mark_re = re.compile(f'{Start_mark}([^{End_mark}]*){End_mark}')
+
+word_re = re.compile(r'\w+')
+
+
+def table_name(version):
+    return f"opp_fts_{version}"
+
+def available():
+    r'''Is the database SQLite, with FTS5 compiled in?
+    '''
+    global Fts5
+    if connection.vendor != 'sqlite':
+        return False
+    if Fts5 is None:
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA compile_options")
+            Fts5 = any(option == 'ENABLE_FTS5' for option, in cursor.fetchall())
+    return Fts5
+
+def has_table(version):
+    if version not in Tables and available():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                           [table_name(version)])
+            if cursor.fetchone() is not None:
+                Tables.add(version)
+    return version in Tables
+
+
+def write_table(version):
+    r'''(Re)creates the FTS5 table for version.  Returns the number of paragraphs in it.
+    '''
+    table = table_name(version)
+    paragraphs = models.Paragraph.objects \
+                   .filter(Q(item__version_id=version)
+                           | Q(cell__table__item__version_id=version)) \
+                   .values_list('text', 'id', 'item_id')
+    sql, params = paragraphs.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(f"CREATE VIRTUAL TABLE {table} "
+                        "USING fts5(text, paragraph_id UNINDEXED, item_id UNINDEXED, "
+                        "           tokenize='unicode61 remove_diacritics 0')")
+        cursor.execute(f"INSERT INTO {table} (text, paragraph_id, item_id) {sql}", params)
+        return cursor.rowcount
+
+
+def quote(text):
+    return '"' + text.replace('"', '""') + '"'
+
+def match_expression(term, synonyms):
+    r'''Returns the FTS5 MATCH expression for term.
+
+    synonyms is, for each of the words in term, the list of the texts of its synonyms.
+
+        >>> match_expression(query.parse_term('unit'), [['unit', 'dwelling']])
+        '("unit" OR "dwelling")'
+        >>> match_expression(query.parse_term('"common elements"'),
+        ...                  [['common'], ['elements', 'element']])
+        '("common elements" OR "common element")'
+        >>> match_expression(query.parse_term('unit near/3 owner'),
+        ...                  [['unit', 'dwelling'], ['owner']])
+        '(("unit" AND "owner") OR ("dwelling" AND "owner"))'
+    '''
+    if isinstance(term, query.Near):
+        # only finds the paragraphs to look in, see near_matches
+        return '(' + ' OR '.join(f"({quote(a)} AND {quote(b)})"
+                                 for a, b in product(*synonyms)) + ')'
+    return '(' + ' OR '.join(quote(' '.join(words)) for words in product(*synonyms)) + ')'
+
+
+def highlights(text):
+    r'''Returns [(word, char_offset, length)] for the words marked in text (from
+    highlight()).  The char_offsets are in the text without the marks.
+
+    highlight() marks a phrase as a whole, so this splits it into words.
+
+        >>> highlights(f'The {Start_mark}unit{End_mark} {Start_mark}owners{End_mark} vote.')
+        [('unit', 4, 4), ('owners', 9, 6)]
+        >>> highlights(f'Of the {Start_mark}common  elements{End_mark}.')
+        [('common', 7, 6), ('elements', 15, 8)]
+    '''
+    ans = []
+    removed = 0
+    for m in mark_re.finditer(text):
+        start = m.start() - removed
+        for w in word_re.finditer(m.group(1)):
+            ans.append((w.group(), start + w.start(), len(w.group())))
+        removed += len(Start_mark) + len(End_mark)
+    return ans
+
+
+def synonym_texts(terms):
+    r'''Returns, for each of terms, [{text: word_id}] of the synonyms of each of its words
+    (from Term.synonyms).
+    '''
+    words_map = synonym_map.get_map()
+    return [[{words_map.text(id): id for id in sorted(synonyms)} for synonyms in term.synonyms]
+            for term in terms]
+
+def near_matches(term, synonyms, paragraphs):
+    r'''Returns the sorted [(word_id, occurrence)] matched by term, a query.Near, in
+    paragraphs, [(paragraph_id, text)].
+
+    synonyms is, for each of the words in term, {text: word_id} of its synonyms.
+
+        >>> near_matches(query.parse_term('unit near/2 owner'),
+        ...              [{'unit': 1}, {'owner': 2, 'owners': 3}],
+        ...              [(10, 'The owners of a unit.  The unit is 1 of 2 or 3 owners.')])
+        [(3, (10, 1, 2, 4, 6)), (1, (10, 1, 4, 16, 4))]
+    '''
+    ans = []
+    for paragraph_id, text in paragraphs:
+        occurrences = [[] for _ in synonyms]
+        for sentence_number, word_number, char_offset, w in load_words.get_tokens(text):
+            for word_occurrences, word_synonyms in zip(occurrences, synonyms):
+                word_id = word_synonyms.get(w.lower())
+                if word_id is not None:
+                    word_occurrences.append((word_id, (paragraph_id, sentence_number,
+                                                       word_number, char_offset, len(w))))
+        ans.extend(term.match(occurrences))
+    return sorted(ans, key=lambda x: x[1])
+
+def get_matches(version, term, synonyms):
+    r'''Returns the sorted [(word_id, occurrence)] of the words matched by term in the
+    paragraphs (in items and table cells) of version.
+
+    synonyms is, for each of the words in term, {text: word_id} of its synonyms (see
+    synonym_texts).
+    '''
+    expression = match_expression(term, [list(s) for s in synonyms])
+    if isinstance(term, query.Near):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT paragraph_id, text FROM {table_name(version)} "
+                           f" WHERE {table_name(version)} MATCH %s",
+                           [expression])
+            return near_matches(term, synonyms, cursor.fetchall())
+    word_ids = {}
+    for word_synonyms in synonyms:
+        word_ids.update(word_synonyms)
+    ans = []
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT paragraph_id, highlight({table_name(version)}, 0, %s, %s) "
+                       f"  FROM {table_name(version)} "
+                       f" WHERE {table_name(version)} MATCH %s",
+                       [Start_mark, End_mark, expression])
+        for paragraph_id, text in cursor.fetchall():
+            for word_number, (word, char_offset, length) in enumerate(highlights(text), 1):
+                ans.append((word_ids.get(word.lower()),
+                            (paragraph_id, 0, word_number, char_offset, length)))
+    return sorted(ans, key=lambda x: x[1])
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opp', '0002_item_source_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='version',
+            name='state',
+            field=models.CharField(choices=[('building', 'Building'), ('indexed', 'Indexed'), ('published', 'Published')], default='building', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='Checkpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('citation', models.CharField(max_length=20)),
+                ('body_order', models.PositiveSmallIntegerField()),
+                ('item_order', models.PositiveIntegerField()),
+                ('version', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='opp.version')),
+            ],
+        ),
+    ]
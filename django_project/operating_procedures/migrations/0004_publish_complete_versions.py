@@ -0,0 +1,22 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:26
+
+from django.db import migrations
+
+
+def publish_complete_versions(apps, schema_editor):
+    r'''The versions from before Version.state were all in use, unless their scrape is
+    still to be resumed from a Checkpoint.
+    '''
+    Version = apps.get_model('opp', 'Version')
+    Version.objects.filter(checkpoint__isnull=True).update(state='published')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opp', '0003_checkpoint_version_state'),
+    ]
+
+    operations = [
+        migrations.RunPython(publish_complete_versions, migrations.RunPython.noop),
+    ]
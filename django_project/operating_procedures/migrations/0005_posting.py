@@ -0,0 +1,116 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:27
+
+from array import array
+from itertools import accumulate
+import struct
+import sys
+
+from django.db import migrations, models
+from django.db.models import Q
+import django.db.models.deletion
+
+
+Fields = 'word_id', 'paragraph_id', 'sentence_number', 'word_number', 'char_offset', 'length'
+
+# The posting format as of this migration (see postings.py), copied here so that later
+# changes to postings.py don't change what this migration does.
+Typecodes = 'B', 'H', 'I', 'Q'
+
+Header = struct.Struct('<I5s')
+
+
+def narrowest(values):
+    top = max(values, default=0)
+    for typecode in Typecodes:
+        if top < 1 << (8 * array(typecode).itemsize):
+            return array(typecode, values)
+    raise ValueError(f"narrowest: {top} too big")
+
+
+def pack(occurrences):
+    columns = [list(column) for column in zip(*occurrences)] or [[] for _ in Fields[1:]]
+    paragraph_ids = columns[0]
+    columns[0] = [b - a for a, b in zip([0] + paragraph_ids, paragraph_ids)]
+    arrays = [narrowest(column) for column in columns]
+    header = Header.pack(len(occurrences),
+                         ''.join(a.typecode for a in arrays).encode('ascii'))
+    if sys.byteorder == 'big':
+        for a in arrays:
+            a.byteswap()
+    return header + b''.join(a.tobytes() for a in arrays)
+
+
+def unpack(data):
+    count, typecodes = Header.unpack_from(data)
+    arrays = []
+    start = Header.size
+    for typecode in typecodes.decode('ascii'):
+        a = array(typecode)
+        end = start + count * a.itemsize
+        a.frombytes(data[start: end])
+        if sys.byteorder == 'big':
+            a.byteswap()
+        arrays.append(a)
+        start = end
+    arrays[0] = accumulate(arrays[0])
+    return list(zip(*arrays))
+
+
+def pack_wordrefs(apps, schema_editor):
+    r'''Packs the WordRefs of each version into a Posting per word, and deletes them.
+    '''
+    Version = apps.get_model('opp', 'Version')
+    WordRef = apps.get_model('opp', 'WordRef')
+    Posting = apps.get_model('opp', 'Posting')
+    for version in Version.objects.all():
+        occurrences = {}  # {word_id: [occurrence]}
+        for wordref in WordRef.objects \
+                         .filter(Q(paragraph__item__version=version)
+                                 | Q(paragraph__cell__table__item__version=version)) \
+                         .order_by('paragraph_id', 'sentence_number', 'word_number') \
+                         .values_list(*Fields) \
+                         .iterator(chunk_size=10000):
+            occurrences.setdefault(wordref[0], []).append(wordref[1:])
+        Posting.objects.bulk_create(
+          [Posting(version=version, word_id=word_id, count=len(word_occurrences),
+                   occurrences=pack(word_occurrences))
+           for word_id, word_occurrences in occurrences.items()],
+          batch_size=500)
+    WordRef.objects.all().delete()
+
+
+def unpack_postings(apps, schema_editor):
+    r'''Stores a WordRef for each occurrence in the Postings.
+    '''
+    WordRef = apps.get_model('opp', 'WordRef')
+    Posting = apps.get_model('opp', 'Posting')
+    for posting in Posting.objects.iterator(chunk_size=1000):
+        WordRef.objects.bulk_create(
+          [WordRef(**dict(zip(Fields, (posting.word_id,) + occurrence)))
+           for occurrence in unpack(posting.occurrences)],
+          batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opp', '0004_publish_complete_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Posting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField()),
+                ('occurrences', models.BinaryField()),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='opp.version')),
+                ('word', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='opp.word')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='posting',
+            constraint=models.UniqueConstraint(fields=('version', 'word'), name='unique_posting'),
+        ),
+        migrations.RunPython(pack_wordrefs, unpack_postings),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:33
+
+from array import array
+from collections import Counter
+from itertools import accumulate
+import struct
+import sys
+
+from django.db import migrations, models
+
+
+# The posting format as of this migration (see postings.py), copied here so that later
+# changes to postings.py don't change what this migration does.
+Header = struct.Struct('<I5s')
+
+
+def paragraph_ids(data):
+    r'''Returns the paragraph_ids of the occurrences packed in data.
+    '''
+    count, typecodes = Header.unpack_from(data)
+    a = array(typecodes.decode('ascii')[0])
+    a.frombytes(data[Header.size: Header.size + count * a.itemsize])
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return accumulate(a)
+
+
+def count_words(apps, schema_editor):
+    r'''Sets Paragraph.num_words from the Postings, as load_words does.
+    '''
+    Paragraph = apps.get_model('opp', 'Paragraph')
+    Posting = apps.get_model('opp', 'Posting')
+    counts = Counter()
+    for occurrences in Posting.objects.values_list('occurrences', flat=True) \
+                                      .iterator(chunk_size=1000):
+        counts.update(paragraph_ids(occurrences))
+    Paragraph.objects.update(num_words=0)
+    paragraphs = list(Paragraph.objects.filter(id__in=counts).only('id'))
+    for paragraph in paragraphs:
+        paragraph.num_words = counts[paragraph.id]
+    Paragraph.objects.bulk_update(paragraphs, ['num_words'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opp', '0005_posting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paragraph',
+            name='num_words',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(count_words, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:35
+
+from itertools import permutations
+
+from django.db import migrations, models
+
+
+def group_synonyms(apps, schema_editor):
+    r'''Sets the Word.synonym_group of each Word with Synonyms to the smallest Word.id
+    in its group (a union-find over the Synonym rows).
+    '''
+    Word = apps.get_model('opp', 'Word')
+    Synonym = apps.get_model('opp', 'Synonym')
+    parents = {}  # {word_id: parent word_id}, the roots are their own parent
+    def find(word_id):
+        root = parents.setdefault(word_id, word_id)
+        while root != parents[root]:
+            root = parents[root]
+        while word_id != root:
+            parents[word_id], word_id = root, parents[word_id]
+        return root
+    for word_id, synonym_id in Synonym.objects.values_list('word_id', 'synonym_id') \
+                                              .iterator(chunk_size=10000):
+        a, b = sorted((find(word_id), find(synonym_id)))
+        parents[b] = a
+    groups = {word_id: find(word_id) for word_id in parents}
+    words = list(Word.objects.filter(id__in=groups))
+    for word in words:
+        word.synonym_group = groups[word.id]
+    Word.objects.bulk_update(words, ['synonym_group'], batch_size=500)
+
+
+def ungroup_synonyms(apps, schema_editor):
+    r'''Stores a Synonym for each pair of Words in the same synonym_group.
+    '''
+    Word = apps.get_model('opp', 'Word')
+    Synonym = apps.get_model('opp', 'Synonym')
+    groups = {}  # {synonym_group: [word_id]}
+    for word_id, synonym_group in Word.objects.filter(synonym_group__isnull=False) \
+                                              .values_list('id', 'synonym_group'):
+        groups.setdefault(synonym_group, []).append(word_id)
+    Synonym.objects.bulk_create(
+      [Synonym(word_id=word_id, synonym_id=synonym_id)
+       for word_ids in groups.values()
+       for word_id, synonym_id in permutations(word_ids, 2)],
+      batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opp', '0006_paragraph_num_words'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='word',
+            name='synonym_group',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='word',
+            index=models.Index(fields=['synonym_group'], name='opp_word_synonym_66074a_idx'),
+        ),
+        migrations.RunPython(group_synonyms, ungroup_synonyms),
+        migrations.RemoveConstraint(
+            model_name='synonym',
+            name='unique_synonym',
+        ),
+        migrations.RemoveField(
+            model_name='synonym',
+            name='synonym',
+        ),
+        migrations.RemoveField(
+            model_name='synonym',
+            name='word',
+        ),
+        migrations.DeleteModel(
+            name='Synonym',
+        ),
+    ]
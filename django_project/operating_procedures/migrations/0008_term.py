@@ -0,0 +1,30 @@
+# Generated by Django 4.1.13 on 2026-10-18 01:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opp', '0007_word_synonym_group'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Term',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_citation', models.CharField(blank=True, max_length=20, null=True)),
+                ('text', models.CharField(max_length=200)),
+                ('synonym_ids', models.TextField()),
+                ('definition', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='opp.item')),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='opp.version')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='annotation',
+            name='term',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='opp.term'),
+        ),
+    ]
@@ -1,12 +1,14 @@
-from django.db import models
+from django.db import models, transaction
 
 # Create your models here.
 
-from itertools import chain, product
-from operator import attrgetter, methodcaller
+from itertools import chain
+from operator import attrgetter, itemgetter
 
 from django.db.models import Q
+from django.db.models.functions import Coalesce
 
+from operating_procedures import postings
 from operating_procedures.chunks import (
     chunkify_text, chunk_item, chunkify_item_body, chunk_paragraph, chunk_table
 )
@@ -17,13 +19,43 @@ class Version(models.Model):
     source = models.CharField(max_length=30)
     url = models.CharField(max_length=300, null=True, blank=True)
     wordrefs_loaded = models.BooleanField(default=False)
+    # load_definitions has annotated the terms defined in this version (of 719 or 61B);
+    # scripts/publish.py warns about publishing one that it hasn't
     definitions_loaded = models.BooleanField(default=False)
 
+    # building  -- being scraped (while it has a Checkpoint), and then indexed
+    # indexed   -- load_words has been run on it
+    # published -- shown by the views (see latest and scripts/publish.py)
+    state = models.CharField(max_length=10, default='building',
+                             choices=[('building', 'Building'), ('indexed', 'Indexed'),
+                                      ('published', 'Published')])
+
     @classmethod
-    def latest(cls, source):
-        r'''Returns id of latest version of source.
+    def latest(cls, source, published=True):
+        r'''Returns id of latest published version of source.
+
+        With published=False, returns id of latest version of source that has finished
+        scraping, whatever its state.  This is the version that the loaders work on.
+
+        Raises Version.DoesNotExist if there isn't one.
         '''
-        return cls.objects.filter(source=source).order_by('-upload_date', '-id')[0].id
+        versions = cls.objects.filter(source=source, checkpoint__isnull=True)
+        if published:
+            versions = versions.filter(state='published')
+        version = versions.order_by('-upload_date', '-id').values_list('id', flat=True) \
+                          .first()
+        if version is None:
+            raise cls.DoesNotExist(
+                    f"no {'published' if published else 'finished'} version of {source}")
+        return version
+
+    def publish(self):
+        r'''Makes this the version shown by the views.
+
+        This is one UPDATE, so readers see either the old version or this one.
+        '''
+        self.state = 'published'
+        self.save(update_fields=['state'])
 
     def as_str(self):
         return f"<Version({self.id}) {self.upload_date=}>"
@@ -32,6 +64,68 @@ class Version(models.Model):
         return self.as_str()
 
 
+class Checkpoint(models.Model):
+    r'''The progress of a scrape that hasn't finished yet, so that it can be resumed.
+
+    Everything up to and including the body_order child of the Item with citation has
+    been written.  Body_order 0 means that the Item itself hasn't been written yet.  An
+    empty citation means that nothing has been written yet.  Item_order is the item_order
+    for the next Item.
+    '''
+    version = models.OneToOneField(Version, on_delete=models.CASCADE)
+    citation = models.CharField(max_length=20)
+    body_order = models.PositiveSmallIntegerField()
+    item_order = models.PositiveIntegerField()
+
+    @classmethod
+    def new_version(cls, source, url=None):
+        r'''Creates a new Version of source, with a Checkpoint at its beginning.
+        '''
+        with transaction.atomic():
+            version = Version.objects.create(source=source, url=url)
+            cls.objects.create(version=version, citation='', body_order=0, item_order=1)
+        return version
+
+    @classmethod
+    def save_progress(cls, writer, version, citation, body_order, item_order):
+        r'''Writes everything pending in writer, along with the new Checkpoint.
+        '''
+        with transaction.atomic():
+            writer.flush()
+            cls.objects.update_or_create(
+              version=version,
+              defaults=dict(citation=citation, body_order=body_order, item_order=item_order))
+
+    @classmethod
+    def finish(cls, writer, version):
+        r'''Writes everything pending in writer, and deletes the Checkpoint for version.
+        '''
+        with transaction.atomic():
+            writer.flush()
+            cls.objects.filter(version=version).delete()
+
+    @classmethod
+    def resume(cls, source):
+        r'''Returns the Checkpoint of the latest version of source that didn't finish
+        scraping, or None.
+
+        An empty citation means to start from the beginning.
+
+        Deletes all of the Items (and everything under them) written after the
+        Checkpoint, since a Bulk_writer writes whenever its batch fills up.
+        '''
+        checkpoint = cls.objects.filter(version__source=source) \
+                                .select_related('version').order_by('-version_id').first()
+        if checkpoint is not None:
+            Item.objects.filter(version=checkpoint.version,
+                                item_order__gte=checkpoint.item_order).delete()
+        return checkpoint
+
+    def __repr__(self):
+        return f"<Checkpoint {self.version_id=} {self.citation=} {self.body_order=} " \
+               f"{self.item_order=}>"
+
+
 class Item(models.Model):
     version = models.ForeignKey(Version, on_delete=models.CASCADE)
     citation = models.CharField(max_length=20)
@@ -42,6 +136,8 @@ class Item(models.Model):
     num_elements = models.PositiveSmallIntegerField() # not including title
     # title is in Paragraph that points back to this Item with body_order == 0
     has_title = models.BooleanField(default=False)
+    # sha256 of the raw html for section Items, used by incremental scrapes
+    source_hash = models.CharField(max_length=64, null=True, blank=True)
     #authority = models.CharField(max_length=200, null=True, blank=True)
     #law_implemented = models.CharField(max_length=200, null=True, blank=True)
     #history = models.CharField(max_length=200, null=True, blank=True)
@@ -56,6 +152,8 @@ class Item(models.Model):
         r'''Returns the Paragraph object.
         '''
         if self.has_title:
+            if hasattr(self, 'title_paragraphs'):   # set by preload
+                return self.title_paragraphs[0]
             return self.paragraph_set.get(body_order=0)
         return None
 
@@ -64,7 +162,9 @@ class Item(models.Model):
 
         Important!  Caller must sort by body_order.
         '''
-        return chain(self.paragraph_set.exclude(body_order=0).all(),
+        # filtered here, rather than in the query, to use the paragraphs loaded by preload
+        return chain((paragraph for paragraph in self.paragraph_set.all()
+                                if paragraph.body_order),
                      self.table_set.all(),
                      self.item_set.all())
 
@@ -74,14 +174,19 @@ class Item(models.Model):
         i = self
         while True:
             print(f"{i.citation} looking for {number=!r}")
-            try:
-                anno = Annotation.objects.get(paragraph__item=i, type='note',
-                                              info=str(number))
-                return anno.paragraph.text
-            except Annotation.DoesNotExist:
-                if i.parent is None:
-                    raise Annotation.DoesNotExist(f"note {number=} in {self.citation}")
-                i = i.parent
+            if hasattr(i, 'notes'):                 # set by preload
+                if str(number) in i.notes:
+                    return i.notes[str(number)]
+            else:
+                try:
+                    anno = Annotation.objects.get(paragraph__item=i, type='note',
+                                                  info=str(number))
+                    return anno.paragraph.text
+                except Annotation.DoesNotExist:
+                    pass
+            if i.parent is None:
+                raise Annotation.DoesNotExist(f"note {number=} in {self.citation}")
+            i = i.parent
 
     def get_block(self, with_body=True, def_as_link=False, with_references=False, top=False,
                         alone=False):
@@ -104,6 +209,7 @@ class Paragraph(models.Model):
     cell = models.ForeignKey('TableCell', on_delete=models.CASCADE, null=True, blank=True)
     body_order = models.PositiveSmallIntegerField()  # 0 for Item title
     text = models.CharField(max_length=4000)
+    num_words = models.PositiveIntegerField(null=True, blank=True)  # set by load_words
 
     def as_str(self):
         if self.item_id is not None:
@@ -113,6 +219,16 @@ class Paragraph(models.Model):
     def __repr__(self):
         return self.as_str()
 
+    @classmethod
+    def in_version(cls, version_id):
+        r'''Returns [(paragraph_id, item_id, num_words)] for all of the paragraphs in
+        version_id.  For a paragraph in a table cell, item_id is the Item holding the table.
+        '''
+        return cls.objects.filter(Q(item__version_id=version_id)
+                                  | Q(cell__table__item__version_id=version_id)) \
+                          .values_list('id', Coalesce('item_id', 'cell__table__item_id'),
+                                       'num_words')
+
     def parent_item(self):
         r'''Returns the item directly containing this paragraph.
         '''
@@ -143,6 +259,28 @@ class Paragraph(models.Model):
         ]
 
 
+class Term(models.Model):
+    r'''A term defined in a version, by load_definitions.
+
+    The 'definition' Annotations where the term is used point back to it, so that
+    load_definitions can tell which Annotations to keep when only some of the terms
+    change (see scripts/load_definitions.py).
+    '''
+    version = models.ForeignKey(Version, on_delete=models.CASCADE)
+    definition = models.ForeignKey(Item, on_delete=models.CASCADE)
+    # only annotate the items whose citation starts with this
+    base_citation = models.CharField(max_length=20, null=True, blank=True)
+    text = models.CharField(max_length=200)    # the words of the term, lowercase
+    # the synonym Word.ids of each of the words, when the term was loaded: the words
+    # separated by ' ', and the ids of each word by ','
+    synonym_ids = models.TextField()
+
+    def as_str(self):
+        return f"<Term({self.id}) {self.text!r} definition={self.definition_id}>"
+
+    def __repr__(self):
+        return self.as_str()
+
 class Annotation(models.Model):
     paragraph = models.ForeignKey(Paragraph, on_delete=models.CASCADE)
 
@@ -176,6 +314,8 @@ class Annotation(models.Model):
     char_offset = models.PositiveSmallIntegerField()
     length = models.PositiveSmallIntegerField()
     info = models.CharField(max_length=20, null=True, blank=True)
+    # the Term matched, for 'definition' Annotations
+    term = models.ForeignKey(Term, on_delete=models.CASCADE, null=True, blank=True)
 
     def as_str(self):
         return f"<Annotation({self.id}) {self.type} " \
@@ -184,6 +324,13 @@ class Annotation(models.Model):
     def __repr__(self):
         return self.as_str()
 
+    def get_definition(self):
+        r'''Returns the Item defining the term, for a 'definition' Annotation.
+        '''
+        if self._meta.get_field('term').is_cached(self):   # loaded by preload
+            return self.term.definition
+        return Item.objects.get(id=int(self.info))
+
     @classmethod
     def get_references(cls, citation, versions, top=False):
         r'''Returns sorted list of citations referencing `citation`.
@@ -229,8 +376,13 @@ class Table(models.Model):
     def __repr__(self):
         return self.as_str()
 
-    def get_block(self, def_as_link=False, with_references=False):
-        return chunk_table(self, def_as_link)
+    def parent_item(self):
+        r'''Returns the item directly containing this table.
+        '''
+        return self.item
+
+    def get_block(self, def_as_link=False, with_references=False, wordrefs=()):
+        return chunk_table(self, def_as_link, wordrefs)
 
     class Meta:
         ordering = ['body_order']
@@ -250,9 +402,13 @@ class TableCell(models.Model):
     def __repr__(self):
         return self.as_str()
 
-    def get_blocks(self, def_as_link=False):
-        return list(map(methodcaller('get_block', def_as_link=def_as_link),
-                        self.paragraph_set.all()))
+    def get_blocks(self, def_as_link=False, wordrefs=()):
+        r'''Wordrefs are the WordRefs to highlight, for any of the paragraphs in the table.
+        '''
+        return [paragraph.get_block(wordrefs=[wordref for wordref in wordrefs
+                                              if wordref.paragraph_id == paragraph.id],
+                                    def_as_link=def_as_link)
+                for paragraph in self.paragraph_set.all()]
 
     class Meta:
         ordering = ['row', 'col']
@@ -263,6 +419,9 @@ class TableCell(models.Model):
 
 class Word(models.Model):
     text = models.CharField(max_length=50, unique=True)  # always all lowercase
+    # Word.id of the first word in its group of synonyms (see Synonym_groups), or None
+    # if it has no synonyms
+    synonym_group = models.PositiveIntegerField(null=True, blank=True)
 
     def as_str(self):
         return f"<Word({self.id}) {self.text}>"
@@ -287,44 +446,92 @@ class Word(models.Model):
     def get_synonyms(self):
         r'''Returns a set of Word.ids (including self.id).
         '''
-        return Synonym.get_synonyms(self.id)
+        if self.synonym_group is None:
+            return {self.id}
+        return set(Word.objects.filter(synonym_group=self.synonym_group)
+                               .values_list('id', flat=True))
 
     class Meta:
         indexes = [
             models.Index(fields=['text']),
+            models.Index(fields=['synonym_group']),
         ]
 
-class Synonym(models.Model):
-    word = models.ForeignKey(Word, on_delete=models.CASCADE)
-    synonym = models.ForeignKey(Word, on_delete=models.CASCADE, related_name='+')
-
-    @classmethod
-    def get_synonyms(cls, word_id):
-        ans = set(map(attrgetter('synonym_id'),
-                      cls.objects.filter(word_id=word_id).all()))
-        ans.add(word_id)
-        return ans
+class Synonym_groups:
+    r'''The groups of synonyms, as a union-find over Word.ids.
+
+    Each group is named by its smallest Word.id, which is stored in the
+    Word.synonym_group of each word in the group.  So a group of n words is n Words,
+    rather than n*n Synonyms.
+
+        >>> groups = Synonym_groups([(7, 7), (9, 7)])
+        >>> groups.add_synonym(3, 4), groups.add_synonym(4, 9), groups.add_synonym(5, 6)
+        (True, True, True)
+        >>> groups.add_synonym(9, 3)
+        False
+        >>> sorted(groups.changes().items())
+        [(3, 3), (4, 3), (5, 5), (6, 5), (7, 3), (9, 3)]
+    '''
+    def __init__(self, word_groups=()):
+        r'''word_groups is (word_id, synonym_group) of the Words already in groups.
+        '''
+        self.parents = {}     # {word_id: parent word_id}, the roots are their own parent
+        self.original = {}    # {word_id: synonym_group} from word_groups
+        for word_id, synonym_group in word_groups:
+            self.original[word_id] = synonym_group
+            self.add_synonym(word_id, synonym_group)
+
+    def find(self, word_id):
+        root = self.parents.setdefault(word_id, word_id)
+        while root != self.parents[root]:
+            root = self.parents[root]
+        # path compression
+        while word_id != root:
+            self.parents[word_id], word_id = root, self.parents[word_id]
+        return root
+
+    def add_synonym(self, word_id, synonym_id):
+        r'''Merges their groups.  Returns False if they were already in the same group.
+        '''
+        a = self.find(word_id)
+        b = self.find(synonym_id)
+        if a == b:
+            return False
+        # the smaller id is the root, so it names the group
+        if b < a:
+            a, b = b, a
+        self.parents[b] = a
+        return True
+
+    def changes(self):
+        r'''Returns {word_id: synonym_group} of the Words whose synonym_group has changed.
+        '''
+        return {word_id: self.find(word_id)
+                for word_id in self.parents
+                if self.original.get(word_id) != self.find(word_id)}
 
     @classmethod
-    def add_synonym(cls, word_id, synonym_id):
-        if cls.objects.filter(word_id=word_id, synonym_id=synonym_id).exists():
-            raise AssertionError(
-                    f"add_synonym: duplicate {Word.objects.get(id=word_id).text} "
-                    f"{Word.objects.get(id=synonym_id).text}")
-        cls.objects.bulk_create(
-            chain.from_iterable(
-              (cls(word_id=w, synonym_id=s),
-               cls(word_id=s, synonym_id=w))
-              for w, s in product(cls.get_synonyms(word_id),
-                                  cls.get_synonyms(synonym_id))))
+    def from_db(cls):
+        return cls(Word.objects.filter(synonym_group__isnull=False)
+                               .values_list('id', 'synonym_group'))
 
-    class Meta:
-        constraints = [
-            models.UniqueConstraint(fields=['word', 'synonym'],
-                                    name='unique_synonym'),
-        ]
+    def save(self):
+        r'''Stores the changed synonym_groups in the Words.  Returns the number changed.
+        '''
+        changes = self.changes()
+        words = list(Word.objects.filter(id__in=changes))
+        for word in words:
+            word.synonym_group = changes[word.id]
+        Word.objects.bulk_update(words, ['synonym_group'], batch_size=500)
+        return len(words)
 
 class WordRef(models.Model):
+    r'''An occurrence of word in paragraph.
+
+    These aren't stored, the occurrences are stored in the Postings (see load_words).
+    Search makes them from the Postings for the paragraphs it shows, to highlight the
+    words found.
+    '''
     type = 'search_highlight'  # word_group_index inserted as 'info' to make this
                                # look like an annotation with type 'search_highlight'.
     paragraph = models.ForeignKey(Paragraph, on_delete=models.CASCADE)
@@ -355,3 +562,84 @@ class WordRef(models.Model):
                                     name='unique_wordref'),
         ]
 
+
+class Posting(models.Model):
+    r'''All of the occurrences of word in version, packed by postings.pack.
+
+    These are what load_words stores for searching, rather than a WordRef per occurrence.
+    '''
+    version = models.ForeignKey(Version, on_delete=models.CASCADE)
+    word = models.ForeignKey(Word, on_delete=models.CASCADE)
+    count = models.PositiveIntegerField()   # number of occurrences
+    occurrences = models.BinaryField()
+
+    def as_str(self):
+        return f"<Posting({self.id}) {self.version_id=} {self.word_id=} {self.count=}>"
+
+    def __repr__(self):
+        return self.as_str()
+
+    @classmethod
+    def pack(cls, version_id, word_id, occurrences):
+        r'''Returns a new (unsaved) Posting for the sorted list of occurrences:
+        (paragraph_id, sentence_number, word_number, char_offset, length).
+        '''
+        return cls(version_id=version_id, word_id=word_id, count=len(occurrences),
+                   occurrences=postings.pack(occurrences))
+
+    def unpack(self):
+        r'''Returns the list of occurrences.
+        '''
+        return postings.unpack(self.occurrences)
+
+    @classmethod
+    def get_wordrefs(cls, version_id, word_ids):
+        r'''Returns [(paragraph, [WordRef])] for the paragraphs (in items and table cells)
+        of version that have any of word_ids, sorted by paragraph id.
+
+        The WordRefs are made from the Postings, and aren't saved.
+        '''
+        return cls.make_wordrefs(cls.get_occurrences(version_id, word_ids))
+
+    @classmethod
+    def get_occurrences(cls, version_id, word_ids):
+        r'''Returns [(word_id, occurrence)] for word_ids in version.
+        '''
+        return [(posting.word_id, occurrence)
+                for posting in cls.objects.filter(version_id=version_id, word_id__in=word_ids)
+                for occurrence in posting.unpack()]
+
+    @staticmethod
+    def make_wordrefs(occurrences, paragraphs=None):
+        r'''Returns [(paragraph, [WordRef])] for occurrences, an iterable of
+        (word_id, occurrence), sorted by paragraph id.
+
+        The WordRefs aren't saved.  paragraphs is {paragraph_id: Paragraph} already loaded
+        (see preload), else the Paragraphs are queried.
+        '''
+        by_paragraph = {}  # {paragraph_id: [(word_id, occurrence)]}
+        for word_id, occurrence in occurrences:
+            by_paragraph.setdefault(occurrence[0], []).append((word_id, occurrence))
+        cache_paragraph = WordRef._meta.get_field('paragraph').set_cached_value
+        if paragraphs is None:
+            paragraphs = {para.id: para
+                          for para in Paragraph.objects.select_related('item',
+                                                                       'cell__table__item')
+                                               .filter(id__in=by_paragraph.keys())}
+        ans = []
+        for paragraph_id in sorted(by_paragraph.keys()):
+            para = paragraphs[paragraph_id]
+            wordrefs = []
+            for word_id, occurrence in sorted(by_paragraph[para.id], key=itemgetter(1)):
+                # WordRef(id, paragraph_id, word_id, sentence_number, word_number,
+                #         char_offset, length)
+                wordref = WordRef(None, occurrence[0], word_id, *occurrence[1:])
+                cache_paragraph(wordref, para)
+                wordrefs.append(wordref)
+            ans.append((para, wordrefs))
+        return ans
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['version', 'word'], name='unique_posting'),
+        ]
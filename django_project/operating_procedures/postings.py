@@ -0,0 +1,85 @@
+# postings.py
+
+r'''Packs the occurrences of a word into a posting list (see models.Posting).
+
+An occurrence is a (paragraph_id, sentence_number, word_number, char_offset, length)
+tuple, like a WordRef.  The occurrences are sorted, and packed column by column:
+
+    header: the number of occurrences (4 bytes), then the array typecode of each column
+    then each column, as an array of unsigned ints of the narrowest typecode that holds it
+
+The paragraph_ids are stored as the difference from the prior paragraph_id, so most of
+them fit in one byte along with the other columns.  An occurrence takes about 6 bytes,
+rather than the ~50 bytes of a WordRef row and its indexes.
+
+Unpacking is array.frombytes and itertools.accumulate, so it runs in C.  All of the
+arrays are stored little-endian.
+'''
+
+from array import array
+from itertools import accumulate
+import struct
+import sys
+
+
+Fields = 'paragraph_id', 'sentence_number', 'word_number', 'char_offset', 'length'
+
+Typecodes = 'B', 'H', 'I', 'Q'   # unsigned, narrowest first
+
+Header = struct.Struct('<I5s')
+
+
+def narrowest(values):
+    r'''Returns the narrowest array of Typecodes that holds values.
+
+        >>> narrowest([1, 255]).typecode, narrowest([1, 256]).typecode
+        ('B', 'H')
+    '''
+    top = max(values, default=0)
+    for typecode in Typecodes:
+        if top < 1 << (8 * array(typecode).itemsize):
+            return array(typecode, values)
+    raise ValueError(f"narrowest: {top} too big")
+
+def pack(occurrences):
+    r'''Returns the bytes for occurrences, a sorted list of
+    (paragraph_id, sentence_number, word_number, char_offset, length).
+
+        >>> data = pack([(1041, 1, 3, 12, 5), (1041, 2, 1, 40, 5), (1307, 1, 7, 51, 6)])
+        >>> len(data)
+        27
+        >>> unpack(data)
+        [(1041, 1, 3, 12, 5), (1041, 2, 1, 40, 5), (1307, 1, 7, 51, 6)]
+    '''
+    columns = [list(column) for column in zip(*occurrences)] or [[] for _ in Fields]
+    paragraph_ids = columns[0]
+    columns[0] = [b - a for a, b in zip([0] + paragraph_ids, paragraph_ids)]
+    arrays = [narrowest(column) for column in columns]
+    header = Header.pack(len(occurrences),
+                         ''.join(a.typecode for a in arrays).encode('ascii'))
+    if sys.byteorder == 'big':
+        for a in arrays:
+            a.byteswap()
+    return header + b''.join(a.tobytes() for a in arrays)
+
+def unpack_columns(data):
+    r'''Returns the columns in data (from pack) as a list of arrays, one per Fields.
+    '''
+    count, typecodes = Header.unpack_from(data)
+    arrays = []
+    start = Header.size
+    for typecode in typecodes.decode('ascii'):
+        a = array(typecode)
+        end = start + count * a.itemsize
+        a.frombytes(data[start: end])
+        if sys.byteorder == 'big':
+            a.byteswap()
+        arrays.append(a)
+        start = end
+    arrays[0] = array('Q', accumulate(arrays[0]))
+    return arrays
+
+def unpack(data):
+    r'''Returns the list of occurrences in data (from pack).
+    '''
+    return list(zip(*unpack_columns(data)))
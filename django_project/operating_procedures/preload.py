@@ -0,0 +1,178 @@
+# preload.py
+
+r'''Loads everything that search shows for a page of results in a bounded number of
+queries.
+
+Showing an item (see chunks.py) follows its parent, title, annotations and notes, and
+the bodies of the definitions used in it.  Done an item at a time that's several queries
+for each item, paragraph and definition on the page.  Instead, search calls load_results,
+which loads all of these for the whole page up front, and leaves them where the models
+look for them:
+
+    Item.parent, Paragraph.item, Paragraph.cell.table, Table.item, the tablecell_set of
+    the tables matched, Paragraph.annotation_set, Annotation.term, Term.definition, and
+    the paragraph_set, table_set and item_set of the definitions (and their sub-items)
+        -- in Django's caches, so these don't do queries
+    Item.title_paragraphs  -- [title Paragraph], for Item.get_title
+    Item.notes             -- {number: text} of the notes in the item, for Item.get_note
+
+The number of queries doesn't depend on the number of results, only on how deep the
+items are nested (the ancestors and sub-items are loaded a level at a time).
+'''
+
+from itertools import chain
+
+from django.db.models import Prefetch, prefetch_related_objects
+
+from operating_procedures import models
+
+
+def load_ancestors(items):
+    r'''Loads the ancestors of items, and caches the parent of each of them.
+
+    Returns a list of items followed by their ancestors.  One query per level of
+    ancestors.
+    '''
+    ans = list(items)
+    by_id = {item.id: item for item in ans}
+    missing = set(item.parent_id for item in ans) - by_id.keys() - {None}
+    while missing:
+        parents = list(models.Item.objects.filter(id__in=missing))
+        ans.extend(parents)
+        by_id.update((parent.id, parent) for parent in parents)
+        missing = set(parent.parent_id for parent in parents) - by_id.keys() - {None}
+    cache_parent = models.Item._meta.get_field('parent').set_cached_value
+    for item in ans:
+        if item.parent_id is not None:
+            cache_parent(item, by_id[item.parent_id])
+    return ans
+
+def load_titles(items):
+    r'''Sets title_paragraphs on items.  One query.
+    '''
+    prefetch_related_objects(items,
+                             Prefetch('paragraph_set',
+                                      queryset=models.Paragraph.objects.filter(body_order=0),
+                                      to_attr='title_paragraphs'))
+
+def load_annotations(paragraphs):
+    r'''Loads the Annotations of paragraphs, with the Term and its definition Item for
+    the 'definition' Annotations.  Three queries.
+
+    All of the Annotations using the same definition share its Item.
+    '''
+    prefetch_related_objects(paragraphs, 'annotation_set__term__definition')
+
+def definitions_in(paragraphs):
+    r'''Returns the definition Items of the 'definition' Annotations in paragraphs.
+
+    The paragraphs must have been passed to load_annotations.
+    '''
+    ans = {}  # {item_id: Item}
+    for paragraph in paragraphs:
+        for annotation in paragraph.annotation_set.all():
+            if annotation.type == 'definition' and annotation.term_id is not None:
+                ans.setdefault(annotation.term.definition_id, annotation.term.definition)
+    return list(ans.values())
+
+def load_bodies(items):
+    r'''Loads the bodies of items, and of all of their sub-items, for chunkify_item_body.
+
+    Returns the sub-items.  About ten queries per level of sub-items.
+    '''
+    sub_items = []
+    level = list(items)
+    while level:
+        prefetch_related_objects(
+          level,
+          'paragraph_set__annotation_set__term__definition',
+          'table_set__tablecell_set__paragraph_set__annotation_set__term__definition',
+          'item_set')
+        for item in level:
+            item.title_paragraphs = [paragraph for paragraph in item.paragraph_set.all()
+                                               if paragraph.body_order == 0]
+        level = list(chain.from_iterable(item.item_set.all() for item in level))
+        sub_items.extend(level)
+    return sub_items
+
+def load_notes(items):
+    r'''Sets notes on items.  One query.
+    '''
+    by_id = {}  # {item_id: [Item]}, there may be more than one Item for the same id
+    for item in items:
+        item.notes = {}
+        by_id.setdefault(item.id, []).append(item)
+    for item_id, number, text \
+     in models.Annotation.objects.filter(type='note', paragraph__item_id__in=by_id.keys()) \
+                                 .values_list('paragraph__item_id', 'info', 'paragraph__text'):
+        for item in by_id[item_id]:
+            item.notes[number] = text
+
+def body_orders(item_ids):
+    r'''Returns {item_id: [body_order]} of the paragraphs in item_ids.  One query.
+
+    Search uses this to see whether any paragraphs were omitted between the ones shown.
+    '''
+    ans = {}
+    for item_id, body_order in models.Paragraph.objects.filter(item_id__in=item_ids) \
+                                                       .values_list('item_id', 'body_order'):
+        ans.setdefault(item_id, []).append(body_order)
+    return ans
+
+def load_tables(paragraphs):
+    r'''Returns the Tables of the paragraphs that are in table cells, with their cells and
+    the paragraphs in them (and their annotations).  Four queries, if there are any.
+
+    The paragraphs in the same table all share its Table.
+    '''
+    tables = {}  # {table_id: Table}
+    cache_table = models.TableCell._meta.get_field('table').set_cached_value
+    for paragraph in paragraphs:
+        if paragraph.cell_id is not None:
+            table = tables.setdefault(paragraph.cell.table_id, paragraph.cell.table)
+            cache_table(paragraph.cell, table)
+    tables = list(tables.values())
+    prefetch_related_objects(tables, 'tablecell_set__paragraph_set__annotation_set__term'
+                                     '__definition')
+    return tables
+
+def load_results(results):
+    r'''Loads the paragraphs matched by results (ranking.Results), and everything needed
+    to show them.
+
+    Returns {paragraph_id: Paragraph} of the matched paragraphs (in items and table
+    cells), and the body_orders of their items and ancestors.  For a paragraph in a table
+    cell, the whole table is shown.
+    '''
+    paragraph_ids = set(occurrence[0]
+                        for result in results
+                        for term_matches in result.matches
+                        for _, occurrence in term_matches)
+    paragraphs = {paragraph.id: paragraph
+                  for paragraph in models.Paragraph.objects.select_related('cell__table')
+                                                   .filter(id__in=paragraph_ids)}
+    tables = load_tables(paragraphs.values())
+    items = load_ancestors(models.Item.objects.filter(
+                             id__in=set(p.item_id for p in paragraphs.values()
+                                                  if p.item_id is not None)
+                                  | set(table.item_id for table in tables)))
+    items_by_id = {item.id: item for item in items}
+    cache_item = models.Paragraph._meta.get_field('item').set_cached_value
+    for paragraph in paragraphs.values():
+        if paragraph.item_id is not None:
+            cache_item(paragraph, items_by_id[paragraph.item_id])
+    cache_table_item = models.Table._meta.get_field('item').set_cached_value
+    for table in tables:
+        cache_table_item(table, items_by_id[table.item_id])
+    load_titles(items)
+    shown = list(chain((p for p in paragraphs.values() if p.item_id is not None),
+                       chain.from_iterable(item.title_paragraphs for item in items)))
+    load_annotations(shown)
+    definitions = definitions_in(chain(shown,
+                                       (paragraph
+                                        for table in tables
+                                        for cell in table.tablecell_set.all()
+                                        for paragraph in cell.paragraph_set.all())))
+    definition_items = load_ancestors(definitions + load_bodies(definitions))
+    load_notes(items + definition_items)
+    return paragraphs, body_orders(items_by_id.keys())
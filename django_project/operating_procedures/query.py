@@ -0,0 +1,142 @@
+# query.py
+
+r'''The terms of a search.
+
+The search words are separated by commas.  Each term is one of:
+
+    word                -- the word, or any of its synonyms
+    "common elements"   -- a phrase: the words (or their synonyms) one right after the
+                           other in the same sentence.  The quotes are optional.
+    unit NEAR/3 owner   -- the two words (or their synonyms) within 3 words of each other
+                           in the same sentence.  NEAR alone is NEAR/5.
+
+The words are split out of each term by load_words.get_tokens, so that they are the
+same as the words indexed.
+
+Each Term is matched against the occurrences (see postings) of the synonyms of each of
+its words by joining them on their positions (paragraph_id, sentence_number,
+word_number), rather than looking up each next word in the database.
+'''
+
+import re
+
+from operating_procedures.scripts import load_words
+
+
+Near_distance = 5   # for NEAR without /k
+
+near_re = re.compile(r'\s+near(?:/(\d+))?\s+', re.IGNORECASE)
+
+
+class Term:
+    r'''A single word.
+
+    words are the texts of the words in the term.  The view fills in synonyms: a set of
+    Word.ids for each of the words.
+    '''
+    def __init__(self, words):
+        self.words = words
+        self.text = ' '.join(words)
+        self.synonyms = None
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.text!r}>"
+
+    def match(self, occurrences):
+        r'''Returns the sorted [(word_id, occurrence)] of all of the words matched.
+
+        occurrences is, for each of the words, [(word_id, occurrence)] for its synonyms.
+        '''
+        return sorted(occurrences[0], key=lambda x: x[1])
+
+
+class Phrase(Term):
+    r'''Words one right after the other in the same sentence.
+
+        >>> Phrase(['common', 'elements']).match(
+        ...   [[(1, (10, 1, 4, 20, 6)), (1, (10, 2, 1, 60, 6)), (1, (11, 1, 7, 40, 6))],
+        ...    [(2, (10, 1, 5, 27, 8)), (2, (10, 2, 5, 90, 8)), (2, (11, 2, 1, 50, 8))]])
+        [(1, (10, 1, 4, 20, 6)), (2, (10, 1, 5, 27, 8))]
+    '''
+    def match(self, occurrences):
+        # {(paragraph_id, sentence_number, word_number): (word_id, occurrence)}
+        positions = [{occurrence[:3]: (word_id, occurrence)
+                      for word_id, occurrence in word_occurrences}
+                     for word_occurrences in occurrences[1:]]
+        ans = []
+        for word_id, occurrence in occurrences[0]:
+            paragraph_id, sentence_number, word_number = occurrence[:3]
+            rest = [word_positions.get((paragraph_id, sentence_number, word_number + i))
+                    for i, word_positions in enumerate(positions, 1)]
+            if all(rest):
+                ans.append((word_id, occurrence))
+                ans.extend(rest)
+        return sorted(ans, key=lambda x: x[1])
+
+
+class Near(Term):
+    r'''Two words within distance words of each other in the same sentence.
+
+        >>> Near(['unit', 'owner'], 2).match(
+        ...   [[(1, (10, 1, 4, 20, 4)), (1, (10, 2, 1, 60, 4))],
+        ...    [(2, (10, 1, 6, 32, 5)), (2, (10, 2, 9, 99, 5)), (2, (11, 1, 4, 20, 5))]])
+        [(1, (10, 1, 4, 20, 4)), (2, (10, 1, 6, 32, 5))]
+    '''
+    def __init__(self, words, distance):
+        super().__init__(words)
+        self.distance = distance
+        self.text = f" NEAR/{distance} ".join(words)
+
+    def match(self, occurrences):
+        # {(paragraph_id, sentence_number): [(word_id, occurrence)]}
+        sentences = {}
+        for word_id, occurrence in occurrences[1]:
+            sentences.setdefault(occurrence[:2], []).append((word_id, occurrence))
+        ans = set()
+        for word_id, occurrence in occurrences[0]:
+            for other in sentences.get(occurrence[:2], ()):
+                if other[1] != occurrence and \
+                   abs(other[1][2] - occurrence[2]) <= self.distance:
+                    ans.add((word_id, occurrence))
+                    ans.add(other)
+        return sorted(ans, key=lambda x: x[1])
+
+
+def words_in(text):
+    return [w.lower() for _, _, _, w in load_words.get_tokens(text)]
+
+def parse_term(text):
+    r'''Returns the Term for text, or None if it has no words.
+
+        >>> parse_term('Unit'), parse_term(' "Common  Elements" '), parse_term('a')
+        (<Term 'unit'>, <Phrase 'common elements'>, None)
+        >>> parse_term('unit near/3 owners'), parse_term('unit NEAR owner')
+        (<Near 'unit NEAR/3 owners'>, <Near 'unit NEAR/5 owner'>)
+    '''
+    parts = near_re.split(text.strip())
+    if len(parts) == 3:
+        words = words_in(parts[0]) + words_in(parts[2])
+        if len(words) != 2:
+            raise ValueError(f"NEAR must be between two words: {text!r}")
+        return Near(words, Near_distance if parts[1] is None else int(parts[1]))
+    if len(parts) > 3:
+        raise ValueError(f"only one NEAR allowed: {text!r}")
+    words = words_in(text)
+    if not words:
+        return None
+    if len(words) == 1:
+        return Term(words)
+    return Phrase(words)
+
+def parse(query):
+    r'''Returns the Terms in query, sorted by text, without duplicates.
+
+        >>> parse('unit, "common elements", association near/3 board, Unit')
+        [<Near 'association NEAR/3 board'>, <Phrase 'common elements'>, <Term 'unit'>]
+    '''
+    terms = {}
+    for text in query.split(','):
+        term = parse_term(text)
+        if term is not None:
+            terms.setdefault(term.text, term)
+    return [terms[text] for text in sorted(terms)]
@@ -0,0 +1,175 @@
+# ranking.py
+
+r'''Ranks the items found by a search with BM25.
+
+Each paragraph in a version (in its items and table cells) is a document, with
+Paragraph.num_words for its length, and each query.Term is a term.  The term frequency
+is the number of times the term matched in the paragraph, and the document frequency is
+the number of paragraphs in the version that it matched.
+
+An item's score is the sum of the scores of its paragraphs.  As with the unranked
+search, an item is only a Result if each of the terms is in its paragraphs or in the
+paragraphs of its ancestors.  A Result whose item is under the item of another Result
+is merged into that one (see merge_trees), so that no item is shown twice.
+
+The scores are worked out from the occurrences and the segments.get_index of each
+version, without the database.  Only the top Results are returned, found with a heap,
+so the database is only read for the Results that are shown.  The next page starts
+after the cursor of the last Result shown, so no state is kept between pages.
+'''
+
+from heapq import nsmallest
+from itertools import chain
+from math import log
+
+from operating_procedures import segments
+
+
+K1 = 1.2     # term frequency saturation
+B = 0.75     # document length normalization
+
+Results_per_page = 20
+
+
+def bm25(tf, num_words, df, num_paragraphs, avg_words):
+    r'''Returns the BM25 score of a term in one paragraph.
+
+        >>> round(bm25(1, 10, 5, 100, 10.0), 4), round(bm25(2, 10, 5, 100, 10.0), 4)
+        (2.9104, 4.0018)
+        >>> round(bm25(1, 10, 50, 100, 10.0), 4), round(bm25(1, 40, 5, 100, 10.0), 4)
+        (0.6931, 1.3067)
+
+    If avg_words is 0 (the paragraphs' num_words weren't set), the paragraph lengths are
+    left out.
+
+        >>> round(bm25(1, 0, 5, 100, 0.0), 4)
+        2.9104
+    '''
+    idf = log((num_paragraphs - df + 0.5) / (df + 0.5) + 1)
+    length = num_words / avg_words if avg_words else 1
+    return idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length))
+
+
+class Result:
+    r'''An item found by a search.
+
+    matches is, for each term, [(word_id, occurrence)] in the item and its ancestors.
+    '''
+    def __init__(self, version, item_id, score, matches):
+        self.version = version
+        self.item_id = item_id
+        self.score = score
+        self.matches = matches
+
+    def __repr__(self):
+        return f"<Result version={self.version} item_id={self.item_id} " \
+               f"score={self.score:.4f}>"
+
+    def sort_key(self):
+        r'''Best first, then in document order.
+        '''
+        return -self.score, self.version, self.item_id
+
+    def cursor(self):
+        return f"{self.score!r}:{self.version}:{self.item_id}"
+
+
+def parse_cursor(cursor):
+    r'''Returns the sort_key of the Result that cursor came from.
+
+        >>> parse_cursor(Result(3, 1207, 4.25, []).cursor())
+        (-4.25, 3, 1207)
+    '''
+    score, version, item_id = cursor.split(':')
+    return -float(score), int(version), int(item_id)
+
+
+def score_version(version, terms, matches):
+    r'''Returns the Results in version.
+
+    matches is, for each of the terms, its [(word_id, occurrence)] in version.
+    '''
+    index = segments.get_index(version)
+    scores = {}    # {item_id: score}
+    by_item = {}   # {item_id: [[(word_id, occurrence)] for each term]}
+    for term_index, (term, term_matches) in enumerate(zip(terms, matches)):
+        tf = {}    # {paragraph_id: number of words matched}
+        for word_id, occurrence in term_matches:
+            paragraph_id = occurrence[0]
+            tf[paragraph_id] = tf.get(paragraph_id, 0) + 1
+            item_id = index.item_id(paragraph_id)
+            if item_id not in by_item:
+                by_item[item_id] = [[] for _ in terms]
+            by_item[item_id][term_index].append((word_id, occurrence))
+        for paragraph_id, num_matched in tf.items():
+            item_id = index.item_id(paragraph_id)
+            scores[item_id] = scores.get(item_id, 0.0) \
+                              + bm25(num_matched / len(term.words),
+                                     index.num_words(paragraph_id), len(tf),
+                                     index.num_paragraphs, index.avg_words)
+    results = []
+    for item_id, score in scores.items():
+        item_matches = [list(term_matches) for term_matches in by_item[item_id]]
+        ancestor = index.parent_id(item_id)
+        while ancestor is not None:
+            if ancestor in by_item:
+                for term_matches, ancestor_matches in zip(item_matches, by_item[ancestor]):
+                    term_matches.extend(ancestor_matches)
+            ancestor = index.parent_id(ancestor)
+        if all(item_matches):
+            results.append(Result(version, item_id, score, item_matches))
+    return merge_trees(results, index.parent_id)
+
+
+def merge_trees(results, parent_id):
+    r'''Merges each of results into the Result for the top-most ancestor of its item that
+    is also in results.  Returns the merged Results.
+
+    The merged Result has the best score of the Results merged (so it's ranked where its
+    best item would be), and all of their matches.
+
+        >>> parents = {6: 5, 7: 6, 9: 8}
+        >>> results = [Result(1, id, score, [[(1, (id, 1, 1, 0, 4))]])
+        ...            for id, score in ((5, 1.0), (7, 3.0), (9, 1.0))]
+        >>> merged = merge_trees(results, parents.get)
+        >>> merged
+        [<Result version=1 item_id=5 score=3.0000>, <Result version=1 item_id=9 score=1.0000>]
+        >>> merged[0].matches
+        [[(1, (5, 1, 1, 0, 4)), (1, (7, 1, 1, 0, 4))]]
+    '''
+    result_items = set(result.item_id for result in results)
+    trees = {}   # {top item_id: [Result]}
+    for result in results:
+        top = result.item_id
+        ancestor = parent_id(result.item_id)
+        while ancestor is not None:
+            if ancestor in result_items:
+                top = ancestor
+            ancestor = parent_id(ancestor)
+        trees.setdefault(top, []).append(result)
+    ans = []
+    for top, tree in trees.items():
+        if len(tree) == 1:
+            ans.append(tree[0])
+        else:
+            ans.append(Result(tree[0].version, top, max(result.score for result in tree),
+                              [sorted(set(chain.from_iterable(term_matches)))
+                               for term_matches in zip(*(result.matches
+                                                         for result in tree))]))
+    return ans
+
+
+def top_results(results, after=None, k=Results_per_page):
+    r'''Returns the best k Results after the cursor, after, best first.
+
+        >>> results = [Result(1, id, score, []) for id, score in ((5, 1.0), (6, 3.0),
+        ...                                                        (7, 2.0), (8, 3.0))]
+        >>> top_results(results, k=3)
+        [<Result version=1 item_id=6 score=3.0000>, <Result version=1 item_id=8 score=3.0000>, <Result version=1 item_id=7 score=2.0000>]
+        >>> top_results(results, after=results[3].cursor(), k=3)
+        [<Result version=1 item_id=7 score=2.0000>, <Result version=1 item_id=5 score=1.0000>]
+    '''
+    if after is not None:
+        start = parse_cursor(after)
+        results = (result for result in results if result.sort_key() > start)
+    return nsmallest(k, results, key=Result.sort_key)
@@ -0,0 +1,119 @@
+# result_cache.py
+
+r'''A cache of what search builds for each query.
+
+The published versions don't change, so the page that search shows depends only on the
+terms, the synonyms of their words, the latest published version of each of the Sources
+and the page (the after cursor).  Together, these are the key (see make_key).  So
+publishing a new version, or load_synonyms changing the synonyms, changes the key, and
+the old entries are just never used again (they age out).  load_definitions can change
+the Annotations of a published version, so it calls invalidate.  This works like
+synonym_map's: the mtime of Stamp_file is part of the key too.
+
+What's cached is the html of the blocks found (rendering them takes more time than
+finding them), the number of results and the cursor for the next page.  Only the rest of
+the page (which shows the words as typed) is rendered each time.
+
+Each process keeps the Max_entries most recently used in an Lru.  If settings.CACHES has
+a Shared_cache, they're also shared with the other processes through that (e.g.,
+memcached or redis).
+
+    >>> lru = Lru(2)
+    >>> lru.put('a', 1)
+    >>> lru.put('b', 2)
+    >>> lru.get('a')
+    1
+    >>> lru.put('c', 3)         # drops 'b', the least recently used
+    >>> lru.get('b'), lru.get('a'), lru.get('c')
+    (None, 1, 3)
+'''
+
+from collections import OrderedDict
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from operating_procedures import fts, segments
+
+
+Max_entries = 500         # per process
+Shared_cache = 'search'   # the settings.CACHES alias, if it's there
+
+Stamp_file = segments.Segments_dir / 'results.stamp'
+
+
+class Lru:
+    r'''The max_entries most recently used values.
+
+    Shared by the request threads, so each of these holds the lock.
+    '''
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        r'''Returns None if key isn't there.
+        '''
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+Results = Lru(Max_entries)
+
+
+def get_generation():
+    try:
+        return Stamp_file.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def make_key(terms, versions, after):
+    r'''Returns the key for the page of results for terms (query.Terms, with their
+    synonyms) in versions, after the after cursor.
+    '''
+    return (tuple((term.__class__.__name__, term.text,
+                   tuple(tuple(sorted(synonyms)) for synonyms in term.synonyms))
+                  for term in terms),
+            tuple(versions), after, fts.Enabled, get_generation())
+
+def shared_key(key):
+    return 'search:' + hashlib.sha256(repr(key).encode()).hexdigest()
+
+def get(key):
+    r'''Returns the value cached for key, or None.
+    '''
+    value = Results.get(key)
+    if value is None and Shared_cache in settings.CACHES:
+        value = caches[Shared_cache].get(shared_key(key))
+        if value is not None:
+            Results.put(key, value)
+    return value
+
+def put(key, value):
+    Results.put(key, value)
+    if Shared_cache in settings.CACHES:
+        caches[Shared_cache].set(shared_key(key), value)
+
+def invalidate():
+    r'''Called when a published version changes, so that no process uses what's cached.
+    '''
+    Results.clear()
+    Stamp_file.parent.mkdir(exist_ok=True)
+    Stamp_file.touch()
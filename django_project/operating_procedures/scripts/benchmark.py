@@ -0,0 +1,236 @@
+# benchmark.py
+
+r'''Times the scrapers, phase by phase, against the fixture_server.
+
+The phases are:
+
+    fetch  -- scrape_html.fetch, getting the pages from the fixture_server (for the
+              bylaws, reading bylaws.txt)
+    parse  -- scrape_html.parse, BeautifulSoup parsing the pages
+    cites  -- scrape_html.create_s_cites
+    db     -- saving the Version and Bulk_writer.flush
+    other  -- everything else on the main thread (walking the soup, creating the model
+              objects, waiting for the pages from the fetch threads)
+
+The time in a phase doesn't include the time in any other phase that it calls.  The 61B
+pages are fetched and parsed on scrape_html.Jobs threads, so fetch and parse are the
+total over all of these threads, and the phases may add up to more than the elapsed time.
+
+Each scrape is done within a transaction that is rolled back, so the database is left as
+it was.
+
+The fixture_server serves the pages in the http_cache.  So on the first run (when the
+first page of 719 or 61b isn't in the http_cache), that scraper is first run, untimed,
+against the real site to record its pages (see record).  The 'record' script arg does
+this for every scraper, to fill in any pages that are missing.
+'''
+
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+import threading
+import time
+
+from django.db import transaction
+from django.db.models import Q
+
+from operating_procedures import models
+from operating_procedures.scripts import fixture_server, http_cache, scrape_bylaws, \
+                                           scrape_html
+from operating_procedures.scripts.bulk_writer import Bulk_writer
+
+
+Phases = 'fetch', 'parse', 'cites', 'db'
+
+Scrapers = '719', '61b', 'bylaws'
+
+
+class Phase_timer:
+    def __init__(self):
+        self.times = defaultdict(float)   # {phase: secs}
+        self.calls = defaultdict(int)     # {phase: number of calls}
+        self.lock = threading.Lock()
+        self.local = threading.local()    # stack: [secs in nested phases]
+        self.thread = threading.get_ident()
+        self.thread_time = 0.0            # secs in phases on the thread that created this
+
+    @contextmanager
+    def phase(self, name):
+        stack = self.local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self.lock:
+                self.times[name] += elapsed - nested
+                self.calls[name] += 1
+            if not stack and threading.get_ident() == self.thread:
+                self.thread_time += elapsed
+
+    def wrap(self, name, fn):
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            with self.phase(name):
+                return fn(*args, **kwargs)
+        return timed
+
+
+@contextmanager
+def timing(timer):
+    r'''Wraps the functions in each phase with timer while in the with statement.
+    '''
+    patches = ((scrape_html, 'fetch', 'fetch'),
+               (scrape_bylaws, 'get_line', 'fetch'),
+               (scrape_html, 'parse', 'parse'),
+               (scrape_html, 'create_s_cites', 'cites'),
+               (Bulk_writer, 'flush', 'db'))
+    saved = [(obj, attr, getattr(obj, attr)) for obj, attr, _ in patches]
+    for obj, attr, name in patches:
+        setattr(obj, attr, timer.wrap(name, getattr(obj, attr)))
+    try:
+        yield
+    finally:
+        for obj, attr, fn in saved:
+            setattr(obj, attr, fn)
+
+
+def scrape(scraper, timer):
+    r'''Runs scraper.  Returns the new Version.
+    '''
+    if scraper == 'bylaws':
+        module = scrape_bylaws
+        version = models.Version(source=scrape_bylaws.Source)
+    elif scraper == '719':
+        module = scrape_html
+        version = models.Version(source=scrape_html.fl_leg_domain,
+                                 url=scrape_html.chapter_719)
+    else:
+        module = scrape_html
+        version = models.Version(source=scrape_html.casetext_domain,
+                                 url=scrape_html.casetext_61B)
+    with timer.phase('db'):
+        version.save()
+    module.version_obj = version
+    module.writer = Bulk_writer()
+    if scraper == 'bylaws':
+        scrape_bylaws.scrape()
+    elif scraper == '719':
+        scrape_html.source = '719'
+        scrape_html.scrape_719()
+    else:
+        scrape_html.source = '61b'
+        scrape_html.scrape_61B()
+    module.writer.flush()
+    return version
+
+
+def first_page(scraper):
+    r'''Returns the url of the first page that scraper gets, or None if it doesn't get
+    any pages.
+    '''
+    if scraper == '719':
+        return scrape_html.chapter_719
+    if scraper == '61b':
+        return scrape_html.casetext_61B
+    return None
+
+
+def record(scraper):
+    r'''Runs scraper against the real site, which stores its pages in the http_cache.
+
+    Isn't timed, and the database is left as it was.
+    '''
+    print(f"{scraper}: recording the pages in {http_cache.Cache_dir}")
+    site = scrape_html.Site
+    scrape_html.Site = None
+    try:
+        with transaction.atomic():
+            scrape(scraper, Phase_timer())
+            transaction.set_rollback(True)
+    finally:
+        scrape_html.Site = site
+
+
+def benchmark(scraper):
+    r'''Times scraper, and prints the results.
+    '''
+    timer = Phase_timer()
+    with transaction.atomic():
+        start = time.perf_counter()
+        with timing(timer):
+            version = scrape(scraper, timer)
+        elapsed = time.perf_counter() - start
+        in_version = Q(item__version=version) | Q(cell__table__item__version=version)
+        counts = dict(
+          items=models.Item.objects.filter(version=version).count(),
+          paragraphs=models.Paragraph.objects.filter(in_version).count(),
+          annotations=models.Annotation.objects.filter(
+                        Q(paragraph__item__version=version)
+                        | Q(paragraph__cell__table__item__version=version)).count())
+        transaction.set_rollback(True)
+    print(f"{scraper}: {elapsed:.2f} secs, "
+          + ', '.join(f"{count} {name}" for name, count in counts.items())
+          + f", {counts['items'] / elapsed:.0f} items/sec")
+    other = elapsed - timer.thread_time
+    for name in Phases:
+        if timer.calls[name]:
+            print(f"  {name:>6}: {timer.times[name]:7.2f} secs "
+                  f"({timer.times[name] / elapsed:4.0%}), {timer.calls[name]} calls")
+    print(f"  {'other':>6}: {other:7.2f} secs ({other / elapsed:4.0%})")
+
+
+def run(*args):
+    port = 0
+    scale = 1
+    if 'port' in args:
+        port = int(args[args.index('port') + 1])
+    if 'scale' in args:
+        scale = int(args[args.index('scale') + 1])
+    if 'jobs' in args:
+        scrape_html.Jobs = int(args[args.index('jobs') + 1])
+    if 'workers' in args:
+        scrape_html.Workers = int(args[args.index('workers') + 1])
+    if 'parser' in args:
+        scrape_html.Parser = args[args.index('parser') + 1]
+    if 'help' in args:
+        print("benchmark help")
+        print("  python manage.py runscript benchmark")
+        print("    times scrape_html 719, scrape_html 61b and scrape_bylaws, phase by phase")
+        print("    against the fixture_server (nothing is left in the database)")
+        print("    the first time, 719 and 61b are first scraped from the real sites to")
+        print("    record their pages in the http_cache")
+        print("  python manage.py runscript benchmark --script-args 719 61b bylaws")
+        print("    only times the scrapers listed")
+        print("  python manage.py runscript benchmark --script-args scale 10")
+        print("    with 10 times as many sections in 719 and 61b")
+        print("  python manage.py runscript benchmark --script-args jobs 4 workers 8 "
+              "parser lxml")
+        print("    with these scrape_html options")
+        print("  python manage.py runscript benchmark --script-args record")
+        print("    records the pages from the real sites again (untimed) before timing,")
+        print("    to fill in any that are missing from the http_cache")
+        print("  python manage.py runscript benchmark --script-args port 8061")
+        print("    runs the fixture_server on port 8061 (default any free port)")
+        print("  python manage.py runscript benchmark --script-args help")
+        print("    prints this help message")
+        return
+    scrapers = [scraper for scraper in Scrapers if scraper in [arg.lower() for arg in args]] \
+            or Scrapers
+    for scraper in scrapers:
+        url = first_page(scraper)
+        if url is not None and ('record' in args or http_cache.lookup(url) is None):
+            record(scraper)
+    server = fixture_server.start(port, scale)
+    scrape_html.Site = f"http://localhost:{server.server_port}"
+    print(f"benchmark {scale=}, Jobs={scrape_html.Jobs}, Workers={scrape_html.Workers}, "
+          f"Parser={scrape_html.Parser!r}, fixture_server on {scrape_html.Site}")
+    try:
+        for scraper in scrapers:
+            benchmark(scraper)
+    finally:
+        server.shutdown()
@@ -0,0 +1,169 @@
+# bulk_writer.py
+
+r'''Buffers new model objects and writes them to the database with bulk_create.
+
+The primary key is assigned when the object is added, so other objects can point to it
+right away, before it has been written.  The ids are reserved from the database's own
+id sequence for the table, a block at a time (see reserve_ids).  So they don't collide
+with the ids used by other Bulk_writers, or other processes, adding to the same table.
+
+Changes to objects that have already been written are passed to `update` and written
+with bulk_update.
+
+Nothing is written until `flush` is called, or batch_size objects are pending.
+
+A Record_writer stands in for a Bulk_writer in another process.  It collects the objects
+as plain records, which write_records then adds to the Bulk_writer.
+'''
+
+from django.apps import apps
+from django.db import connection, transaction
+
+
+Batch_size = 2000
+Id_block = 2000       # number of ids reserved at a time for each model
+
+
+class Bulk_writer:
+    def __init__(self, batch_size=Batch_size):
+        self.batch_size = batch_size
+        self.ids = {}          # {model: iterator of the reserved ids not used yet}
+        self.pending = {}      # {model: [obj]}
+        self.updates = {}      # {(model, fields): {id: obj}}
+        self.num_pending = 0
+
+    def add(self, obj):
+        r'''Assigns obj.id and queues obj to be written.  Returns obj.
+        '''
+        model = obj.__class__
+        obj.id = next(self.ids.get(model, iter(())), None)
+        if obj.id is None:
+            self.ids[model] = iter(reserve_ids(model, Id_block))
+            obj.id = next(self.ids[model])
+        self.pending.setdefault(model, []).append(obj)
+        self.num_pending += 1
+        if self.num_pending >= self.batch_size:
+            self.flush()
+        return obj
+
+    def update(self, obj, *fields):
+        r'''Call this after changing fields in obj.
+
+        Does nothing if obj hasn't been written yet, since the change will be written
+        with it.
+        '''
+        if not obj._state.adding:
+            self.updates.setdefault((obj.__class__, fields), {})[obj.id] = obj
+            self.num_pending += 1
+            if self.num_pending >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        r'''Writes all pending objects and updates to the database.
+        '''
+        for model in dependency_order(self.pending.keys()):
+            model.objects.bulk_create(self.pending[model])
+        self.pending = {}
+        for (model, fields), objs in self.updates.items():
+            model.objects.bulk_update(objs.values(), fields)
+        self.updates = {}
+        self.num_pending = 0
+
+
+class Record_writer:
+    def __init__(self):
+        self.next_ids = {}     # {model: next local id}
+        self.objs = []
+
+    def add(self, obj):
+        r'''Assigns obj.id (local to this Record_writer) and records obj.  Returns obj.
+        '''
+        model = obj.__class__
+        obj.id = self.next_ids.get(model, 1)
+        self.next_ids[model] = obj.id + 1
+        self.objs.append(obj)
+        return obj
+
+    def update(self, obj, *fields):
+        r'''Does nothing, the objects are recorded as they are when `records` is called.
+        '''
+        pass
+
+    def flush(self):
+        pass
+
+    def records(self):
+        r'''Returns [(model label, {attname: value})] for the objects added, in the order
+        that they were added.
+        '''
+        return [(obj._meta.label,
+                 {field.attname: getattr(obj, field.attname)
+                  for field in obj._meta.concrete_fields})
+                for obj in self.objs]
+
+
+def write_records(writer, records, external_ids={}):
+    r'''Adds the objects in records (from Record_writer.records) to writer.
+
+    The local ids in their ForeignKeys are changed to the ids assigned by writer.
+    ForeignKeys to objects that aren't in records are changed by external_ids
+    ({model: {local id: id}}), or left as they are.
+    '''
+    new_ids = {}  # {model: {local id: id}}
+    for label, fields in records:
+        model = apps.get_model(label)
+        local_id = fields.pop('id')
+        for field in model._meta.concrete_fields:
+            if field.is_relation:
+                id = fields[field.attname]
+                for ids in new_ids, external_ids:
+                    if id in ids.get(field.related_model, ()):
+                        fields[field.attname] = ids[field.related_model][id]
+                        break
+        new_ids.setdefault(model, {})[local_id] = writer.add(model(**fields)).id
+
+
+def reserve_ids(model, n):
+    r'''Reserves n ids for model from the database's id sequence for its table.
+
+    Returns the ids, which no other insert into the table will use.  Ids that are
+    reserved and not used just leave a gap.
+    '''
+    table = model._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # Django's sqlite tables are AUTOINCREMENT, so new ids come after the seq in
+            # sqlite_sequence.  The UPDATE locks the database until the atomic block ends.
+            cursor.execute("UPDATE sqlite_sequence SET seq = seq + %s WHERE name = %s",
+                           [n, table])
+            if cursor.rowcount == 0:
+                # nothing has been inserted into table yet
+                cursor.execute("INSERT INTO sqlite_sequence (name, seq) "
+                               f"SELECT %s, COALESCE(MAX(id), 0) + %s FROM {table}",
+                               [table, n])
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+            last = cursor.fetchone()[0]
+            return range(last - n + 1, last + 1)
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+                           "FROM generate_series(1, %s)",
+                           [table, n])
+            return sorted(id for id, in cursor.fetchall())
+        raise AssertionError(f"reserve_ids: {connection.vendor} databases aren't supported")
+
+
+def dependency_order(models):
+    r'''Returns models sorted so that each model comes after the models it has a
+    ForeignKey to.
+    '''
+    ans = []
+    def add(model):
+        if model not in ans:
+            for field in model._meta.concrete_fields:
+                if field.is_relation and field.related_model is not model and \
+                   field.related_model in models:
+                    add(field.related_model)
+            ans.append(model)
+    for model in models:
+        add(model)
+    return ans
@@ -0,0 +1,211 @@
+# fixture_server.py
+
+r'''Local stand-in for leg.state.fl.us and casetext.com.
+
+Serves the pages recorded in the http_cache directory, so that the scrapers can be run
+(and timed) without touching the real sites.  The pages are served as:
+
+    http://localhost:<Port>/<scheme>/<host><path>?<query>
+
+See site_url.  Setting scrape_html.Site (the 'site' script arg in scrape_html) makes
+scrape_html fetch all of its pages this way.
+
+With a Scale of N, the recorded pages are scaled up to have N times as many sections:
+
+    - each Section in the chapter 719 page is followed by N-1 copies, numbered 719.10501,
+      719.10502, etc.
+    - each section link in the 61B chapter pages is followed by N-1 copies, linking to the
+      same page with Copy_param=k added to the query.  These pages are served with the
+      citation changed to 61B-75.00301, 61B-75.00302, etc.
+
+The http_cache must have the pages in it (i.e., scrape 719 and 61b once, or run the
+benchmark, which records them the first time) before this can serve them.
+'''
+
+from copy import copy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import re
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+from bs4 import BeautifulSoup
+
+from operating_procedures.scripts import http_cache
+
+
+Port = 8061
+Scale = 1
+
+Copy_param = 'fixture_copy'
+
+
+def site_url(url, site):
+    r'''Returns the url on the fixture server at site for url.
+
+        >>> site_url('http://www.leg.state.fl.us/statutes/index.cfm?App_mode=x',
+        ...          'http://localhost:8061')
+        'http://localhost:8061/http/www.leg.state.fl.us/statutes/index.cfm?App_mode=x'
+    '''
+    scheme, netloc, path, query, fragment = urlsplit(url)
+    return site.rstrip('/') + urlunsplit(('', '', f"/{scheme}/{netloc}{path}", query, ''))
+
+
+def original_url(path):
+    r'''Returns (url, copy) for the path requested from the fixture server.
+
+    Copy is the Copy_param (as an int), or 0.
+
+        >>> original_url('/https/casetext.com/regulation/section-61b-75003?fixture_copy=2')
+        ('https://casetext.com/regulation/section-61b-75003', 2)
+    '''
+    _, _, path, query, _ = urlsplit(path)
+    scheme, netloc, path = path.split('/', 3)[1:]
+    params = []
+    copy_num = 0
+    for param in query.split('&') if query else ():
+        if param.startswith(Copy_param + '='):
+            copy_num = int(param[len(Copy_param) + 1:])
+        else:
+            params.append(param)
+    return urlunsplit((scheme, netloc, '/' + path, '&'.join(params), '')), copy_num
+
+
+section_number_re = re.compile(r'([0-9]+\.[0-9]+)')
+section_title_re = re.compile(r'(61B-[0-9]+\.[0-9]+)')
+
+def scale_719(soup, scale):
+    r'''Adds scale-1 copies after each Section.
+    '''
+    for section in soup.find_all('div', class_='Section'):
+        after = section
+        for k in range(1, scale):
+            section_copy = copy(section)
+            number = section_copy.find('span', class_='SectionNumber')
+            for s in number.find_all(string=section_number_re):
+                s.replace_with(section_number_re.sub(rf'\g<1>{k:02d}', s, count=1))
+                break
+            after.insert_after(section_copy)
+            after = section_copy
+
+def scale_61B_chapter(soup, scale):
+    r'''Adds scale-1 copies after each section link.
+    '''
+    ul = soup.body.article.ul
+    for li in ul.find_all('li', recursive=False):
+        after = li
+        for k in range(1, scale):
+            li_copy = copy(li)
+            scheme, netloc, path, query, fragment = urlsplit(li_copy.a['href'])
+            query = '&'.join(q for q in (query, f"{Copy_param}={k}") if q)
+            li_copy.a['href'] = urlunsplit((scheme, netloc, path, query, fragment))
+            after.insert_after(li_copy)
+            after = li_copy
+
+def renumber_61B_section(soup, copy_num):
+    r'''Changes the citation of this section page to copy copy_num.
+    '''
+    title = soup.find('section', class_='codified-law-title')
+    title.string = section_title_re.sub(rf'\g<1>{copy_num:02d}', title.string, count=1)
+
+
+def is_61B_chapter(soup):
+    r'''Is this the list of sections in a 61B chapter (rather than the list of chapters, or
+    a section)?
+    '''
+    if soup.find('section', class_='codified-law-title') is not None:
+        return False
+    title = soup.body.article.ul.li.find('span', class_='title')
+    return title is None or not title.get_text().startswith('Chapter ')
+
+
+def get_page(url, copy_num, scale):
+    r'''Returns the Cached_response for url, scaled up by scale; or None.
+    '''
+    cached = http_cache.lookup(url)
+    if cached is None or cached.status_code != 200 or (scale == 1 and not copy_num):
+        return cached
+    soup = BeautifulSoup(cached.text, 'html.parser')
+    if urlsplit(url).hostname.endswith('leg.state.fl.us'):
+        scale_719(soup, scale)
+    elif copy_num:
+        renumber_61B_section(soup, copy_num)
+    elif is_61B_chapter(soup):
+        scale_61B_chapter(soup, scale)
+    else:
+        soup = None
+    if soup is not None:
+        cached.content = str(soup).encode(cached.encoding or 'utf-8')
+    return cached
+
+
+class Fixture_handler(BaseHTTPRequestHandler):
+    scale = 1
+    pages = None   # {(url, copy_num): Cached_response}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        url, copy_num = original_url(self.path)
+        key = url, copy_num
+        with self.lock:
+            page = self.pages.get(key)
+        if page is None:
+            page = get_page(url, copy_num, self.scale)
+            with self.lock:
+                self.pages[key] = page
+        if page is None:
+            self.send_error(404, f"{url} not in http_cache, "
+                                 "run benchmark with 'record' to record it")
+            return
+        self.send_response(page.status_code)
+        self.send_header('Content-Type', page.headers.get('Content-Type', 'text/html'))
+        self.send_header('Content-Length', str(len(page.content)))
+        self.end_headers()
+        self.wfile.write(page.content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(port=0, scale=1):
+    r'''Starts the fixture server on a background thread.  Returns the server.
+
+    Port 0 picks any free port.  The site to pass to site_url is
+    f"http://localhost:{server.server_port}".  Call server.shutdown() to stop it.
+    '''
+    handler = type('Fixture_handler', (Fixture_handler,), dict(scale=scale, pages={}))
+    server = ThreadingHTTPServer(('localhost', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(*args):
+    global Port, Scale
+    if 'port' in args:
+        Port = int(args[args.index('port') + 1])
+    if 'scale' in args:
+        Scale = int(args[args.index('scale') + 1])
+    if 'help' in args:
+        print("fixture_server help")
+        print("  python manage.py runscript fixture_server")
+        print(f"    serves the pages in the http_cache on http://localhost:{Port}")
+        print("    until interrupted")
+        print("  python manage.py runscript fixture_server --script-args port 8062")
+        print(f"    serves them on another port (default {Port})")
+        print("  python manage.py runscript fixture_server --script-args scale 10")
+        print("    serves them with 10 times as many sections")
+        print("  to scrape from it:")
+        print("    python manage.py runscript scrape_html --script-args 719 "
+              f"site http://localhost:{Port}")
+        print("  python manage.py runscript fixture_server --script-args help")
+        print("    prints this help message")
+    else:
+        server = start(Port, Scale)
+        print(f"serving {http_cache.Cache_dir} on http://localhost:{server.server_port} "
+              f"with {Scale=}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
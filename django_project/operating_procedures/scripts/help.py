@@ -24,11 +24,21 @@ def run():
     print("  python manage.py runscript show_outline")
     print("  python manage.py runscript show_outline --script-args 61b")
     print("  python manage.py runscript show_outline --script-args gg")
+    print("  python manage.py runscript publish")
     print()
-    print("run doctests in scrape_html:")
+    print("the web pages only show published versions, and keep showing the old versions")
+    print("until the new ones are published")
+    print()
+    print("run the doctests (in the scripts and in the modules that search uses):")
     print("  python manage.py test operating_procedures.scripts.run_doctests")
     print("  (see scripts/run_doctests.py)")
     print()
+    print("time the scrapers against a local copy of the sites:")
+    print("  python manage.py runscript benchmark --script-args help")
+    print()
+    print("time the postings, index and fts ways of matching search terms:")
+    print("  python manage.py runscript search_benchmark --script-args help")
+    print()
     print("database sizes:")
     print("  db.sqlite3 ends up at 6.6MB")
     print()
@@ -40,5 +50,4 @@ def run():
     print("  Table      :     9")
     print("  TableCell  :  1463")
     print("  Word       :  3547")
-    print("  Synonym    :  5856")
-    print("  WordRef    : 75218")
+    print("  WordRef    :     0 (was 75218, now packed into a Posting per word)")
@@ -0,0 +1,115 @@
+# http_cache.py
+
+r'''On-disk cache of the raw http responses fetched by scrape_html.get.
+
+The cache directory holds:
+
+    index/<sha256 of url>.json  -- url, status_code, headers, encoding and the sha256
+                                   of the body.
+    bodies/<sha256 of body>     -- the raw bytes of the body.  These are content-addressed,
+                                   so a page that hasn't changed is only stored once.
+
+Cached pages are revalidated with If-None-Match/If-Modified-Since (see
+conditional_headers), so an unchanged page costs a 304 rather than a full download.
+
+When Offline is set, pages are only read from the cache and nothing is fetched.
+'''
+
+from hashlib import sha256
+import json
+import os
+from pathlib import Path
+import tempfile
+
+from requests.structures import CaseInsensitiveDict
+
+
+Cache_dir = Path(__file__).parents[2] / 'http_cache'
+
+Enabled = True
+Offline = False
+
+
+class Cached_response:
+    r'''Looks enough like a requests.Response for scrape_html.get.
+    '''
+    def __init__(self, url, status_code, headers, encoding, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.encoding = encoding
+        self.content = content
+
+    @property
+    def text(self):
+        return str(self.content, self.encoding or 'utf-8', errors='replace')
+
+
+def digest(data):
+    return sha256(data).hexdigest()
+
+def index_path(url):
+    return Cache_dir / 'index' / f"{digest(url.encode('utf-8'))}.json"
+
+def body_path(body_hash):
+    return Cache_dir / 'bodies' / body_hash
+
+def write_file(path, data):
+    r'''Writes data (bytes) to path atomically, so that concurrent readers (and writers)
+    never see a partial file.
+    '''
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def lookup(url):
+    r'''Returns the Cached_response for url, or None.
+    '''
+    path = index_path(url)
+    if not path.exists():
+        return None
+    with path.open() as f:
+        entry = json.load(f)
+    try:
+        content = body_path(entry['body']).read_bytes()
+    except FileNotFoundError:
+        print(f"http_cache: WARNING body missing for {url=} -- IGNORED")
+        return None
+    return Cached_response(url, entry['status_code'], entry['headers'], entry['encoding'],
+                           content)
+
+
+def store(url, response):
+    r'''Stores response for url.  Returns a Cached_response.
+    '''
+    content = response.content
+    body_hash = digest(content)
+    if not body_path(body_hash).exists():
+        write_file(body_path(body_hash), content)
+    entry = dict(url=url,
+                 status_code=response.status_code,
+                 headers=dict(response.headers),
+                 encoding=response.encoding,
+                 body=body_hash)
+    write_file(index_path(url), json.dumps(entry, indent=2).encode('utf-8'))
+    return Cached_response(url, response.status_code, entry['headers'], response.encoding,
+                           content)
+
+
+def conditional_headers(cached):
+    r'''Returns the request headers to revalidate the cached response.
+    '''
+    headers = {}
+    if cached is not None:
+        if 'ETag' in cached.headers:
+            headers['If-None-Match'] = cached.headers['ETag']
+        if 'Last-Modified' in cached.headers:
+            headers['If-Modified-Since'] = cached.headers['Last-Modified']
+    return headers
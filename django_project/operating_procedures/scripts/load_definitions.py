@@ -1,12 +1,35 @@
 # load_definitions.py
 
-from itertools import chain
+r'''Annotates the terms defined in 719 and 61B where they are used.
+
+The terms defined in each version are stored as Terms (see get_version_terms), and each
+'definition' Annotation points to the Term that it matched.  So when a source is
+scraped again, its new version only needs to be scanned where something has changed
+(see annotate_version):
+
+    - the Annotations of the prior version are copied to the paragraphs whose citation
+      and text are unchanged, for the Terms that are unchanged (the same definition
+      citation and words, with the same synonyms)
+    - the unchanged paragraphs are only scanned for the added (or changed) Terms
+    - the rest of the paragraphs are scanned for all of the Terms
+
+When only the definitions change, the prior version is the annotated version itself,
+and its Annotations for the old Terms are replaced.  So are the 'definition' Annotations
+made before there were Terms (which have no term).
+
+The synonyms of the words of each Term are recorded when the Term is created.  A Term
+whose words have different synonyms now (load_synonyms has changed them) is treated as
+changed, and scanned for again.  Run with 'full' to scan everything.
+'''
+
+from collections import deque
 import re
 
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import CharField, Q
+from django.db.models.functions import Cast
 
-from operating_procedures import models
+from operating_procedures import models, result_cache, synonym_map
 from operating_procedures.scripts.sources import *
 
 
@@ -18,10 +41,12 @@ term_re = re.compile(r'''
 
 or_re = re.compile(r' +or +')
 
-def annotate(anno_version, definition, base_citation=None):
-    r'''`definition` is an item.
+Incremental = True   # copy the Annotations for unchanged Terms and paragraphs
+
+def get_terms(definition):
+    r'''Returns the terms defined by `definition` (an item), as lists of words.
     '''
-    print(f"annotate: {definition.citation} id={definition.id}")
+    print(f"get_terms: {definition.citation} id={definition.id}")
     def_text = definition.paragraph_set.get(body_order=1).text
     assert def_text[0] in ('"', '\u201c'), \
            f'Expected ", got {ord(def_text[0])=} {ord(def_text[11])=}'
@@ -29,85 +54,352 @@ def annotate(anno_version, definition, base_citation=None):
     print(f"  {terms_text=}")
     terms = or_re.split(terms_text)
     print(f"  {terms=}")
-    for term in terms:
-        annotate_term(anno_version, definition, term[1:-1].split(), base_citation)
+    return [term[1:-1].split() for term in terms]
 
-def annotate_term(anno_version, definition, words, base_citation):
-    r'''`definition` is an item.
+
+class Phrase_automaton:
+    r'''An Aho-Corasick automaton that finds all of the phrases added to it in one pass
+    over a sequence of symbols.
+
+    Here the symbols are the synonym_groups of the words, so a phrase matches any of
+    the synonyms of each of its words.
+
+        >>> automaton = Phrase_automaton()
+        >>> automaton.add([1, 2], 'a'); automaton.add([2, 3], 'b')
+        >>> automaton.add([1, 2, 3, 4], 'c'); automaton.add([2], 'd')
+        >>> automaton.build()
+        >>> state = 0
+        >>> for i, symbol in enumerate([1, 2, 3, 1, 2, 3, 4]):
+        ...     state = automaton.step(state, symbol)
+        ...     print(i, automaton.outputs[state])
+        0 []
+        1 [(2, 'a'), (1, 'd')]
+        2 [(2, 'b')]
+        3 []
+        4 [(2, 'a'), (1, 'd')]
+        5 [(2, 'b')]
+        6 [(4, 'c')]
     '''
-    print(f"annotate_term {anno_version=} {definition.id=} {words=} {base_citation=}")
-    w = words[0]
-    first_words = [models.Word.objects.get(id=id)
-                   for id in models.Word.lookup_word(w).get_synonyms()]
-    rest_words = words[1:]
-
-    def get_wordrefs(word):
-        if base_citation is None:
-            return chain(word.wordref_set.filter(
-                           paragraph__item__version=anno_version).all(),
-                         word.wordref_set.filter(
-                           paragraph__cell__table__item__version=anno_version).all())
-        return chain(word.wordref_set.filter(
-                       paragraph__item__version=anno_version,
-                       paragraph__item__citation__startswith=base_citation).all(),
-                     word.wordref_set.filter(
-                       paragraph__cell__table__item__version=anno_version,
-                       paragraph__cell__table__item__citation__startswith=base_citation).all())
-
-    for ref in chain.from_iterable(get_wordrefs(word) for word in first_words):
-        char_offset = ref.char_offset
-        for w in rest_words:
-            try:
-                ref = ref.get_next_word()
-            except models.WordRef.DoesNotExist:
-                # nope!
-                #print(w, "not found, not enough words in sentence")
-                break
-            if ref.word_id not in models.Word.lookup_word(w).get_synonyms():
-                # nope!
-                #print(w, models.Word.lookup_word(w).get_synonyms(),
-                #      "not found, next word was",
-                #      models.Word.get_text(ref.word_id))
-                break
-        else:
-            print(f"creating annotation paragraph_id={ref.paragraph_id} {char_offset=} "
-                  f"length={ref.char_offset + ref.length - char_offset}")
-            models.Annotation.objects.create(
-              paragraph_id=ref.paragraph_id,
-              type="definition",
-              char_offset=char_offset,
-              length=ref.char_offset + ref.length - char_offset,
-              info=str(definition.id))
+    def __init__(self):
+        self.goto = [{}]      # {symbol: next state} for each state; 0 is the start
+        self.fail = [0]       # longest proper suffix (as a state) of each state
+        self.outputs = [[]]   # [(number of symbols, value)] of the phrases ending in
+                              # each state
 
+    def add(self, symbols, value):
+        state = 0
+        for symbol in symbols:
+            if symbol not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.goto[state][symbol] = len(self.goto) - 1
+            state = self.goto[state][symbol]
+        self.outputs[state].append((len(symbols), value))
 
-def load_definitions(def_version, anno_versions):
-    def_ver_obj = models.Version.objects.get(id=def_version)
-    if def_ver_obj.definitions_loaded:
-        print("ERROR: load_definitions already run on version", version)
+    def build(self):
+        r'''Sets the fail links, breadth first.  Call after all of the phrases are
+        added.
+        '''
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for symbol, next_state in self.goto[state].items():
+                fail = self.fail[state]
+                while fail and symbol not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(symbol, 0)
+                self.outputs[next_state] = self.outputs[next_state] \
+                                         + self.outputs[self.fail[next_state]]
+                queue.append(next_state)
+
+    def step(self, state, symbol):
+        while state and symbol not in self.goto[state]:
+            state = self.fail[state]
+        return self.goto[state].get(symbol, 0)
 
+
+class Version_index:
+    r'''The words of a version in document order, unpacked from its Postings.
+
+    This replaces a WordRef query for each word of each term with one pass over the
+    version.
+    '''
+    def __init__(self, version):
+        # [(paragraph_id, sentence_number, word_number, word_id, char_offset, length)]
+        self.words = sorted(
+          (paragraph_id, sentence_number, word_number, posting.word_id, char_offset,
+           length)
+          for posting in models.Posting.objects.filter(version_id=version)
+          for paragraph_id, sentence_number, word_number, char_offset, length
+           in posting.unpack())
+        # {paragraph_id: citation of its item}
+        self.citations = {
+          id: item_citation or cell_citation
+          for id, item_citation, cell_citation
+           in models.Paragraph.objects.filter(Q(item__version_id=version)
+                                              | Q(cell__table__item__version_id=version))
+                                      .values_list('id', 'item__citation',
+                                                   'cell__table__item__citation')}
+
+# {version: Version_index} of the version being annotated.  This holds every word of the
+# version, so load_definitions drops it after each annotate_version.
+Version_indexes = {}
+
+def get_version_index(version):
+    if version not in Version_indexes:
+        Version_indexes[version] = Version_index(version)
+    return Version_indexes[version]
+
+def find_terms(anno_version, automaton, unchanged=(), unchanged_automaton=None):
+    r'''Returns the Annotations for the Terms in automaton where they are used in
+    anno_version.
+
+    The paragraph_ids in unchanged are only scanned for the Terms in
+    unchanged_automaton (if it isn't None).  The Terms only match words one right after
+    the other in the same sentence.
+    '''
+    index = get_version_index(anno_version)
+    words_map = synonym_map.get_map()
+    annotations = []
+    current = automaton
+    state = 0
+    last_position = None
+    offsets = []     # char_offset of each word of the run of words that state is on
+    for paragraph_id, sentence_number, word_number, word_id, char_offset, length \
+     in index.words:
+        if (paragraph_id, sentence_number, word_number - 1) != last_position:
+            current = unchanged_automaton if paragraph_id in unchanged else automaton
+            state = 0
+            offsets = []
+        last_position = paragraph_id, sentence_number, word_number
+        if current is None:
+            continue
+        offsets.append(char_offset)
+        state = current.step(state, words_map.synonym_group(word_id))
+        for num_words, term in current.outputs[state]:
+            if term.base_citation is None or \
+               index.citations[paragraph_id].startswith(term.base_citation):
+                start = offsets[-num_words]
+                annotations.append(models.Annotation(
+                  paragraph_id=paragraph_id,
+                  type="definition",
+                  char_offset=start,
+                  length=char_offset + length - start,
+                  info=str(term.definition_id),
+                  term=term))
+    return annotations
+
+def build_automaton(terms):
+    r'''Returns a Phrase_automaton for terms, or None if there are no terms.
+    '''
+    if not terms:
+        return None
+    words_map = synonym_map.get_map()
+    automaton = Phrase_automaton()
+    for term in terms:
+        automaton.add([words_map.synonym_group(words_map.word_id(w))
+                       for w in term.text.split()],
+                      term)
+    automaton.build()
+    return automaton
+
+
+def definitions_items(def_ver_obj):
+    r'''Generates (definitions, base_citation) for each Definitions item in def_ver_obj.
+    '''
     for definitions in models.Item.objects.filter(Q(paragraph__text='Definitions.')
                                                   | Q(paragraph__text='Definition.')
                                                   | Q(paragraph__text='Definitions')
                                                   | Q(paragraph__text='Definition'),
-                                                  version_id=def_version, has_title=True,
+                                                  version_id=def_ver_obj.id,
+                                                  has_title=True,
                                                   paragraph__body_order=0):
         if def_ver_obj.source == Source_61B:
             base_citation = definitions.citation[: definitions.citation.index('.')]
         else:
             base_citation = None
-        print(f"doing definitions from {definitions.citation} id={definitions.id} to "
-              f"{anno_versions=} {base_citation=}")
-        if definitions.item_set.exists():
-            print(f"item_set exists")
-            for definition in definitions.item_set.all():
-                for anno_version in anno_versions:
-                    annotate(anno_version, definition, base_citation)
+        print(f"doing definitions from {definitions.citation} id={definitions.id} "
+              f"{base_citation=}")
+        yield definitions, base_citation
+
+def synonym_ids(words):
+    r'''Returns the synonym Word.ids of each of words, as stored in Term.synonym_ids.
+    '''
+    words_map = synonym_map.get_map()
+    return ' '.join(','.join(map(str, sorted(words_map.synonyms(words_map.word_id(w)))))
+                    for w in words)
+
+def get_version_terms(def_ver_obj):
+    r'''Returns the Terms defined in def_ver_obj, creating them the first time.
+    '''
+    terms = models.Term.objects.filter(version=def_ver_obj).select_related('definition') \
+                               .order_by('id')
+    if not terms.exists():
+        new_terms = []
+        for definitions, base_citation in definitions_items(def_ver_obj):
+            if definitions.item_set.exists():
+                print(f"item_set exists")
+                definition_items = definitions.item_set.all()
+            else:
+                print(f"item_set empty")
+                definition_items = [definitions]
+            for definition in definition_items:
+                for words in get_terms(definition):
+                    new_terms.append(models.Term(version=def_ver_obj,
+                                                 definition=definition,
+                                                 base_citation=base_citation,
+                                                 text=' '.join(words).lower(),
+                                                 synonym_ids=synonym_ids(words)))
+        models.Term.objects.bulk_create(new_terms)
+    return list(terms)
+
+def term_key(term, synonym_ids):
+    return term.definition.citation, term.base_citation, synonym_ids
+
+
+def paragraphs_of(version):
+    return Q(paragraph__item__version_id=version) \
+         | Q(paragraph__cell__table__item__version_id=version)
+
+def annotated_by(anno_version, def_source):
+    r'''Returns the set of the versions of def_source whose Terms annotate anno_version.
+    '''
+    return set(models.Annotation.objects.filter(paragraphs_of(anno_version),
+                                                term__version__source=def_source)
+                                        .values_list('term__version_id', flat=True)
+                                        .distinct())
+
+def find_prior(anno_version, def_source):
+    r'''Returns (prior anno version, prior def version) for the latest version of the
+    source of anno_version (up to anno_version itself) that has been annotated with the
+    Terms of def_source, or (None, None).
+    '''
+    anno_source = models.Version.objects.get(id=anno_version).source
+    for prior in models.Version.objects.filter(source=anno_source, id__lte=anno_version) \
+                                       .order_by('-id').values_list('id', flat=True):
+        def_versions = annotated_by(prior, def_source)
+        if def_versions:
+            return prior, max(def_versions)
+    return None, None
+
+def paragraph_keys(version):
+    r'''Returns {(citation, text): paragraph_id} for the paragraphs in version.
+
+    Any (citation, text) shared by more than one paragraph is left out, so that those
+    paragraphs are scanned again.
+    '''
+    ans = {}
+    duplicates = set()
+    for id, item_citation, cell_citation, text \
+     in models.Paragraph.objects.filter(Q(item__version_id=version)
+                                        | Q(cell__table__item__version_id=version)) \
+                                .values_list('id', 'item__citation',
+                                             'cell__table__item__citation', 'text'):
+        key = item_citation or cell_citation, text
+        if key in ans:
+            duplicates.add(key)
+        ans[key] = id
+    for key in duplicates:
+        del ans[key]
+    return ans
+
+def annotate_version(def_ver_obj, terms, anno_version):
+    r'''Annotates terms (the Terms of def_ver_obj) where they are used in anno_version.
+
+    Only scans the paragraphs and Terms that have changed since the prior annotations
+    (see find_prior), unless Incremental is False.  A Term has changed if its words
+    don't have the synonyms recorded in its synonym_ids now.
+    '''
+    current_ids = {term: synonym_ids(term.text.split()) for term in terms}
+    prior, prior_def = find_prior(anno_version, def_ver_obj.source)
+    if prior == anno_version and prior_def == def_ver_obj.id and Incremental and \
+       all(term.synonym_ids == current_ids[term] for term in terms):
+        print(f"{anno_version=} already annotated from version {def_ver_obj.id}")
+        return
+    term_map = {}          # {prior Term.id: Term}
+    paragraph_map = {}     # {prior paragraph_id: paragraph_id}
+    if prior is not None and Incremental:
+        prior_terms = {}   # {term_key: [Term]}
+        for term in models.Term.objects.filter(version_id=prior_def) \
+                                       .select_related('definition').order_by('id'):
+            prior_terms.setdefault(term_key(term, term.synonym_ids), []).append(term)
+        new_terms = {}     # {term_key: [Term]}
+        for term in terms:
+            new_terms.setdefault(term_key(term, current_ids[term]), []).append(term)
+        for key, key_terms in new_terms.items():
+            if len(prior_terms.get(key, ())) == len(key_terms):
+                for prior_term, term in zip(prior_terms[key], key_terms):
+                    term_map[prior_term.id] = term
+        if prior == anno_version:
+            paragraph_map = {id: id for id in get_version_index(anno_version).citations}
         else:
-            print(f"item_set empty")
-            for anno_version in anno_versions:
-                annotate(anno_version, definitions, base_citation)
+            prior_keys = paragraph_keys(prior)
+            paragraph_map = {prior_keys[key]: id
+                             for key, id in paragraph_keys(anno_version).items()
+                             if key in prior_keys}
+    annotations = []
+    if term_map and paragraph_map:
+        for paragraph_id, char_offset, length, term_id \
+         in models.Annotation.objects.filter(paragraphs_of(prior),
+                                             term__version_id=prior_def) \
+                                     .values_list('paragraph_id', 'char_offset', 'length',
+                                                  'term_id'):
+            if paragraph_id in paragraph_map and term_id in term_map:
+                term = term_map[term_id]
+                annotations.append(models.Annotation(
+                  paragraph_id=paragraph_map[paragraph_id],
+                  type="definition",
+                  char_offset=char_offset,
+                  length=length,
+                  info=str(term.definition_id),
+                  term=term))
+    num_copied = len(annotations)
+    mapped = set(term_map.values())
+    added = [term for term in terms if term not in mapped]
+    annotations.extend(find_terms(anno_version, build_automaton(terms),
+                                  set(paragraph_map.values()), build_automaton(added)))
+    if term_map and paragraph_map:
+        print(f"{anno_version=}: copied {num_copied} annotations from version {prior} "
+              f"({len(term_map)} terms and {len(paragraph_map)} paragraphs unchanged), "
+              f"found {len(annotations) - num_copied} ({len(added)} terms added)")
+    else:
+        print(f"{anno_version=}: found {len(annotations)} annotations")
+    replaced = Q(type='definition', term__isnull=True,
+                 info__in=models.Item.objects.filter(version__source=def_ver_obj.source)
+                                     .values_list(Cast('id', CharField())))
+    if prior == anno_version:
+        replaced |= Q(term__version_id__in={prior_def, def_ver_obj.id})
+    models.Annotation.objects.filter(paragraphs_of(anno_version)).filter(replaced).delete()
+    models.Annotation.objects.bulk_create(annotations, batch_size=500)
+
+
+def load_definitions(def_version, anno_versions):
+    r'''Annotates the terms defined in def_version where they are used in anno_versions.
+
+    Commits the Annotations for each of anno_versions as it goes, so that the views
+    aren't locked out of the database while this runs.  The anno_versions that already
+    have Annotations for the Terms of def_version are skipped (unless the synonyms of
+    some of the Terms have changed, or Incremental is False), so if an earlier
+    load_definitions didn't finish, this picks up where it left off.
+
+    Sets def_version's definitions_loaded when done.  That isn't checked here (running
+    this again is how the annotations are redone), only by publish, which warns when a
+    version of 719 or 61B is published before its terms have been loaded.
+    '''
+    def_ver_obj = models.Version.objects.get(id=def_version)
+    terms = get_version_terms(def_ver_obj)
+    print(f"load_definitions {def_version=}: {len(terms)} terms, {anno_versions=}")
+    for anno_version in anno_versions:
+        try:
+            with transaction.atomic():
+                annotate_version(def_ver_obj, terms, anno_version)
+        finally:
+            Version_indexes.clear()
     def_ver_obj.definitions_loaded = True
     def_ver_obj.save()
+    # the Annotations of a published version may have changed
+    transaction.on_commit(result_cache.invalidate)
 
 
 Def_sources = Source_719, Source_61B
@@ -124,8 +416,11 @@ Anno_map = {  # maps def_source to anno_sources
 }
 
 
-@transaction.atomic
 def run(*args):
+    global Incremental
+    if 'full' in args:
+        Incremental = False
+        args = tuple(arg for arg in args if arg != 'full')
     if 'help' in args:
         print("load_definitions help:")
         print("  This loads references to terms defined in def-docs (719 or 61b) as")
@@ -134,6 +429,9 @@ def run(*args):
         print("  719 definitions are loaded into all documents (719, 61B and GG).")
         print("  61B definitions are only loaded into the 61B document.")
         print()
+        print("  Only the paragraphs and terms that have changed since the prior annotations")
+        print("  are scanned, the rest of the annotations are copied.")
+        print()
         print("  python manage.py runscript load_definitions")
         print("    Loads terms defined in all def-docs as opp_annotations where used in all")
         print("    anno-docs.")
@@ -152,6 +450,9 @@ def run(*args):
         print("                                                            anno-ver version_id.")
         print("    Loads terms defined in version of def-doc as opp_annotations where used in")
         print("    version of anno-doc.")
+        print("  python manage.py runscript load_definitions --script-args full ...")
+        print("    Scans every paragraph for every term, rather than copying the annotations")
+        print("    of the terms and paragraphs that are unchanged.")
         #print("  python manage.py runscript load_definitions --script-args test")
         #print("    Runs test on get_sentences function.")
         print("  python manage.py runscript load_definitions --script-args help")
@@ -162,7 +463,7 @@ def run(*args):
         anno_version = None
         if 'defs-doc' in args:
             defs_name = args[args.index('defs-doc') + 1]
-            defs_version = models.Version.latest(Source_map[defs_name])
+            defs_version = models.Version.latest(Source_map[defs_name], published=False)
         elif 'defs-ver' in args:
             defs_version = int(args[args.index('defs-ver') + 1])
             anno_version = defs_version
@@ -171,20 +472,20 @@ def run(*args):
 
         if 'anno-doc' in args:
             anno_name = args[args.index('anno-doc') + 1]
-            anno_version = models.Version.latest(Source_map[anno_name])
+            anno_version = models.Version.latest(Source_map[anno_name], published=False)
         elif 'anno-ver' in args:
             anno_version = int(args[args.index('anno-ver') + 1])
 
         if defs_version is None:
             if anno_version is None:
                 for source in Def_sources:
-                    defs_version = models.Version.latest(source)
-                    anno_versions = [models.Version.latest(anno_source)
+                    defs_version = models.Version.latest(source, published=False)
+                    anno_versions = [models.Version.latest(anno_source, published=False)
                                      for anno_source in Anno_map[source]]
                     load_definitions(defs_version, anno_versions)
             else:
                 anno_source = models.Version.objects.get(id=anno_version).source
-                def_versions = [(models.Version.latest(def_source)
+                def_versions = [(models.Version.latest(def_source, published=False)
                                    if anno_source != def_source
                                    else anno_version)
                                 for def_source in Def_map[anno_source]]
@@ -193,9 +494,10 @@ def run(*args):
         elif anno_version is not None:
             load_definitions(defs_version, [anno_version])
         else:
-            anno_versions = [models.Version.latest(anno_source)
+            anno_versions = [models.Version.latest(anno_source, published=False)
                              for anno_source in Anno_map[Source_map[defs_name]]]
             load_definitions(defs_version, anno_versions)
 
         print("next: python manage.py runscript show_outline")
+        print("then: python manage.py runscript publish")
 
@@ -4,21 +4,36 @@ from pathlib import Path
 
 from django.db import transaction
 
-from operating_procedures import models
+from operating_procedures import models, synonym_map
 
 
 Synonyms_file = Path(__file__).parents[2] / 'synonyms.txt'
 
 
 def load_synonyms(synonyms_file):
+    r'''Adds the synonyms in synonyms_file to the Synonym_groups.
+
+    Each line is a group of synonyms, separated by spaces.  Lines starting with # are
+    ignored.
+    '''
+    # the web workers reload their synonym maps once these are committed
+    transaction.on_commit(synonym_map.invalidate)
     with open(synonyms_file, 'r') as synonyms:
-        for line in synonyms:
-            line = line.strip()
-            if line and line[0] != '#':
-                words = list(map(models.Word.lookup_word, line.split()))
-                first = words[0]
-                for second in words[1:]:
-                    models.Synonym.add_synonym(first.id, second.id)
+        lines = [line.split() for line in map(str.strip, synonyms)
+                              if line and line[0] != '#']
+    texts = set(text.lower() for line in lines for text in line)
+    word_ids = dict(models.Word.objects.filter(text__in=texts).values_list('text', 'id'))
+    models.Word.objects.bulk_create(models.Word(text=text)
+                                    for text in sorted(texts - word_ids.keys()))
+    word_ids = dict(models.Word.objects.filter(text__in=texts).values_list('text', 'id'))
+    groups = models.Synonym_groups.from_db()
+    for line in lines:
+        first = line[0].lower()
+        for second in line[1:]:
+            second = second.lower()
+            if not groups.add_synonym(word_ids[first], word_ids[second]):
+                raise AssertionError(f"load_synonyms: duplicate {first} {second}")
+    print(f"load_synonyms: {groups.save()} Words changed synonym_group")
 
 
 @transaction.atomic
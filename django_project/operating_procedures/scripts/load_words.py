@@ -1,28 +1,181 @@
 # load_words.py
 
+from bisect import bisect_left
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice, zip_longest
+import multiprocessing
 import re
+import time
 
-from django.db import transaction
+from django.db.models import Q
 
-from operating_procedures import models
+from operating_procedures import fts, models, segments
+from operating_procedures.scripts.bulk_writer import Bulk_writer
 from operating_procedures.scripts.sources import *
 
 
-def index_paragraph(paragraph):
-    global words
-    for sentence_number, (sentence_offset, s) in enumerate(get_sentences(paragraph.text), 1):
-        for word_number, (word_offset, w) in enumerate(get_words(s), 1):
-            word_id = models.Word.lookup_word(w).id
-            models.WordRef(paragraph=paragraph,
-                           word_id=word_id,
-                           sentence_number=sentence_number,
-                           word_number=word_number,
-                           char_offset=sentence_offset + word_offset,
-                           length=len(w)).save()
+Workers = 1        # number of processes tokenizing the paragraphs (see load_words)
+Chunk_size = 200   # number of paragraphs sent to a worker at a time
+
+
+Copy_unchanged = True   # copy the occurrences in unchanged paragraphs from the prior version
+
+
+def paragraph_texts(version, skip=()):
+    r'''Generates (paragraph_id, text) for each paragraph in version, except the
+    paragraph_ids in skip.
+    '''
+    for item in models.Item.objects.filter(version_id=version) \
+                                   .prefetch_related('paragraph_set',
+                                                     'table_set__tablecell_set'
+                                                     '__paragraph_set'):
+        for p in item.paragraph_set.all():
+            print(f"paragraph {item.citation}, {p.body_order}")
+            if p.id not in skip:
+                yield p.id, p.text
+        for t in item.table_set.all():
+            print(f"table {item.citation}, {t.body_order}")
+            for c in t.tablecell_set.all():
+                for p in c.paragraph_set.all():
+                    if p.id not in skip:
+                        yield p.id, p.text
+
+def copy_unchanged(ver_obj, occurrences):
+    r'''Copies the occurrences in the paragraphs in ver_obj whose text is unchanged from
+    the latest version of ver_obj.source before ver_obj that has had load_words run on it.
+
+    The occurrences are copied from the Postings of that version into occurrences
+    ({word_id: [occurrence]}).  Returns the set of paragraph_ids copied.
+    '''
+    prior = models.Version.objects.filter(source=ver_obj.source, id__lt=ver_obj.id,
+                                          wordrefs_loaded=True).order_by('-id').first()
+    if prior is None:
+        return set()
+    prior_paragraphs = {text: id for id, text in paragraphs_in(prior)}
+    copies = {prior_paragraphs[text]: id for id, text in paragraphs_in(ver_obj)
+                                         if text in prior_paragraphs}
+    num_copied = 0
+    for posting in models.Posting.objects.filter(version=prior).iterator(chunk_size=1000):
+        copied = [(copies[occurrence[0]],) + occurrence[1:]
+                  for occurrence in posting.unpack()
+                  if occurrence[0] in copies]
+        if copied:
+            occurrences.setdefault(posting.word_id, []).extend(copied)
+            num_copied += len(copied)
+    print(f"copied {num_copied} words in {len(copies)} paragraphs unchanged from "
+          f"version {prior.id}")
+    return set(copies.values())
+
+def paragraphs_in(version):
+    r'''Returns [(paragraph_id, text)] for all of the paragraphs in version.
+    '''
+    return models.Paragraph.objects.filter(Q(item__version=version)
+                                           | Q(cell__table__item__version=version)) \
+                                   .values_list('id', 'text')
+
+def chunks(iterable, size):
+    r'''Generates lists of size elements from iterable (the last may be shorter).
+    '''
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+def tokenize(paragraphs):
+    r'''Returns [(paragraph_id, word, sentence_number, word_number, char_offset, length)]
+    for the words in paragraphs ([(paragraph_id, text)]).
 
-def index_cell(cell):
-    for p in cell.paragraph_set.all():
-        index_paragraph(p)
+    This is what the Pool worker processes run.
+    '''
+    return [(paragraph_id, w, sentence_number, word_number, char_offset, len(w))
+            for paragraph_id, text in paragraphs
+            for sentence_number, word_number, char_offset, w in get_tokens(text)]
+
+def add_occurrences(tokens, occurrences):
+    r'''Adds each of the tokens from tokenize to occurrences ({word_id: [occurrence]}).
+
+    New Words are added to writer.
+    '''
+    for paragraph_id, w, sentence_number, word_number, char_offset, length in tokens:
+        occurrences.setdefault(lookup_word(w), []) \
+                   .append((paragraph_id, sentence_number, word_number, char_offset,
+                            length))
+
+def write_postings(version, occurrences):
+    r'''Replaces the Postings of version with ones packed from occurrences
+    ({word_id: [occurrence]}).
+
+    Returns the number of Postings written.
+    '''
+    models.Posting.objects.filter(version_id=version).delete()
+    posting_writer = Bulk_writer()
+    for word_id, word_occurrences in occurrences.items():
+        word_occurrences.sort()
+        posting_writer.add(models.Posting.pack(version, word_id, word_occurrences))
+    posting_writer.flush()
+    print(f"wrote {len(occurrences)} Postings for {version=}")
+    return len(occurrences)
+
+def posting_occurrences(version):
+    r'''Returns {word_id: [occurrence]} from the Postings of version.
+    '''
+    return {posting.word_id: posting.unpack()
+            for posting in models.Posting.objects.filter(version_id=version)
+                                                 .iterator(chunk_size=1000)}
+
+def count_words(version, occurrences):
+    r'''Sets Paragraph.num_words for the paragraphs in version from occurrences
+    ({word_id: [occurrence]}).
+    '''
+    counts = Counter(occurrence[0] for word_occurrences in occurrences.values()
+                                   for occurrence in word_occurrences)
+    paragraphs = list(models.Paragraph.objects
+                            .filter(Q(item__version_id=version)
+                                    | Q(cell__table__item__version_id=version))
+                            .only('id'))
+    for paragraph in paragraphs:
+        paragraph.num_words = counts[paragraph.id]
+    models.Paragraph.objects.bulk_update(paragraphs, ['num_words'], batch_size=500)
+
+def write_segment(version):
+    r'''Writes the segments.Segment for version from its Postings.
+    '''
+    segments.write(version,
+                   models.Posting.objects.filter(version_id=version)
+                                         .values_list('word_id', 'occurrences'),
+                   models.Word.objects.values_list('text', 'id'),
+                   models.Paragraph.in_version(version),
+                   models.Item.objects.filter(version_id=version)
+                                      .values_list('id', 'parent_id'))
+    print(f"wrote {segments.segment_path(version)}")
+
+def write_fts(version):
+    r'''Fills the fts table for version, if the database has FTS5 (SQLite).
+    '''
+    if fts.available():
+        num_paragraphs = fts.write_table(version)
+        print(f"wrote {num_paragraphs} paragraphs to {fts.table_name(version)}")
+
+def lookup_word(w):
+    r'''Returns the Word.id for w, adding a new Word to writer if necessary.
+
+    Like models.Word.lookup_word, but looks in words (loaded by load_vocabulary) rather
+    than the database.
+    '''
+    text = w.lower()
+    word_id = words.get(text)
+    if word_id is None:
+        word_id = words[text] = writer.add(models.Word(text=text)).id
+    return word_id
+
+def load_vocabulary():
+    r'''Sets words to {text: Word.id} for all of the Words in the database.
+    '''
+    global words
+    words = dict(models.Word.objects.values_list('text', 'id'))
 
 
 def get_sentences(text, trace=False):
@@ -89,38 +242,215 @@ def is_word(w):
     return w and w.isalpha() and len(w) > 1
 
 
+# The letters that word_re's [a-z] matches with IGNORECASE.  Spelled out, because a
+# case-sensitive class is twice as fast.
+Letters = 'a-zA-Z\u0130\u0131\u017f\u212a'
+
+# What word_re finds, less the words that get_words skips.
+token_re = re.compile(rf'\b(?!(?:a|s|ss)\b)[{Letters}]+\b')
+
+# A word right before the end of the text searched (see get_words_end).
+last_word_re = re.compile(rf'\b[{Letters}]+\Z')
+
+# The periods that might end a sentence (see check_end).
+period_re = re.compile(r'\.(?=\s|\Z)')
+
+abbr_re = re.compile(r'\bss?\.', re.IGNORECASE)  # what s_re looks for
+
+def get_tokens(text):
+    r'''Returns [(sentence_number, word_number, char_offset, word)] for the words in text.
+
+    This is the same as running get_words on each of the get_sentences.  But rather than
+    a regex match per word, and a find, rfind and regex match per period, it finds the
+    periods ending the sentences in one scan, and then the words in each sentence in
+    one finditer.
+
+        >>> for token in get_tokens('As provided by ss. 719.606 and s. 719.61. Tenants '
+        ...                         'shall have a right.'):
+        ...     print(token)
+        (1, 1, 0, 'As')
+        (1, 2, 3, 'provided')
+        (1, 3, 12, 'by')
+        (1, 4, 27, 'and')
+        (2, 1, 42, 'Tenants')
+        (2, 2, 50, 'shall')
+        (2, 3, 56, 'have')
+        (2, 4, 63, 'right')
+    '''
+    ans = []
+    sentence_start = 0
+    has_newline = '\n' in text
+    for sentence_number, end in enumerate(chain(sentence_ends(text), (len(text),)), 1):
+        words_end = end
+        if has_newline:
+            words_end = get_words_end(text, sentence_start, end)
+        ans.extend([(sentence_number, word_number, m.start(), m.group())
+                    for word_number, m
+                     in enumerate(token_re.finditer(text, sentence_start, words_end), 1)])
+        sentence_start = end + 1
+    return ans
+
+def get_words_end(text, start, end):
+    r'''Returns where get_words stops looking for words in text[start: end].
+
+    Word_re doesn't match across a newline, so this is the first newline that get_words
+    doesn't skip over as the character after a word.
+    '''
+    newline = text.find('\n', start, end)
+    while newline >= 0:
+        if not last_word_re.search(text, start, newline):
+            return newline
+        newline = text.find('\n', newline + 1, end)
+    return end
+
+def sentence_ends(text):
+    r'''Generates the index of each period in text that ends a sentence.
+
+    The same periods as get_sentences, without its second look at the text before and
+    after each period.
+    '''
+    sentence_start = 0
+    abbrs = None     # start of each abbr_re match in text, only found if needed
+    for m in period_re.finditer(text):
+        end = m.start()
+        # check_end: a space within 3 chars of the period means s_re is tried from that
+        # space, and s_re matches any s. or ss. from there to the end of the line.
+        sp = text.rfind(' ', max(sentence_start, end - 3), end)
+        if sp >= 0 or end < 3:
+            sp = max(sp, 0)
+            if abbrs is None:
+                abbrs = [a.start() for a in abbr_re.finditer(text)]
+            i = bisect_left(abbrs, sp)
+            if i < len(abbrs) and '\n' not in text[sp: abbrs[i]]:
+                continue
+        yield end
+        sentence_start = end + 1
+
+def get_tokens_by_sentence(text):
+    r'''Generates the same tokens as get_tokens, using get_sentences and get_words.
+    '''
+    for sentence_number, (sentence_offset, s) in enumerate(get_sentences(text), 1):
+        for word_number, (word_offset, w) in enumerate(get_words(s), 1):
+            yield sentence_number, word_number, sentence_offset + word_offset, w
+
+def check_tokens(texts):
+    r'''Compares get_tokens to get_tokens_by_sentence on each of texts.
+
+    Prints the texts that differ.  Returns the number of texts that differ.
+    '''
+    differ = 0
+    for text in texts:
+        tokens = get_tokens(text)
+        expected = list(get_tokens_by_sentence(text))
+        if tokens != expected:
+            differ += 1
+            print(f"check_tokens: {text!r}")
+            for got, exp in zip_longest(tokens, expected):
+                if got != exp:
+                    print(f"  got {got}, expected {exp}")
+                    break
+    return differ
+
+def token_benchmark(texts, repeat=5):
+    r'''Prints the tokens/sec for get_tokens and get_tokens_by_sentence over texts.
+
+    Then over one paragraph of 2000 short sentences.  Check_end's s_re looks at the
+    rest of the paragraph for each of these, so get_sentences takes time proportional
+    to the square of the length of the paragraph.
+    '''
+    long_text = 'The unit owner signs it. ' * 2000
+    for name, fn_texts, fn_repeat in (('paragraphs', texts, repeat),
+                                      ('long paragraph', [long_text], 1)):
+        print(f"{name}:")
+        for fn in get_tokens_by_sentence, get_tokens:
+            start = time.perf_counter()
+            for _ in range(fn_repeat):
+                num_tokens = sum(len(list(fn(text))) for text in fn_texts)
+            elapsed = time.perf_counter() - start
+            print(f"  {fn.__name__}: {num_tokens} tokens, "
+                  f"{num_tokens * fn_repeat / elapsed:,.0f} tokens/sec")
+
+
 def load_words(version):
+    r'''Indexes the words in version.
+
+    The paragraphs whose text is unchanged from the prior version of the same source have
+    their occurrences copied from that version's Postings (unless Copy_unchanged is
+    False).  The rest are tokenized Chunk_size at a time, by Workers processes if
+    Workers > 1.  So the time taken is mostly for the paragraphs that have changed.
+    The occurrences of each word are collected in memory and packed into a Posting per
+    word (see write_postings), which is what load_definitions reads.  The WordRefs
+    aren't stored: the Postings hold the same occurrences, and search makes WordRefs
+    from them for the paragraphs it shows.  The new Words and the Postings are written
+    a batch at a time, so that the views aren't locked out of the database while this
+    runs.  The Postings are then written to the segment file that search reads (see
+    write_segment).  The text of the paragraphs also goes into an FTS5 table, for the
+    optional fts search backend (see write_fts).
+    '''
+    global writer
     ver_obj = models.Version.objects.get(id=version)
     print(f"loading words for {ver_obj.source!r} {version=}")
     if ver_obj.wordrefs_loaded:
         print("ERROR: load_words already run on version", version)
     else:
-        for item in models.Item.objects.filter(version_id=version):
-            for p in item.paragraph_set.all():
-                print(f"paragraph {item.citation}, {p.body_order}")
-                index_paragraph(p)
-            for t in item.table_set.all():
-                print(f"table {item.citation}, {t.body_order}")
-                for c in t.tablecell_set.all():
-                    index_cell(c)
+        load_vocabulary()
+        occurrences = {}  # {word_id: [occurrence]}
+        copied = copy_unchanged(ver_obj, occurrences) if Copy_unchanged else set()
+        writer = Bulk_writer()
+        paragraphs = chunks(paragraph_texts(version, copied), Chunk_size)
+        if Workers > 1:
+            with ProcessPoolExecutor(max_workers=Workers,
+                                     mp_context=multiprocessing.get_context('fork')) \
+              as pool:
+                add_occurrences(chain.from_iterable(pool.map(tokenize, paragraphs)),
+                                occurrences)
+        else:
+            add_occurrences(chain.from_iterable(map(tokenize, paragraphs)), occurrences)
+        writer.flush()
+        count_words(version, occurrences)
+        write_postings(version, occurrences)
+        write_segment(version)
+        write_fts(version)
         ver_obj.wordrefs_loaded = True
+        if ver_obj.state == 'building':
+            ver_obj.state = 'indexed'
         ver_obj.save()
 
 
-@transaction.atomic
 def run(*args):
-    global words
-    words = {}
+    global Workers, Copy_unchanged
+    if 'full' in args:
+        Copy_unchanged = False
+        args = tuple(arg for arg in args if arg != 'full')
+    if 'workers' in args:
+        i = args.index('workers')
+        Workers = int(args[i + 1])
+        args = args[:i] + args[i + 2:]
     if 'help' in args:
         print("load_words help:")
         print("  python manage.py runscript load_words")
-        print("    loads opp_wordref from all words in latest versions of 719, 61B and GG")
+        print("    loads opp_posting from all words in latest versions of 719, 61B and GG")
         print("  python manage.py runscript load_words --script-args 719|61b|gg")
-        print("    loads opp_wordref from all words in latest versions of 719, 61B or GG")
+        print("    loads opp_posting from all words in latest versions of 719, 61B or GG")
         print("  python manage.py runscript load_words --script-args 'version' version_id")
-        print("    loads opp_wordref from all words in indicated version")
+        print("    loads opp_posting from all words in indicated version")
+        print("  python manage.py runscript load_words --script-args workers 4 ...")
+        print("    tokenizes the paragraphs in 4 processes (default 1)")
+        print("  python manage.py runscript load_words --script-args full ...")
+        print("    tokenizes every paragraph, rather than copying the words of the")
+        print("    paragraphs that are unchanged from the prior version")
+        print("  python manage.py runscript load_words --script-args postings [version N]")
+        print("    rewrites Paragraph.num_words, the segment files and fts tables from the")
+        print("    Postings of the latest versions of 719, 61B and GG (or version N),")
+        print("    without loading the words again")
         print("  python manage.py runscript load_words --script-args test")
         print("    runs test on get_sentences function")
+        print("  python manage.py runscript load_words --script-args check-tokens")
+        print("    checks that get_tokens gets the same words as get_sentences and")
+        print("    get_words, over all of the paragraphs in the database")
+        print("  python manage.py runscript load_words --script-args token-benchmark [repeat]")
+        print("    prints tokens/sec for get_tokens and get_sentences/get_words over all")
+        print("    of the paragraphs in the database")
         print("  python manage.py runscript load_words --script-args help")
         print("    prints this help message")
     elif 'test' in args:
@@ -129,6 +459,28 @@ def run(*args):
             print(s_offset, len(s), repr(s))
             for w_offset, w in get_words(s):
                 print("word:", w_offset, s_offset + w_offset, repr(w))
+    elif 'postings' in args:
+        if 'version' in args:
+            version = int(args[args.index('version') + 1])
+            count_words(version, posting_occurrences(version))
+            write_segment(version)
+            write_fts(version)
+        else:
+            for source in Sources:
+                version = models.Version.latest(source, published=False)
+                if models.Version.objects.get(id=version).wordrefs_loaded:
+                    count_words(version, posting_occurrences(version))
+                    write_segment(version)
+                    write_fts(version)
+    elif 'check-tokens' in args:
+        texts = models.Paragraph.objects.values_list('text', flat=True)
+        differ = check_tokens(texts)
+        print(f"check_tokens: {differ} of {len(texts)} paragraphs differ")
+    elif 'token-benchmark' in args:
+        i = args.index('token-benchmark')
+        repeat = int(args[i + 1]) if len(args) > i + 1 else 5
+        token_benchmark(list(models.Paragraph.objects.values_list('text', flat=True)),
+                        repeat)
     elif 'version' in args:
         version = int(args[-1])
         load_words(version)
@@ -137,14 +489,14 @@ def run(*args):
               f"--script-args version {version}")
     elif args:
         source = args[0]
-        version = models.Version.latest(Source_map[source])
+        version = models.Version.latest(Source_map[source], published=False)
         load_words(version)
         print_load_synonyms()
         print(f"next: python manage.py runscript load_definitions "
               f"--script-args {source}")
     else:
         for source in Sources:
-            version = models.Version.latest(source)
+            version = models.Version.latest(source, published=False)
             load_words(version)
         print_load_synonyms()
         print(f"next: python manage.py runscript load_definitions")
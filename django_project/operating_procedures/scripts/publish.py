@@ -0,0 +1,44 @@
+# publish.py
+
+from operating_procedures import models
+from operating_procedures.scripts.sources import *
+
+
+def publish(version):
+    r'''Publishes version, so that the views show it rather than the version they were
+    showing.
+    '''
+    ver_obj = models.Version.objects.get(id=version)
+    if ver_obj.state == 'published':
+        print(f"version {version} of {ver_obj.source!r} is already published")
+    elif ver_obj.state != 'indexed':
+        print(f"ERROR: version {version} of {ver_obj.source!r} is {ver_obj.state}, "
+              "run load_words on it first")
+    else:
+        if not ver_obj.definitions_loaded and ver_obj.source in (Source_719, Source_61B):
+            print(f"WARNING: load_definitions hasn't been run on version {version}")
+        ver_obj.publish()
+        print(f"published version {version} of {ver_obj.source!r}")
+
+
+def run(*args):
+    if 'help' in args:
+        print("publish help:")
+        print("  python manage.py runscript publish")
+        print("    publishes the latest versions of 719, 61B and GG, so that the web")
+        print("    pages show them")
+        print("  python manage.py runscript publish --script-args 719|61b|gg")
+        print("    publishes the latest version of 719, 61B or GG")
+        print("  python manage.py runscript publish --script-args 'version' version_id")
+        print("    publishes the indicated version")
+        print("  python manage.py runscript publish --script-args help")
+        print("    prints this help message")
+        print("  the version must have been through load_words (and, for 719 and 61B,")
+        print("  load_definitions) first")
+    elif 'version' in args:
+        publish(int(args[args.index('version') + 1]))
+    elif args:
+        publish(models.Version.latest(Source_map[args[0]], published=False))
+    else:
+        for source in Sources:
+            publish(models.Version.latest(source, published=False))
@@ -2,9 +2,21 @@
 
 import unittest
 import doctest
-from . import scrape_html
+from . import fixture_server, load_definitions, load_words, scrape_html
+from .. import fts, models, postings, query, ranking, result_cache, segments, synonym_map
 
 
 def load_tests(loader, tests, ignore):
     tests.addTests(doctest.DocTestSuite(scrape_html))
+    tests.addTests(doctest.DocTestSuite(fixture_server))
+    tests.addTests(doctest.DocTestSuite(load_words))
+    tests.addTests(doctest.DocTestSuite(load_definitions))
+    tests.addTests(doctest.DocTestSuite(postings))
+    tests.addTests(doctest.DocTestSuite(segments))
+    tests.addTests(doctest.DocTestSuite(query))
+    tests.addTests(doctest.DocTestSuite(ranking))
+    tests.addTests(doctest.DocTestSuite(fts))
+    tests.addTests(doctest.DocTestSuite(synonym_map))
+    tests.addTests(doctest.DocTestSuite(models))
+    tests.addTests(doctest.DocTestSuite(result_cache))
     return tests
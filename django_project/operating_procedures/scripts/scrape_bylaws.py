@@ -3,9 +3,8 @@
 from pathlib import Path
 import re
 
-from django.db import transaction
-
 from operating_procedures import models
+from operating_procedures.scripts.bulk_writer import Bulk_writer
 
 
 Source = 'officialrecords.mypinellasclerk.org'
@@ -26,15 +25,28 @@ def get_line(skip_blank_lines=False):
 
 Item_re = re.compile(r'(ARTICLE [IVX]+|[0-9]{1,2}(?:\.[0-9]*)?|[a-z]\.)(?: +(.*)|(?![0-9a-zA-Z]))')
 
+Resume_from = None  # Checkpoint to resume from
+
 def scrape(trace=False):
     r'''Expects a list of articles.
+
+    Commits what has been written so far (see Checkpoint) at the start of each article.
     '''
     global Infile, History
     item_order = 0
     History = []   # list of [item, body_order]
     with Source_file.open() as Infile:
         line = get_line(skip_blank_lines=True)  # None at EOF
+        if Resume_from is not None and Resume_from.citation:
+            item_order = Resume_from.item_order - 1
+            while line is not None and article_citation(line) != Resume_from.citation:
+                while get_line():  # skip the rest of this block
+                    pass
+                line = get_line(skip_blank_lines=True)  # None at EOF
         while line is not None and not line.startswith('--END--'):
+            if not trace and article_citation(line):
+                models.Checkpoint.save_progress(writer, version_obj, article_citation(line),
+                                                0, item_order + 1)
             item_order += 1
             process_item(line, item_order, trace)
             line = get_line(skip_blank_lines=True)  # None at EOF
@@ -42,6 +54,15 @@ def scrape(trace=False):
             set_num_elements(trace)
 
 
+def article_citation(line):
+    r'''Returns the citation of the ARTICLE that line starts, or None.
+    '''
+    m = Item_re.match(line)
+    if m and m.group(1).startswith('ARTICLE '):
+        return "GG " + m.group(1)
+    return None
+
+
 def process_item(line, item_order, trace):
     global History
 
@@ -151,10 +172,10 @@ def create_item(citation, number, title, item_order, parent=None, body_order=Non
     else:
         #print(f"create_item {citation=} parent={parent and parent.citation} {item_order=} "
         #      f"{body_order=}")
-        item = models.Item.objects.create(version=version_obj, citation=citation,
-                                          number=number, parent=parent,
-                                          item_order=item_order, body_order=body_order,
-                                          num_elements=0, has_title=bool(title))
+        item = writer.add(models.Item(version=version_obj, citation=citation,
+                                      number=number, parent=parent,
+                                      item_order=item_order, body_order=body_order,
+                                      num_elements=0, has_title=bool(title)))
     if title:
         create_paragraph(item, 0, title, trace)
     return item
@@ -169,7 +190,7 @@ def set_num_elements(trace):
             print(f"set_num_elements {item=} {num_elements=}")
         else:
             item.num_elements = num_elements
-            item.save()
+            writer.update(item, 'num_elements')
 
 
 def create_paragraph(item, body_order, text, trace):
@@ -178,9 +199,9 @@ def create_paragraph(item, body_order, text, trace):
         para = f"{item} {text[:20]}"
         citation = item
     else:
-        para = models.Paragraph.objects.create(item=item,
-                                               body_order=body_order,
-                                               text=text)
+        para = writer.add(models.Paragraph(item=item,
+                                           body_order=body_order,
+                                           text=text))
         citation = item.citation
     create_cites(citation, para, text, trace)
 
@@ -246,25 +267,27 @@ def create_cites(citation, para, text, trace):
         if trace:
             print(f"  create_cites: {cite3=!r} at {start}")
         else:
-            models.Annotation.objects.create(paragraph=para,
-                                             type='s_cite',
-                                             char_offset=start,
-                                             length=len(cite),
-                                             info=cite3)
+            writer.add(models.Annotation(paragraph=para,
+                                         type='s_cite',
+                                         char_offset=start,
+                                         length=len(cite),
+                                         info=cite3))
 
     if trace and targets:
         print(f"create_cites {citation} NOTICE done: {targets=}")
 
 
-@transaction.atomic
 def run(*args):
-    global version_obj
+    global version_obj, writer, Resume_from
     if 'help' in args:
         print("scrape_bylaws help")
         print("  python manage.py runscript scrape_bylaws")
         print("    - loads bylaws as a new version with today's date")
         print("    - you must also runscript load_words --script-args <version_id>")
         print("      to index all of the words in this new version")
+        print("  python manage.py runscript scrape_bylaws --script-args resume")
+        print("    - continues loading the last version of the bylaws that didn't finish")
+        print("      loading, from the last article started")
         print("  python manage.py runscript scrape_bylaws --script-args trace")
         print("    turns trace on for the load")
         print("  python manage.py runscript scrape_bylaws --script-args test")
@@ -284,9 +307,19 @@ def run(*args):
         print(f"run {args=}")
         scrape(trace=True)
     else:
-        version_obj = models.Version(source=Source)
-        version_obj.save()
+        if 'resume' in args:
+            Resume_from = models.Checkpoint.resume(Source)
+            if Resume_from is None:
+                print(f"no unfinished scrape of {Source} to resume")
+                return
+            version_obj = Resume_from.version
+            print(f"resuming version {version_obj.id} at "
+                  f"{Resume_from.citation or 'the beginning'}")
+        else:
+            version_obj = models.Checkpoint.new_version(Source)
+        writer = Bulk_writer()
         scrape()
+        models.Checkpoint.finish(writer, version_obj)
         print("Bylaws loaded as version", version_obj.id)
         print(f"next: python manage.py runscript load_words --script-args gg")
 
@@ -1,14 +1,22 @@
 # scrape_html.py
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from hashlib import sha256
 from itertools import chain
+import multiprocessing
 import re
+import threading
+import time
+from urllib.parse import urlsplit
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, FeatureNotFound
 from bs4.element import NavigableString
-from django.db import transaction
+from django.db.models import Q
 
 from operating_procedures import models
+from operating_procedures.scripts import fixture_server, http_cache
+from operating_procedures.scripts.bulk_writer import Bulk_writer, Record_writer, write_records
 
 
 casetext_domain = "casetext.com"
@@ -34,6 +42,24 @@ class Find_error(Exception):
 Dump_body = False
 Max_title = 50
 
+Parser = 'html.parser'  # BeautifulSoup tree builder: 'html.parser', 'lxml' or 'html5lib'
+Parsers = 'html.parser', 'lxml', 'html5lib'
+
+Jobs = 8               # number of threads fetching pages concurrently (see fetch_all)
+Workers = 1            # number of processes parsing the 719 sections (see scrape_719)
+Per_domain_limit = 4   # max number of concurrent requests to any one domain
+Max_retries = 5        # for retryable errors (see get)
+Min_backoff = 0.5      # seconds
+Max_backoff = 30.0     # seconds
+
+Retry_status_codes = (429, 500, 502, 503, 504)
+
+Site = None  # e.g., 'http://localhost:8061' to fetch all pages from the fixture_server
+
+Prior_sections = {}  # {citation: (item_id, source_hash)} from the prior version, see
+                     # load_prior_sections.  Empty unless doing an incremental scrape.
+Sections_copied = 0
+
 
 def find1(soup, name, attrs={}, recursive=False, string=None, error_if_none=True, **kwargs):
     all = soup.find_all(name, attrs, recursive, string, **kwargs)
@@ -43,14 +69,111 @@ def find1(soup, name, attrs={}, recursive=False, string=None, error_if_none=True
         raise Find_error(f"{soup.name}: Expected one {name=} {attrs=}, got {len(all)}")
     return all[0]
 
+class Throttle:
+    r'''Limits the number of concurrent requests to one domain.
+
+    Also keeps an adaptive delay that is applied before each request to the domain.  The
+    delay is doubled each time the domain fails with a retryable error, and halved each
+    time it succeeds.
+    '''
+    def __init__(self, limit):
+        self.semaphore = threading.BoundedSemaphore(limit)
+        self.lock = threading.Lock()
+        self.delay = 0.0
+
+    def backoff(self):
+        with self.lock:
+            self.delay = min(max(self.delay * 2, Min_backoff), Max_backoff)
+            return self.delay
+
+    def success(self):
+        with self.lock:
+            self.delay /= 2
+            if self.delay < Min_backoff:
+                self.delay = 0.0
+
+Executor = None  # ThreadPoolExecutor used by fetch_all
+
+Throttles = {}  # {domain: Throttle}
+Throttles_lock = threading.Lock()
+
+def get_throttle(url):
+    domain = urlsplit(url).hostname
+    with Throttles_lock:
+        if domain not in Throttles:
+            Throttles[domain] = Throttle(Per_domain_limit)
+        return Throttles[domain]
+
+def get_response(url):
+    r'''Gets url, retrying on connection errors and Retry_status_codes.
+
+    Returns the response, which may still have a bad status_code.
+
+    Goes through the http_cache, unless http_cache.Enabled is False or the pages are coming
+    from the fixture_server (which serves them from the http_cache).  A cached page is
+    revalidated with the server, unless http_cache.Offline is set, in which case the
+    server is not contacted at all.
+    '''
+    if not http_cache.Enabled or Site is not None:
+        return fetch(url)
+    cached = http_cache.lookup(url)
+    if http_cache.Offline:
+        if cached is None:
+            raise HTTP_error(f"{url=}: not in http_cache (offline)")
+        return cached
+    response = fetch(url, http_cache.conditional_headers(cached))
+    if response.status_code == 304 and cached is not None:
+        return cached
+    if response.status_code == 200:
+        return http_cache.store(url, response)
+    return response
+
+def fetch(url, headers={}):
+    r'''Gets url from the server, retrying on connection errors and Retry_status_codes.
+
+    If Site is set, gets url from the fixture_server at Site instead.
+    '''
+    if Site is not None:
+        url = fixture_server.site_url(url, Site)
+    throttle = get_throttle(url)
+    for attempt in range(Max_retries + 1):
+        with throttle.semaphore:
+            if throttle.delay:
+                time.sleep(throttle.delay)
+            try:
+                response = requests.get(url, headers=headers)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == Max_retries:
+                    raise
+                print(f"get {url=}: got {e.__class__.__name__}, "
+                      f"backing off {throttle.backoff()} secs")
+                continue
+        if response.status_code in Retry_status_codes and attempt < Max_retries:
+            print(f"get {url=}: status_code {response.status_code}, "
+                  f"backing off {throttle.backoff()} secs")
+            continue
+        throttle.success()
+        return response
+
 def get(url):
     r'''Gets url and returns the soup!
 
+    See get_text.
+    '''
+    return parse(get_text(url))
+
+def get_text(url):
+    r'''Gets url and returns the decoded text of the page.
+
     Checks status_code in response, and Content-Type == 'text/html'.
 
-    Also corrects encoding, if the encoding in Content-Type or meta charset differ.
+    Also corrects encoding, if the encoding in Content-Type or meta charset differ.  The
+    meta charset is sniffed from the raw bytes (see sniff_charset), so the page only needs
+    to be parsed once.
+
+    This is thread safe, see fetch_all.
     '''
-    response = requests.get(url)
+    response = get_response(url)
     if response.status_code != 200:
         raise HTTP_error(f"{url=}: status_code {response.status_code}")
     encoding = response.encoding
@@ -67,31 +190,99 @@ def get(url):
             print(f"response.encoding is {encoding}, got charset {e2} in Content-Type, "
                   "changing encoding")
             encoding = e2
-            response.encoding = encoding
             where = 'from Content-Type'
-    soup = BeautifulSoup(response.text, 'html.parser')
-    m = soup.head.find('meta', charset=True)
-    if m is not None:
-        if m['charset'] != encoding:
-            print(f"meta charset is {encoding}, got encoding {e2} {where}, "
-                  "changing encoding")
-            encoding = m['charset']
-            response.encoding = encoding
-            soup = BeautifulSoup(response.text, 'html.parser')
-    #print(f"{soup.head.find('meta')}")
-    return soup
+    meta_charset = sniff_charset(response.content)
+    if meta_charset is not None and meta_charset != encoding:
+        print(f"meta charset is {meta_charset}, got encoding {encoding} {where}, "
+              "changing encoding")
+        encoding = meta_charset
+    if encoding is None:
+        return response.text
+    return str(response.content, encoding, errors='replace')
+
+def parse(text, parser=None):
+    r'''Returns the soup for text, using parser (default Parser).
+    '''
+    return BeautifulSoup(text, parser or Parser)
+
+head_end_re = re.compile(rb'</head|<body', re.IGNORECASE)
+meta_re = re.compile(rb'<meta\s[^>]*>', re.IGNORECASE)
+attr_re = re.compile(rb'''([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?''')
+
+def sniff_charset(content):
+    r'''Returns the charset attribute of the first <meta> tag in the <head>, or None.
+
+    This works on the raw bytes of the page, so that the page doesn't have to be parsed
+    to find out how to decode it.
+
+        >>> sniff_charset(b'<html><head><title>x</title><meta charset="utf-8"></head>')
+        'utf-8'
+        >>> sniff_charset(b"<head><META name=x CHARSET=iso-8859-1>")
+        'iso-8859-1'
+        >>> sniff_charset(b'<head><meta http-equiv="Content-Type" '
+        ...               b'content="text/html; charset=utf-8"></head>')
+        >>> sniff_charset(b'<head></head><body><meta charset="utf-8">')
+    '''
+    m = head_end_re.search(content)
+    head = content[: m.start()] if m else content
+    for meta in meta_re.finditer(head):
+        for attr in attr_re.finditer(meta.group(), 5):
+            if attr.group(1).lower() == b'charset':
+                value = attr.group(2) or attr.group(3) or attr.group(4) or b''
+                return value.decode('ascii', errors='replace')
+    return None
+
+def fetch_all(urls):
+    r'''Generates the soup for each url, in the same order as urls.
+
+    The pages are fetched and parsed concurrently by Jobs threads, so this may run well
+    ahead of the caller.  The caller is the only one that touches the database, so
+    item_order and body_order are still assigned in document order.
+    '''
+    if Jobs <= 1 or Executor is None:
+        return map(get, urls)
+    return Executor.map(get, urls)
+
+def parse_benchmark(url, repeat=5):
+    r'''Prints how long it takes each of the Parsers to parse url.
+    '''
+    text = get_text(url)
+    print(f"parse_benchmark {url=}")
+    print(f"  {len(text)} chars, best and mean of {repeat} parses:")
+    for parser in Parsers:
+        try:
+            parse('<html></html>', parser)
+        except FeatureNotFound:
+            print(f"  {parser:>12}: not installed")
+            continue
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            soup = parse(text, parser)
+            times.append(time.perf_counter() - start)
+        print(f"  {parser:>12}: {min(times) * 1000:8.1f} ms, "
+              f"{sum(times) / repeat * 1000:8.1f} ms, "
+              f"found {len(soup.find_all('div', class_='Section'))} Sections")
+
 
 def scrape_61B(trace=False):
     r'''Expects a list of chapters.  Passes all 75-79 chapters to process_61B_chapter.
     '''
-    global item_order
-    item_order = 1
+    global item_order, Executor
+    item_order = 1 if Resume_from is None else Resume_from.item_order
+    Executor = ThreadPoolExecutor(max_workers=max(Jobs, 1))
+    try:
+        scrape_61B_chapters()
+    finally:
+        Executor.shutdown(cancel_futures=True)
+
+def scrape_61B_chapters():
     soup = get(casetext_61B)
     #article = find1(soup.body, 'article', recursive=True)
     article = soup.body.article
     ul = find1(article, 'ul', recursive=False)
     #print(f"scrape_61B got ul with {len(ul.contents)} elements")
-    chapters_seen = []
+    chapters = []  # [(ch_number, title, href)]
     for li in ul.children:
         a = li.a
         title = find1(a, 'span', recursive=True, class_='title').string
@@ -100,17 +291,22 @@ def scrape_61B(trace=False):
         #print(f"scrape_61B got li.a tag {a.contents[-1]=}, {ch_number=}")
         if 75 <= ch_number <= 79:
             if 'Repealed' not in title:
-                assert not chapters_seen or ch_number == chapters_seen[-1] + 1
-                chapters_seen.append(ch_number)
+                assert not chapters or ch_number == chapters[-1][0] + 1
                 href = a['href']
                 if href[0] != '/':
                     href = casetext + href
-                process_61B_chapter(ch_number, title, href)
-    assert chapters_seen and chapters_seen[-1] == 79
+                chapters.append((ch_number, title, href))
+    assert chapters and chapters[-1][0] == 79
+    start, done = resume_point([f"61B-{ch_number}" for ch_number, _, _ in chapters])
+    for ch_number, title, href in chapters[start:]:
+        process_61B_chapter(ch_number, title, href, done)
+        done = 0
 
 
-def process_61B_chapter(ch_number, title, url):
+def process_61B_chapter(ch_number, title, url, done=0):
     r'''E.g., 61B-75
+
+    Done is the number of sections already written (when resuming).
     '''
     title = title[title.index(' - ') + 3: title.index('(\u00a7') - 1]  # \u00a7 is section sign
     #print(f"process_61B_chapter got {ch_number=}, {title=}, url=...{url[-30:]}")
@@ -118,22 +314,30 @@ def process_61B_chapter(ch_number, title, url):
     #article = find1(soup.body, 'article', recursive=True)
     article = soup.body.article
     ul = find1(article, 'ul', recursive=False)
-    chapter_item = create_item(f"61B-{ch_number}", ch_number, title)
-    for body_order, li in enumerate(ul.children, 1):
+    citation = f"61B-{ch_number}"
+    if done:
+        chapter_item = models.Item.objects.get(version=version_obj, citation=citation)
+    else:
+        chapter_item = create_item(citation, ch_number, title)
+    hrefs = []
+    for li in ul.children:
         a = li.a
         href = a['href']
         if href[0] != '/':
             href = casetext + href
-        process_61B_section(chapter_item, body_order, href)
-    set_num_elements(chapter_item, body_order)
+        hrefs.append(href)
+    for body_order, section_soup in enumerate(fetch_all(hrefs[done:]), done + 1):
+        process_61B_section(chapter_item, body_order, section_soup)
+        checkpoint(citation, body_order)
+    set_num_elements(chapter_item, len(hrefs))
 
 
-def create_item(citation, number, title, parent=None, body_order=None):
+def create_item(citation, number, title, parent=None, body_order=None, source_hash=None):
     global item_order
-    item = models.Item(version=version_obj, citation=citation, number=number,
-                       parent=parent, item_order=item_order, body_order=body_order,
-                       num_elements=0, has_title=bool(title))
-    item.save()
+    item = writer.add(models.Item(version=version_obj, citation=citation, number=number,
+                                  parent=parent, item_order=item_order,
+                                  body_order=body_order, num_elements=0,
+                                  has_title=bool(title), source_hash=source_hash))
     item_order += 1
     if title:
         create_paragraph(title, 0, item)
@@ -143,13 +347,31 @@ def create_item(citation, number, title, parent=None, body_order=None):
 def set_num_elements(item, num_elements):
     if num_elements > 0:
         item.num_elements = num_elements
-        item.save()
+        writer.update(item, 'num_elements')
 
 
-def process_61B_section(parent, body_order, url):
+Resume_from = None  # Checkpoint to resume from, see resume_point
+
+def resume_point(citations):
+    r'''Returns (index, done) to resume from in citations, which are the citations of
+    the chapters (or parts) in the order that they are scraped.
+
+    Done is the number of sections of citations[index] that are already written.  This is
+    (0, 0) if not resuming, or resuming from the beginning.
+    '''
+    if Resume_from is None or not Resume_from.citation:
+        return 0, 0
+    return citations.index(Resume_from.citation), Resume_from.body_order
+
+def checkpoint(citation, body_order):
+    r'''Commits everything scraped so far, up to section body_order of citation.
+    '''
+    models.Checkpoint.save_progress(writer, version_obj, citation, body_order, item_order)
+
+
+def process_61B_section(parent, body_order, soup):
     r'''E.g., 61B-75.008
     '''
-    soup = get(url)
     #print(f"process_61B_section {parent.citation=}, {body_order=}")
     article = find1(soup.body, 'article', recursive=True)
     body = find1(article, 'div', class_="content-body", recursive=True)
@@ -162,7 +384,11 @@ def process_61B_section(parent, body_order, url):
     number = citation[citation.index('.'):]  # e.g., '.008 '
     #print(f"found section title {citation=}, {number=}, {title=}")
 
-    section_item = create_item(citation, number, title, parent, body_order)
+    source_hash = section_hash(body)
+    if copy_section(citation, source_hash, parent, body_order):
+        return
+
+    section_item = create_item(citation, number, title, parent, body_order, source_hash)
 
     container = body.find('section', class_='act', recursive=True).section
 
@@ -427,9 +653,9 @@ def process_61B_a(a, char_offset, citation):
         else:
             print(f"process_61B_a {citation} WARNING: child {i}, {child.prettify()}, IGNORED")
     def create_annotation(para):
-        models.Annotation.objects.create(paragraph=para, type='link',
-                                         char_offset=char_offset, length=len(ans),
-                                         info=a['href'])
+        writer.add(models.Annotation(paragraph=para, type='link',
+                                     char_offset=char_offset, length=len(ans),
+                                     info=a['href']))
     return ans, create_annotation
 
 
@@ -689,14 +915,146 @@ cite_hyphen_re = re.compile(r"""
           """,
           re.VERBOSE)
 
+def combine_res(cite_res):
+    r'''Returns a regex that matches any of cite_res (which must have the same flags), and
+    the group number of the citations of each cite_re within it.
+    '''
+    flags = cite_res[0].flags
+    assert all(cite_re.flags == flags for cite_re in cite_res)
+    combined = re.compile('|'.join(f"(?:{cite_re.pattern}\n)" for cite_re in cite_res),
+                          flags)
+    cite_groups = []
+    group = 1
+    for cite_re in cite_res:
+        cite_groups.append(group)
+        group += cite_re.groups
+    return combined, cite_groups
+
+# One finditer of cite_scan_map[source] finds the cites of all of cite_re_map[source].
+cite_scan_map = {source: combine_res(cite_res) for source, cite_res in cite_re_map.items()}
+
+# Where each of the cite_re_map[source] regexes could start, for sources with more than one
+# (these all have a required prefix).
+cite_anchor_map = {
+    '719': re.compile(r'''\bs\.|\bss\.|\bsections?|\bsubsections?|\bparagraphs?
+                          |\bsubparagraphs?|\brules?|\bchapters?''',
+                      re.VERBOSE | re.IGNORECASE),
+}
+
+# Every cite has a digit and a prefix or suffix (cites without either are ignored), so
+# paragraphs without a digit and one of these strings are skipped: (strings found in the
+# lower cased text, strings found as is).  The 61b suffixes (F.S., F.A.C., Florida
+# Statutes, ...) are case sensitive, so these are looked for as is, rather than 'fa' and
+# 'fs', which are in nearly every paragraph.
+cite_keyword_map = {
+    '719': (('s.', 'section', 'paragraph', 'rule', 'chapter'), ()),
+    '61b': (('section', 'paragraph', 'rule', 'chapter'), ('F.S', 'FS', 'F.A', 'FA', 'Florida')),
+}
+
+digit_re = re.compile(r"[0-9]")
+
+cite_target_re = re.compile(r"719(\.[0-9]+)?|61[bB](-[0-9]+(\.[0-9]+)?)?")
+
+cite_list_re = re.compile(r",|and")
+
+def find_cites(text, source):
+    r'''Generates (m, group) for the cite_re_map[source] matches in text that have a prefix
+    or suffix.  The citations are m.group(group).
+
+    These come in the same order as running the finditer of each cite_re_map[source]
+    regex in turn.
+
+       >>> [m.group(g) for m, g in find_cites('see s. 719.106(1) and ss. 719.107, 719.108', '719')]
+       ['719.106(1)', '719.107, 719.108']
+       >>> [m.group(g) for m, g in find_cites('Section 719.301(4)(a), F.S., or 3 units', '61b')]
+       ['719.301(4)(a)']
+       >>> list(find_cites('in 1999 the association', '719'))
+       []
+    '''
+    if not may_have_cites(text, source):
+        return
+    scan_re, cite_groups = cite_scan_map[source]
+    found = [[] for _ in cite_groups]
+    for m in scan_re.finditer(text):
+        if len(cite_groups) > 1:
+            anchor = cite_anchor_map[source].search(text, m.start() + 1)
+            if anchor is not None and anchor.start() < m.end():
+                # Running the finditers one at a time might find another cite starting
+                # within this one, which the combined finditer skips.  This hardly ever
+                # happens, so just do that.
+                found = [[(m, 1) for m in cite_re.finditer(text)]
+                         for cite_re in cite_re_map[source]]
+                break
+        i = next(i for i, group in enumerate(cite_groups) if m.start(group) >= 0)
+        found[i].append((m, cite_groups[i]))
+    for m, group in chain.from_iterable(found):
+        if m.start(group) != m.start() or m.end(group) != m.end():
+            yield m, group
+
+def may_have_cites(text, source):
+    r'''False if text can't have any cites (see cite_keyword_map).
+
+       >>> may_have_cites('the failure of the staff', '61b'), may_have_cites('in 3 days', '61b')
+       (False, False)
+       >>> may_have_cites('rule 61B-75.001', '61b'), may_have_cites('61B-75.001, F.A.C.', '61b')
+       (True, True)
+    '''
+    if not digit_re.search(text):
+        return False
+    lower_keywords, keywords = cite_keyword_map[source]
+    if any(keyword in text for keyword in keywords):
+        return True
+    lower = text.lower()
+    return any(keyword in lower for keyword in lower_keywords)
+
+def split_cites(text, start, end):
+    r'''Generates (start, cite) for each cite in the ',' and/or 'and' separated list of
+    cites in text[start: end].  The cites are stripped.
+
+       >>> list(split_cites('ss. 719.106, 719.107 and 719.109', 4, 32))
+       [(4, '719.106'), (13, '719.107'), (25, '719.109')]
+    '''
+    while True:
+        sep = cite_list_re.search(text, start, end)
+        cite = text[start: end if sep is None else sep.start()]
+        cite2 = cite.lstrip()
+        yield start + len(cite) - len(cite2), cite2.rstrip()
+        if sep is None:
+            return
+        start = sep.end()
+
+def cites_in(text, start, end):
+    r'''Generates (char_offset, length, info) for each cite in text[start: end].
+    '''
+    previous = None
+    for start, cite in split_cites(text, start, end):
+        previous, current = combine(previous, cite)
+        if current:
+            yield start, len(cite), current
+
+def s_cites(text, source):
+    r'''Generates (char_offset, length, info) for each s_cite Annotation in text.
+
+       >>> for cite in s_cites('see ss. 719.106(1)(a), 719.107 and 719.108-719.109, F.S.', '719'):
+       ...     print(cite)
+       (8, 13, '719.106(1)(a)')
+       (23, 7, '719.107')
+       (35, 15, '719.108-719.109')
+       >>> for cite in s_cites('Subsections 61B-76.006(6), (8), F.A.C.', '61b'):
+       ...     print(cite)
+       (12, 13, '61B-76.006(6)')
+       (27, 3, '61B-76.006(8)')
+    '''
+    for m, group in find_cites(text, source):
+        yield from cites_in(text, m.start(group), m.end(group))
+
 def create_s_cites(para, text, trace):
     #trace = True
     if para.item:
         citation = para.item.citation
     else:
         citation = para.cell.table.item.citation
-    targets = [(m.group(), m.start(), m.end())
-               for m in re.finditer(r'719(\.[0-9]+)?|61[bB](-[0-9]+(\.[0-9]+)?)?', text)]
+    targets = [(m.group(), m.start(), m.end()) for m in cite_target_re.finditer(text)]
     if targets:
         for i in range(len(targets) - 1):
             if targets[i][1] > targets[i+1][1]:
@@ -705,14 +1063,9 @@ def create_s_cites(para, text, trace):
             print(f"create_s_cites {citation} {para.body_order=} {targets=}")
 
     # record all legal cites (starting with 'ss.' or 's.') in Annotations
-    for m in chain.from_iterable(cite_re.finditer(text) for cite_re in cite_re_map[source]):
-        start = m.start(1)
-        end = m.end(1)
-        if start == m.start() and end == m.end():
-            #if not m.group().isdigit():
-            #    print(f"create_s_cites: {citation} {para.body_order=} NOTICE: "
-            #          f"no identifers on {m.group(1)} -- IGNORED")
-            continue
+    for m, group in find_cites(text, source):
+        start = m.start(group)
+        end = m.end(group)
         full = m.group().strip()
         if trace and (full.startswith('s.') or full.startswith('ss.')):
             print(f"  create_s_cites {citation} {para.body_order=} full starts with s.")
@@ -724,61 +1077,63 @@ def create_s_cites(para, text, trace):
                 last = i
         if first is None:
             print(f"  create_s_cites {citation} {para.body_order=} "
-                  f"got cite {m.group(1)!r} at {start} -- NOTICE: NOT IN TARGETS")
+                  f"got cite {m.group(group)!r} at {start} -- NOTICE: NOT IN TARGETS")
         else:
             del targets[first: last + 1]
             if trace:
                 print(f"  create_s_cites {citation} {para.body_order=} "
-                      f"got cite {m.group(1)!r} at {start}")
-        previous = None
-        while True:
-            comma = text.find(',', start, end)
-            and_offset = text.find('and', start, end)
-            if comma < 0 and and_offset < 0:
-                # last cite
-                cite = text[start: end]
-                cite2 = cite.lstrip()
-                start += len(cite) - len(cite2)  # add len of leading spaces
-                cite = cite2.rstrip()
-                previous, current = combine(previous, cite)
-                if current:
-                    if trace:
-                        print(f"    create_s_cites: last cite {cite=!r} {current=!r} at {start}")
-                    models.Annotation.objects.create(paragraph=para, type='s_cite',
-                                                     char_offset=start, length=len(cite),
-                                                     info=current)
-                break
-            elif comma < 0 or 0 <= and_offset < comma:
-                # and comes first
-                cite = text[start: and_offset]
-                cite2 = cite.lstrip()
-                start += len(cite) - len(cite2)  # add len of leading spaces
-                cite = cite2.rstrip()
-                previous, current = combine(previous, cite)
-                if current:
-                    if trace:
-                        print(f"    create_s_cites: and cite {cite=!r} {current=!r} at {start}")
-                    models.Annotation.objects.create(paragraph=para, type='s_cite',
-                                                     char_offset=start, length=len(cite),
-                                                     info=current)
-                start = and_offset + 3
-            else:
-                # comma comes first
-                cite = text[start: comma]
-                cite2 = cite.lstrip()
-                start += len(cite) - len(cite2)  # add len of leading spaces
-                cite = cite2.rstrip()
-                previous, current = combine(previous, cite)
-                if current:
-                    if trace:
-                        print(f"    create_s_cites: ',' cite {cite=!r} {current=!r} at {start}")
-                    models.Annotation.objects.create(paragraph=para, type='s_cite',
-                                                     char_offset=start, length=len(cite),
-                                                     info=current)
-                start = comma + 1
+                      f"got cite {m.group(group)!r} at {start}")
+        for char_offset, length, info in cites_in(text, start, end):
+            if trace:
+                print(f"    create_s_cites: cite {text[char_offset: char_offset + length]!r} "
+                      f"{info=!r} at {char_offset}")
+            writer.add(models.Annotation(paragraph=para, type='s_cite',
+                                         char_offset=char_offset, length=length,
+                                         info=info))
     if targets:
         print(f"  create_s_cites {citation} {para.body_order=} NOTICE done: {targets=}")
 
+def cite_benchmark(source, repeat=5):
+    r'''Prints the paragraphs/second for s_cites over the latest version of source.
+
+    Also prints how many paragraphs get past the prefilter (may_have_cites), and checks
+    that s_cites finds the same cites as the s_cite Annotations loaded for
+    that version (except in the citeAs and history notes, which aren't searched for
+    cites).
+    '''
+    version = models.Version.latest({'719': fl_leg_domain, '61b': casetext_domain}[source],
+                                    published=False)
+    paragraphs = models.Paragraph.objects.filter(Q(item__version_id=version)
+                                                 | Q(cell__table__item__version_id=version))
+    texts = []
+    loaded = {}  # {index in texts: sorted s_cites}
+    for para in paragraphs.prefetch_related('annotation_set').order_by('id'):
+        annotations = para.annotation_set.all()
+        if not any(a.type in ('citeAs', 'history') for a in annotations):
+            loaded[len(texts)] = sorted((a.char_offset, a.length, a.info)
+                                        for a in annotations if a.type == 's_cite')
+        texts.append(para.text)
+    print(f"cite_benchmark {source=} {version=}")
+    num_passed = sum(map(bool, (may_have_cites(text, source) for text in texts)))
+    num_cited = sum(map(bool, (list(s_cites(text, source)) for text in texts)))
+    print(f"  prefilter passed {num_passed} of {len(texts)} paragraphs "
+          f"({num_passed / max(len(texts), 1):.1%}), {num_cited} have cites")
+    print(f"  {len(texts)} paragraphs, best of {repeat} runs:")
+    def time_it(name, fn):
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            for text in texts:
+                fn(text)
+            times.append(time.perf_counter() - start)
+        print(f"  {name:>20}: {len(texts) / min(times):10.0f} paragraphs/sec")
+    time_it('regex scan (before)',
+            lambda text: [m for cite_re in cite_re_map[source] for m in cite_re.finditer(text)])
+    time_it('find_cites', lambda text: list(find_cites(text, source)))
+    time_it('s_cites', lambda text: list(s_cites(text, source)))
+    diffs = sum(sorted(s_cites(texts[i], source)) != cites for i, cites in loaded.items())
+    print(f"  {diffs} of {len(loaded)} paragraphs differ from their loaded s_cite Annotations")
+
 def combine(a, b):
     r'''Combines a (previous cite) with b.  Returns (previous, current) cites.
 
@@ -850,8 +1205,8 @@ def combine1(a, b):
 
 def create_paragraph(text, body_order, item=None, cell=None, index=True, trace=False):
     assert item or cell
-    para = models.Paragraph(item=item, cell=cell, body_order=body_order, text=text)
-    para.save()
+    para = writer.add(models.Paragraph(item=item, cell=cell, body_order=body_order,
+                                       text=text))
     if index:
         create_s_cites(para, text, trace)
     return para
@@ -880,35 +1235,116 @@ def scrape_719(trace=False):
                 span Number: a.&emsp;
                 span ...: <text>
     '''
-    global item_order
+    global item_order, Pool
     print(f"scrape_719 {trace=}")
     soup = get(chapter_719)
     chapter = find1(soup, 'div', recursive=True, class_='Chapter')
-    item_order = 1
-    for part in chapter.find_all('div', recursive=False, class_='Part'):
-        process_part(part, trace)
+    item_order = 1 if Resume_from is None else Resume_from.item_order
+    parts = chapter.find_all('div', recursive=False, class_='Part')
+    start, done = resume_point([part_number(part) for part in parts])
+    todo = [(part, 0) for part in parts[start:]]  # [(part, sections done)]
+    todo[0] = parts[start], done
+    if Workers > 1:
+        # fork, so that the workers start out with this module set up as it is here.
+        Pool = ProcessPoolExecutor(max_workers=Workers,
+                                   mp_context=multiprocessing.get_context('fork'),
+                                   initializer=init_worker)
+    try:
+        if Pool is not None:
+            submit_sections(todo, trace)
+        for part, done in todo:
+            process_part(part, trace, done)
+    finally:
+        if Pool is not None:
+            Pool.shutdown(cancel_futures=True)
+            Pool = None
+            Section_futures.clear()
+
+Pool = None            # ProcessPoolExecutor used by scrape_719 when Workers > 1
+
+Section_futures = {}   # {id(section tag): Future for section_records}
+
+def submit_sections(todo, trace):
+    r'''Submits all of the sections in todo ([(part, sections done)]) to be parsed by the
+    Pool.
 
-def process_part(part, trace):
+    Except the sections that will be copied from the prior version (see copy_section).
+    '''
+    for part, done in todo:
+        citation = part_number(part)
+        sections = part.find_all('div', recursive=False, class_='Section')
+        for body_order, section in enumerate(sections[done:], done + 1):
+            number = get_string(section.contents[0], de_emsp=True).strip() + ' '
+            source_hash = section_hash(section)
+            if Prior_sections.get(number, (None, None))[1] != source_hash:
+                Section_futures[id(section)] = \
+                  Pool.submit(section_records, str(section), citation, body_order,
+                              source_hash, trace)
+
+def init_worker():
+    global Prior_sections, Section_futures
+    Prior_sections = {}
+    Section_futures = {}
+
+def section_records(html, parent_citation, body_order, source_hash, trace):
+    r'''Runs in a Pool worker process.  Parses the section in html.
+
+    Returns the Record_writer records for it, to be written by write_section_records
+    back in the main process.  The parent part Item is id 0 in the records.
+    '''
+    global writer, item_order
+    writer = Record_writer()
+    item_order = 0
+    section = find1(parse(html), 'div', recursive=True, class_='Section')
+    process_section(section, models.Item(id=0, citation=parent_citation), body_order, trace,
+                    source_hash)
+    return writer.records()
+
+def write_section_records(records, parent):
+    r'''Writes the records from section_records, with parent as the parent part Item.
+    '''
+    global item_order
+    num_items = 0
+    for label, fields in records:
+        if 'item_order' in fields:
+            fields['item_order'] += item_order
+            num_items += 1
+    write_records(writer, records, {models.Item: {0: parent.id}})
+    item_order += num_items
+
+def part_number(part):
+    pt = find1(part, 'div', class_="PartTitle")
+    return get_string(find1(pt, 'div', class_="PartNumber"), de_emsp=True)
+
+def process_part(part, trace, done=0):
+    r'''Done is the number of sections already written (when resuming).
+    '''
     pt = find1(part, 'div', class_="PartTitle")
-    number = get_string(find1(pt, 'div', class_="PartNumber"), de_emsp=True)
+    number = part_number(part)
     type = "Part"
     title = get_string(find1(pt, 'span', class_="PartTitle"))
     if trace:
         print(f"{type}: {item_order=}, {number=}, {title=}")
-    part_obj = create_item(number, number, title)
-    body_order = 0  # in case there are no children...
-    for body_order, section \
-     in enumerate(part.find_all('div', recursive=False, class_='Section'), 1):
+    if done:
+        part_obj = models.Item.objects.get(version=version_obj, citation=number)
+    else:
+        part_obj = create_item(number, number, title)
+    sections = part.find_all('div', recursive=False, class_='Section')
+    for body_order, section in enumerate(sections[done:], done + 1):
         process_section(section, part_obj, body_order, trace)
-    set_num_elements(part_obj, body_order)
+        checkpoint(number, body_order)
+    set_num_elements(part_obj, len(sections))
 
 
-def process_section(section, parent, body_order, trace):
+def process_section(section, parent, body_order, trace, source_hash=None):
     r'''
 
     Section citations have a space at the end so that citation prefixes can be used to
     determine whether Item A is a parent (recursively) of Item B.  This prevents '719.103'
     from being taken as a parent of '719.1035'.
+
+    If the section was submitted to the Pool (see submit_sections), this just writes the
+    records that it got back.
     '''
     #print("process_section:")
     #print(section.prettify())
@@ -945,8 +1381,16 @@ def process_section(section, parent, body_order, trace):
 
     assert number[-1] == ' '
 
+    if source_hash is None:
+        source_hash = section_hash(section)
+    if copy_section(number, source_hash, parent, body_order):
+        return
+    if id(section) in Section_futures:
+        write_section_records(Section_futures.pop(id(section)).result(), parent)
+        return
+
     # omitting part number from citation
-    section_obj = create_item(number, number.strip(), title, parent, body_order)
+    section_obj = create_item(number, number.strip(), title, parent, body_order, source_hash)
 
     get_body(find1(section, 'span', class_="SectionBody"),
              parent=section_obj,
@@ -969,6 +1413,94 @@ def process_section(section, parent, body_order, trace):
                f"process_section {section_obj.citation} note {number=} {text=!r}"
         create_note(section_obj, body_order, 'Note. ' + text, 5, info=number)
 
+def section_hash(tag):
+    return sha256(str(tag).encode('utf-8')).hexdigest()
+
+def load_prior_sections(source_domain):
+    r'''Loads Prior_sections from the latest version of source_domain.
+
+    Must be called before the new version is created.
+    '''
+    global Prior_sections
+    try:
+        prior_version = models.Version.latest(source_domain, published=False)
+    except models.Version.DoesNotExist:
+        print(f"load_prior_sections: no prior version of {source_domain}, "
+              "scraping everything")
+        return
+    Prior_sections = {
+      citation: (id, source_hash)
+      for id, citation, source_hash
+       in models.Item.objects.filter(version_id=prior_version, source_hash__isnull=False)
+                             .values_list('id', 'citation', 'source_hash')
+    }
+    print(f"load_prior_sections: got {len(Prior_sections)} sections from version "
+          f"{prior_version}")
+
+def copy_section(citation, source_hash, parent, body_order):
+    r'''Copies the section from the prior version if its html hasn't changed.
+
+    This copies the section Item, all of its subordinate Items, and their Paragraphs,
+    Tables, TableCells and Annotations (except for 'definition' Annotations, which are
+    added later by load_definitions).  The copies are given the next item_orders.
+
+    Returns True if the section was copied, False if it needs to be scraped.
+    '''
+    global item_order, Sections_copied
+    prior_id, prior_hash = Prior_sections.get(citation, (None, None))
+    if prior_hash != source_hash:
+        return False
+    prior_version = models.Item.objects.get(id=prior_id).version_id
+
+    # The subordinate items' citations start with the section's citation, but so may
+    # the citations of other sections (e.g., 719.103 and 719.1035), so only the items
+    # that descend from the section are copied.  Parents come before their children in
+    # item_order.
+    new_items = {}  # {prior id: new Item}
+    for item in models.Item.objects.filter(version_id=prior_version,
+                                           citation__startswith=citation) \
+                                   .order_by('item_order'):
+        if item.id == prior_id:
+            new_parent, new_body_order = parent, body_order
+        elif item.parent_id in new_items:
+            new_parent, new_body_order = new_items[item.parent_id], item.body_order
+        else:
+            continue
+        new_items[item.id] = writer.add(
+          models.Item(version=version_obj, citation=item.citation, number=item.number,
+                      parent=new_parent, item_order=item_order, body_order=new_body_order,
+                      num_elements=item.num_elements, has_title=item.has_title,
+                      source_hash=item.source_hash))
+        item_order += 1
+
+    new_tables = {}
+    for table in models.Table.objects.filter(item_id__in=list(new_items)).order_by('id'):
+        new_tables[table.id] = writer.add(
+          models.Table(item=new_items[table.item_id], has_header=table.has_header,
+                       body_order=table.body_order))
+
+    new_cells = {}
+    for cell in models.TableCell.objects.filter(table_id__in=list(new_tables)) \
+                                        .order_by('id'):
+        new_cells[cell.id] = writer.add(
+          models.TableCell(table=new_tables[cell.table_id], row=cell.row, col=cell.col))
+
+    new_paras = {}
+    for para in models.Paragraph.objects.filter(Q(item_id__in=list(new_items))
+                                                | Q(cell_id__in=list(new_cells))) \
+                                        .order_by('id'):
+        new_paras[para.id] = writer.add(
+          models.Paragraph(item=new_items.get(para.item_id), cell=new_cells.get(para.cell_id),
+                           body_order=para.body_order, text=para.text))
+
+    for anno in models.Annotation.objects.filter(paragraph_id__in=list(new_paras)) \
+                                         .exclude(type='definition').order_by('id'):
+        writer.add(models.Annotation(paragraph=new_paras[anno.paragraph_id], type=anno.type,
+                                     char_offset=anno.char_offset, length=anno.length,
+                                     info=anno.info))
+    Sections_copied += 1
+    return True
+
 def create_note(parent, body_order, text, prefix_len=None, type=None, info=None):
     if type is None:
         assert prefix_len is not None
@@ -979,8 +1511,8 @@ def create_note(parent, body_order, text, prefix_len=None, type=None, info=None)
     elif prefix_len is None:
         prefix_len = len(text)
     para = create_paragraph(text, body_order, parent, index=(type not in ('citeAs', 'history')))
-    models.Annotation.objects.create(paragraph=para, type=type, char_offset=0, length=prefix_len,
-                                     info=info)
+    writer.add(models.Annotation(paragraph=para, type=type, char_offset=0, length=prefix_len,
+                                 info=info))
 
 def get_string(tag, de_emsp=False, ignore_emdash=False, allow_p=False):
     span = []
@@ -1048,9 +1580,9 @@ def get_body(tag, parent=None, allow_title=True, skip=0, strip=0, trace=False):
                     m = ss_cite_re.match(text, offset)
                     if not m:
                         m = word_re.match(text, offset)
-                models.Annotation.objects.create(paragraph=p, type=type,
-                                                 char_offset=offset, length=m.end() - offset,
-                                                 info=info)
+                writer.add(models.Annotation(paragraph=p, type=type,
+                                             char_offset=offset, length=m.end() - offset,
+                                             info=info))
             annotations = []
             current_span = []
 
@@ -1132,7 +1664,7 @@ def process_child(parent, child, strip_number, body_order, trace):
             print(f"{type}: citation={my_citation} -> {title=}")
         create_paragraph(title, 0, obj, trace=trace)
         obj.has_title = True
-        obj.save()
+        writer.update(obj, 'has_title')
 
 def get_number(tag, strip_number, trace):
     r'''Returns allow_title, skip, strip, number.
@@ -1197,17 +1729,15 @@ def get_history(tag):
     return get_string(find1(tag, 'span', class_='HistoryText'))
 
 def process_table(parent, child, body_order):
-    table = models.Table(item=parent, has_header=False, body_order=body_order)
-    table.save()
+    table = writer.add(models.Table(item=parent, has_header=False, body_order=body_order))
     row = 1
     def load_row(tr, head=False):
         nonlocal row
         for col_num, col in enumerate(tr, 1):
-            cell = models.TableCell(table=table, row=row, col=col_num)
-            cell.save()
+            cell = writer.add(models.TableCell(table=table, row=row, col=col_num))
             if head and not table.has_header:
                 table.has_header = True
-                table.save()
+                writer.update(table, 'has_header')
 
             text = ''
             i = 1
@@ -1238,9 +1768,39 @@ def process_table(parent, child, body_order):
     else:
         load_rows(child)
 
-@transaction.atomic
+def start_version(source_domain, url, resume):
+    r'''Sets version_obj to a new Version, or to the version being resumed.
+
+    Returns False if there is nothing to resume.
+    '''
+    global version_obj, Resume_from
+    if resume:
+        Resume_from = models.Checkpoint.resume(source_domain)
+        if Resume_from is None:
+            print(f"no unfinished scrape of {source_domain} to resume")
+            return False
+        version_obj = Resume_from.version
+        print(f"resuming version {version_obj.id} after {Resume_from.citation or 'nothing'} "
+              f"section {Resume_from.body_order}")
+    else:
+        version_obj = models.Checkpoint.new_version(source_domain, url)
+    return True
+
+
 def run(*args):
-    global source, version_obj
+    global source, writer, Jobs, Workers, Parser, Site
+    if 'jobs' in args:
+        Jobs = int(args[args.index('jobs') + 1])
+    if 'workers' in args:
+        Workers = int(args[args.index('workers') + 1])
+    if 'parser' in args:
+        Parser = args[args.index('parser') + 1]
+    if 'offline' in args:
+        http_cache.Offline = True
+    if 'no-cache' in args:
+        http_cache.Enabled = False
+    if 'site' in args:
+        Site = args[args.index('site') + 1]
     if not args or 'help' in args:
         print("scrape_html help")
         print("  python manage.py runscript scrape_html --script-args 719")
@@ -1253,10 +1813,41 @@ def run(*args):
         print("      to index all of the words in this new version")
         print("  python manage.py runscript scrape_html --script-args trace")
         print("    turns trace on for the load")
+        print("  python manage.py runscript scrape_html --script-args 61b jobs 4")
+        print(f"    fetches pages with 4 threads (default {Jobs}, 1 fetches one at a time)")
+        print("  python manage.py runscript scrape_html --script-args 719 workers 8")
+        print("    parses the sections in 8 processes (default 1, parses them in this process)")
+        print("  python manage.py runscript scrape_html --script-args 719 resume")
+        print("    - continues loading the last version of 719 that didn't finish loading,")
+        print("      from the last section written")
+        print("  python manage.py runscript scrape_html --script-args 719 incremental")
+        print("    - only parses the sections that have changed since the latest version,")
+        print("      the unchanged sections are copied from the latest version")
+        print("  python manage.py runscript scrape_html --script-args 719 offline")
+        print("    - loads chapter 719 only from the pages saved in the http_cache directory")
+        print("  python manage.py runscript scrape_html --script-args 719 no-cache")
+        print("    - doesn't use (or update) the http_cache directory")
+        print("  python manage.py runscript scrape_html --script-args 719 "
+              "site http://localhost:8061")
+        print("    - fetches the pages from the fixture_server running on localhost:8061")
+        print("  python manage.py runscript scrape_html --script-args 719 parser lxml")
+        print(f"    - parses the pages with lxml (or html5lib) rather than {Parser}")
+        print("  python manage.py runscript scrape_html --script-args parse-benchmark [repeat]")
+        print("    times each parser on the chapter 719 page (our largest page)")
+        print("  python manage.py runscript scrape_html --script-args cite-benchmark 719 "
+              "[repeat]")
+        print("    times finding the s_cites in the paragraphs of the latest version of 719")
+        print("    (or 61b), and checks them against its s_cite Annotations")
         print("  python manage.py runscript scrape_html --script-args doctests")
         print("    run doctests on this module")
         print("  python manage.py runscript scrape_html --script-args help")
         print("    prints this help message")
+    elif 'parse-benchmark' in args:
+        i = args.index('parse-benchmark') + 1
+        parse_benchmark(chapter_719, int(args[i]) if i < len(args) else 5)
+    elif 'cite-benchmark' in args:
+        i = args.index('cite-benchmark') + 1
+        cite_benchmark(args[i].lower(), int(args[i + 1]) if i + 1 < len(args) else 5)
     elif 'doctests' in args:
         import doctest
         print(f"{doctest.testmod()=}")
@@ -1275,18 +1866,30 @@ def run(*args):
                 print(f"search matched {s=!r} with {m.group()=!r} {m.group(1)=!r}")
     elif '719' in args:
         print(f"run {args=}")
-        version_obj = models.Version(source=fl_leg_domain, url=chapter_719)
-        version_obj.save()
+        if 'incremental' in args:
+            load_prior_sections(fl_leg_domain)
+        if not start_version(fl_leg_domain, chapter_719, 'resume' in args):
+            return
         source = '719'
+        writer = Bulk_writer()
         scrape_719('trace' in args)
+        models.Checkpoint.finish(writer, version_obj)
         print("Chapter 719 loaded as version", version_obj.id)
+        if Prior_sections:
+            print(f"  {Sections_copied} of {len(Prior_sections)} sections copied unchanged")
         print(f"next: python manage.py runscript load_words --script-args {source}")
     elif '61b' in [s.lower() for s in args]:
         print(f"run {args=}")
-        version_obj = models.Version(source=casetext_domain, url=casetext_61B)
-        version_obj.save()
+        if 'incremental' in args:
+            load_prior_sections(casetext_domain)
+        if not start_version(casetext_domain, casetext_61B, 'resume' in args):
+            return
         source = '61b'
+        writer = Bulk_writer()
         scrape_61B('trace' in args)
+        models.Checkpoint.finish(writer, version_obj)
         print("Chapters 61B-75 through 79 loaded as version", version_obj.id)
+        if Prior_sections:
+            print(f"  {Sections_copied} of {len(Prior_sections)} sections copied unchanged")
         print(f"next: python manage.py runscript load_words --script-args {source}")
 
@@ -0,0 +1,116 @@
+# search_benchmark.py
+
+r'''Times the ways of finding the matches for search terms, on each of the sources.
+
+The backends are:
+
+    postings -- a Posting query for each word's synonyms, joined by query.Term.match
+    index    -- segments.get_occurrences (the segment file, else the Postings), joined by
+                query.Term.match.  This is what search uses by default.
+    fts      -- fts.get_matches, an FTS5 MATCH (when fts.Enabled)
+
+The terms default to the Num_words most frequent words in each version, plus phrases
+and NEARs made from pairs of them.  For each backend, this prints the time per term and
+the number of paragraphs matched.  The number of paragraphs that the postings and fts
+backends don't agree on is printed too (FTS5 doesn't stop phrases at the end of a
+sentence, and tokenizes a little differently).
+'''
+
+import time
+
+from operating_procedures import fts, models, query, segments, synonym_map
+from operating_procedures.scripts.sources import *
+
+
+Num_words = 10
+
+Backends = 'postings', 'index', 'fts'
+
+
+def default_terms(version):
+    r'''Returns the Num_words most frequent words in version as Terms, plus Phrases and
+    Nears of each pair of them.
+    '''
+    words = list(models.Word.objects.filter(posting__version_id=version)
+                                    .order_by('-posting__count', 'id')
+                                    .values_list('text', flat=True)[:Num_words])
+    return [query.Term([w]) for w in words] \
+         + [query.Phrase([a, b]) for a, b in zip(words, words[1:])] \
+         + [query.Near([a, b], query.Near_distance) for a, b in zip(words, words[1:])]
+
+def get_matches(backend, version, term, synonyms):
+    if backend == 'postings':
+        return term.match([models.Posting.get_occurrences(version, word_ids)
+                           for word_ids in term.synonyms])
+    if backend == 'index':
+        return term.match([segments.get_occurrences(version, word_ids)
+                           for word_ids in term.synonyms])
+    return fts.get_matches(version, term, synonyms)
+
+def paragraphs_matched(matches):
+    return set(occurrence[0] for _, occurrence in matches)
+
+def benchmark(source, terms, repeat):
+    r'''Times each of the Backends on terms in the latest version of source.
+    '''
+    version = models.Version.latest(source, published=False)
+    if terms is None:
+        terms = default_terms(version)
+    word_ids = segments.lookup_words(set(w for term in terms for w in term.words),
+                                     [version])
+    terms = [term for term in terms if all(w in word_ids for w in term.words)]
+    words_map = synonym_map.get_map()
+    for term in terms:
+        term.synonyms = [words_map.synonyms(word_ids[w]) for w in term.words]
+    fts_synonyms = fts.synonym_texts(terms)
+    backends = [backend for backend in Backends
+                if backend != 'fts' or fts.has_table(version)]
+    print(f"{source} {version=}: {len(terms)} terms")
+    paragraphs = {}   # {backend: [set(paragraph_id)]}
+    for backend in backends:
+        # first time, to open the segment and warm the caches
+        paragraphs[backend] = [paragraphs_matched(get_matches(backend, version, term,
+                                                              synonyms))
+                               for term, synonyms in zip(terms, fts_synonyms)]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for term, synonyms in zip(terms, fts_synonyms):
+                get_matches(backend, version, term, synonyms)
+        elapsed = time.perf_counter() - start
+        print(f"  {backend:>8}: {elapsed / (repeat * len(terms) or 1) * 1000:7.2f} msec/term, "
+              f"{sum(map(len, paragraphs[backend]))} paragraphs")
+    if 'fts' in paragraphs:
+        differ = sum(len(a ^ b) for a, b in zip(paragraphs['postings'], paragraphs['fts']))
+        print(f"  postings and fts differ on {differ} paragraphs")
+    else:
+        print("  no fts table -- run load_words first (SQLite only)")
+
+
+def run(*args):
+    repeat = 5
+    terms = None
+    if 'repeat' in args:
+        repeat = int(args[args.index('repeat') + 1])
+    if 'query' in args:
+        terms = query.parse(args[args.index('query') + 1])
+    if 'help' in args:
+        print("search_benchmark help")
+        print("  python manage.py runscript search_benchmark")
+        print("    times the postings, index and fts ways of matching search terms on the")
+        print("    latest versions of 719, 61B and GG")
+        print(f"    the terms are the {Num_words} most frequent words in each version, and")
+        print("    phrases and NEARs of pairs of them")
+        print("  python manage.py runscript search_benchmark --script-args 719|61b|gg")
+        print("    only on 719, 61B or GG")
+        print("  python manage.py runscript search_benchmark --script-args "
+              "query 'unit, \"common elements\"'")
+        print("    times these terms (as typed into search)")
+        print("  python manage.py runscript search_benchmark --script-args repeat 10")
+        print("    times each term 10 times (default 5)")
+        print("  python manage.py runscript search_benchmark --script-args help")
+        print("    prints this help message")
+        return
+    sources = [Source_map[arg.lower()] for arg in args if arg.lower() in Source_map] \
+           or Sources
+    for source in sources:
+        benchmark(source, terms, repeat)
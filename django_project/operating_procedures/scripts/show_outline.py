@@ -19,9 +19,9 @@ def run(*args):
         if 'version' in args:
             version = int(args[args.index('version') + 1])
         elif args:
-            version = models.Version.latest(Source_map[args[0]])
+            version = models.Version.latest(Source_map[args[0]], published=False)
         else:
-            version = models.Version.latest(Source_719)
+            version = models.Version.latest(Source_719, published=False)
         path = []
 
         def print_item(item):
@@ -12,5 +12,7 @@ def run(*args):
         print("    prints all version information")
     else:
         for version in models.Version.objects.order_by('-upload_date').all():
-            print(f"version {version.id} on {version.upload_date} from {version.source}")
+            scraping = models.Checkpoint.objects.filter(version=version).exists()
+            print(f"version {version.id} on {version.upload_date} from {version.source}: "
+                  f"{'scraping' if scraping else version.state}")
 
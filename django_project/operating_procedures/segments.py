@@ -0,0 +1,335 @@
+# segments.py
+
+r'''Immutable on-disk index segments, one per Version, read through mmap.
+
+load_words writes a segment for each version that it indexes (see write_segment).  The
+web workers open them with mmap (see get_segment), so all of the workers share one copy
+in the page cache, and search looks up the words and their occurrences without going to
+the database.  Only the paragraphs that are shown are read from the database.
+
+The segment for a version is Segments_dir/<version>.seg.  It is written to a temp file
+and renamed, so readers never see a partial segment.  After the Header, it has these
+sections, each starting on an 8 byte boundary:
+
+    word_ids      -- sorted ids of the Words in the version
+    posting_ends  -- end of the posting (from postings.pack) of each word in postings
+    postings      -- the postings, in word_ids order
+    text_ends     -- end of each Word.text in texts
+    text_word_ids -- the Word.id of each text
+    texts         -- the utf-8 text of the Words, sorted
+    paragraph_ids -- sorted ids of the paragraphs in the version, in items and table cells
+    paragraph_item_ids -- the Item.id of each of these paragraphs (for a paragraph in a
+                          table cell, the Item holding the table)
+    num_words     -- the Paragraph.num_words of each of these paragraphs
+    item_ids      -- sorted ids of the Items in the version
+    parent_ids    -- the Item.parent_id of each of these items (0 for None)
+
+All of the numbers are little-endian unsigned 8 byte ints.  The texts are all of the
+Words in the database when the segment was written, not just the ones in the version,
+so that a search word is found even if only its synonyms are in the version.
+
+    >>> import tempfile
+    >>> dir = Path(tempfile.mkdtemp())
+    >>> write(7, [(3, postings.pack([(11, 1, 1, 0, 4), (12, 2, 5, 30, 4)]))],
+    ...       [('Unit', 3), ('board', 9)], [(11, 100, 6), (12, 101, 10)],
+    ...       [(100, None), (101, 100)], dir)
+    >>> segment = Segment(segment_path(7, dir))
+    >>> segment.version, segment.lookup_word('unit'), segment.lookup_word('units')
+    (7, 3, None)
+    >>> segment.occurrences(3)
+    [(11, 1, 1, 0, 4), (12, 2, 5, 30, 4)]
+    >>> segment.occurrences(9), segment.item_id(12), segment.item_id(13)
+    ([], 101, None)
+    >>> segment.num_paragraphs, segment.avg_words, segment.num_words(12)
+    (2, 8.0, 10)
+    >>> segment.parent_id(101), segment.parent_id(100)
+    (100, None)
+    >>> import shutil
+    >>> shutil.rmtree(dir)
+'''
+
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+import mmap
+import os
+from pathlib import Path
+import struct
+import sys
+import tempfile
+
+from operating_procedures import models, postings
+
+
+Segments_dir = Path(__file__).parents[1] / 'segments'
+
+Magic = b'OPPSEG3\n'
+
+# Magic, version, num_words, num_texts, num_paragraphs, num_items, postings size,
+# texts size
+Header = struct.Struct('<8s7Q')
+
+# {version: (mtime_ns of the segment file or None, Segment or Db_index)} opened by this
+# process
+Indexes = {}
+
+
+def segment_path(version, dir=None):
+    return (Segments_dir if dir is None else dir) / f"{version}.seg"
+
+def align(offset):
+    return (offset + 7) & ~7
+
+def layout(num_words, num_texts, num_paragraphs, num_items, postings_size, texts_size):
+    r'''Returns {section: (offset, size)}.
+    '''
+    sizes = (('word_ids', 8 * num_words),
+             ('posting_ends', 8 * num_words),
+             ('postings', postings_size),
+             ('text_ends', 8 * num_texts),
+             ('text_word_ids', 8 * num_texts),
+             ('texts', texts_size),
+             ('paragraph_ids', 8 * num_paragraphs),
+             ('paragraph_item_ids', 8 * num_paragraphs),
+             ('num_words', 8 * num_paragraphs),
+             ('item_ids', 8 * num_items),
+             ('parent_ids', 8 * num_items))
+    ans = {}
+    offset = align(Header.size)
+    for name, size in sizes:
+        ans[name] = offset, size
+        offset = align(offset + size)
+    return ans
+
+
+def write(version, word_postings, words, paragraphs, items, dir=None):
+    r'''Writes the segment for version.
+
+    word_postings is [(word_id, posting from postings.pack)], words is [(text, word_id)],
+    paragraphs is [(paragraph_id, item_id, num_words)] and items is [(item_id, parent_id)].
+    '''
+    word_postings = sorted(word_postings)
+    words = sorted((text.lower().encode('utf-8'), word_id) for text, word_id in words)
+    paragraphs = sorted(paragraphs)
+    items = sorted(items)
+    sections = dict(
+      word_ids=array('Q', (word_id for word_id, _ in word_postings)),
+      posting_ends=array('Q', accumulate(len(posting) for _, posting in word_postings)),
+      postings=b''.join(posting for _, posting in word_postings),
+      text_ends=array('Q', accumulate(len(text) for text, _ in words)),
+      text_word_ids=array('Q', (word_id for _, word_id in words)),
+      texts=b''.join(text for text, _ in words),
+      paragraph_ids=array('Q', (paragraph_id for paragraph_id, _, _ in paragraphs)),
+      paragraph_item_ids=array('Q', (item_id for _, item_id, _ in paragraphs)),
+      num_words=array('Q', (num_words or 0 for _, _, num_words in paragraphs)),
+      item_ids=array('Q', (item_id for item_id, _ in items)),
+      parent_ids=array('Q', (parent_id or 0 for _, parent_id in items)))
+    counts = (len(word_postings), len(words), len(paragraphs), len(items),
+              len(sections['postings']), len(sections['texts']))
+    offsets = layout(*counts)
+    data = bytearray(align(max(offset + size for offset, size in offsets.values())))
+    Header.pack_into(data, 0, Magic, version, *counts)
+    for name, (offset, size) in offsets.items():
+        section = sections[name]
+        if isinstance(section, array):
+            if sys.byteorder == 'big':
+                section.byteswap()
+            section = section.tobytes()
+        data[offset: offset + size] = section
+    path = segment_path(version, dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class Texts:
+    r'''The sorted texts of a Segment, as a sequence of bytes for bisect.
+    '''
+    def __init__(self, ends, texts):
+        self.ends = ends
+        self.texts = texts
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, i):
+        return bytes(self.texts[self.ends[i - 1] if i else 0: self.ends[i]])
+
+
+class Segment:
+    r'''A segment file, opened read-only with mmap.
+
+    The sections are read in place, through memoryviews of the mmap, on little-endian
+    machines.
+    '''
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, *counts = Header.unpack_from(self.mmap)
+        if magic != Magic:
+            raise ValueError(f"Segment: {path} has the wrong magic number {magic!r}")
+        self.sections = layout(*counts)
+        self.word_ids = self.column('word_ids')
+        self.posting_ends = self.column('posting_ends')
+        self.postings = self.section('postings')
+        self.texts = Texts(self.column('text_ends'), self.section('texts'))
+        self.text_word_ids = self.column('text_word_ids')
+        self.paragraph_ids = self.column('paragraph_ids')
+        self.paragraph_item_ids = self.column('paragraph_item_ids')
+        self.paragraph_num_words = self.column('num_words')
+        self.item_ids = self.column('item_ids')
+        self.parent_ids = self.column('parent_ids')
+        self.num_paragraphs = len(self.paragraph_ids)
+        self.avg_words = sum(self.paragraph_num_words) / (self.num_paragraphs or 1)
+
+    def section(self, name):
+        offset, size = self.sections[name]
+        return memoryview(self.mmap)[offset: offset + size]
+
+    def column(self, name):
+        if sys.byteorder == 'little':
+            return self.section(name).cast('Q')
+        ans = array('Q')
+        ans.frombytes(self.section(name))
+        ans.byteswap()
+        return ans
+
+    def lookup_word(self, text):
+        r'''Returns the Word.id for text, or None.
+        '''
+        key = text.lower().encode('utf-8')
+        i = bisect_left(self.texts, key)
+        if i < len(self.texts) and self.texts[i] == key:
+            return self.text_word_ids[i]
+        return None
+
+    def occurrences(self, word_id):
+        r'''Returns the list of occurrences (see postings) of word_id in the version.
+        '''
+        i = bisect_left(self.word_ids, word_id)
+        if i == len(self.word_ids) or self.word_ids[i] != word_id:
+            return []
+        return postings.unpack(
+                 self.postings[self.posting_ends[i - 1] if i else 0: self.posting_ends[i]])
+
+    def paragraph_index(self, paragraph_id):
+        i = bisect_left(self.paragraph_ids, paragraph_id)
+        if i == len(self.paragraph_ids) or self.paragraph_ids[i] != paragraph_id:
+            return None
+        return i
+
+    def item_id(self, paragraph_id):
+        r'''Returns the Item.id of paragraph_id, or None if it isn't in an item.
+        '''
+        i = self.paragraph_index(paragraph_id)
+        return None if i is None else self.paragraph_item_ids[i]
+
+    def num_words(self, paragraph_id):
+        return self.paragraph_num_words[self.paragraph_index(paragraph_id)]
+
+    def parent_id(self, item_id):
+        r'''Returns the Item.parent_id of item_id.
+        '''
+        return self.parent_ids[bisect_left(self.item_ids, item_id)] or None
+
+
+class Db_index:
+    r'''The same lookups as a Segment, for a version without one, from the database.
+    '''
+    def __init__(self, version):
+        self.version = version
+        # {paragraph_id: (item_id, num_words)}
+        self.paragraphs = {
+          id: (item_id, num_words or 0)
+          for id, item_id, num_words in models.Paragraph.in_version(version)}
+        self.parent_ids = dict(models.Item.objects.filter(version_id=version)
+                                                  .values_list('id', 'parent_id'))
+        self.num_paragraphs = len(self.paragraphs)
+        self.avg_words = sum(num_words for _, num_words in self.paragraphs.values()) \
+                           / (self.num_paragraphs or 1)
+
+    def occurrences(self, word_id):
+        posting = models.Posting.objects.filter(version_id=self.version, word_id=word_id) \
+                                        .first()
+        return [] if posting is None else posting.unpack()
+
+    def item_id(self, paragraph_id):
+        return self.paragraphs.get(paragraph_id, (None, 0))[0]
+
+    def num_words(self, paragraph_id):
+        return self.paragraphs[paragraph_id][1]
+
+    def parent_id(self, item_id):
+        return self.parent_ids[item_id]
+
+
+def get_segment(version):
+    r'''Returns the Segment for version, or None if it doesn't have one.
+    '''
+    index = get_index(version)
+    return index if isinstance(index, Segment) else None
+
+def get_mtime(path):
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def get_index(version):
+    r'''Returns the Segment for version, or a Db_index if it doesn't have one.
+
+    These are kept for as long as the segment file isn't changed.  So a Db_index is
+    replaced by the Segment once load_words writes one, and a Segment by the new one if
+    it's written again.  Only the published versions are searched, so their Postings and
+    Paragraph.num_words don't change otherwise.
+    '''
+    path = segment_path(version)
+    mtime = get_mtime(path)
+    if version not in Indexes or Indexes[version][0] != mtime:
+        index = None
+        if mtime is not None:
+            try:
+                index = Segment(path)
+            except FileNotFoundError:
+                mtime = None
+            except ValueError as e:
+                print(f"segments: WARNING {e} -- IGNORED")
+        if index is None:
+            index = Db_index(version)
+        Indexes[version] = mtime, index
+    return Indexes[version][1]
+
+def lookup_words(texts, versions):
+    r'''Returns {text: Word.id} for the texts that are Words.
+
+    Looks in the segments of versions, and then in the database for any texts not found
+    there (Words added since the segments were written).
+    '''
+    found = {}  # {text: word_id}
+    for segment in filter(None, map(get_segment, versions)):
+        for text in texts:
+            if text not in found:
+                word_id = segment.lookup_word(text)
+                if word_id is not None:
+                    found[text] = word_id
+    missing = [text for text in texts if text not in found]
+    if missing:
+        found.update(models.Word.objects.filter(text__in=missing).values_list('text', 'id'))
+    return found
+
+def get_occurrences(version, word_ids):
+    r'''Returns [(word_id, occurrence)] for word_ids in the paragraphs (in items and table
+    cells) of version.
+
+    Reads the segment of version, if it has one, else the Postings.
+    '''
+    index = get_index(version)
+    return [(word_id, occurrence)
+            for word_id in word_ids
+            for occurrence in index.occurrences(word_id)]
@@ -0,0 +1,120 @@
+# synonym_map.py
+
+r'''An in-memory map of the synonyms of each Word, loaded once per process.
+
+Search and load_definitions expand each word to its synonyms.  Rather than a query for
+each word, get_map loads all of the Words (with their synonym_group) once into a
+Synonym_map, and that is used until load_synonyms changes the synonym groups.
+
+The synonyms are the same for all versions, so the map isn't per version.  It's
+invalidated by a generation: load_synonyms calls invalidate, which drops the map in its
+own process and touches Stamp_file.  Other processes (the web workers) see the new
+mtime of Stamp_file on their next get_map, and reload their map.  Checking this is an
+os.stat, not a database query.
+
+The Word texts are as of when the map was loaded.  Words added since then (by
+load_words) have no synonyms (load_synonyms hasn't been run on them), and their texts
+are looked up in the database the first time that they're needed.
+
+    >>> m = Synonym_map([('unit', 1, 1), ('dwelling', 2, 1), ('board', 3, None),
+    ...                  ('a', 4, 4), ('b', 5, 4)])
+    >>> sorted(m.synonyms(1)), sorted(m.synonyms(2)), sorted(m.synonyms(3))
+    ([1, 2], [1, 2], [3])
+    >>> m.synonyms(1) is m.synonyms(2)
+    True
+    >>> m.synonym_group(2), m.synonym_group(3), m.synonym_group(5)
+    (1, 3, 4)
+    >>> m.word_id('dwelling'), m.text(1)
+    (2, 'unit')
+'''
+
+from operating_procedures import models, segments
+
+
+Stamp_file = segments.Segments_dir / 'synonyms.stamp'
+
+Map = None          # the Synonym_map loaded by this process
+Generation = None   # mtime of Stamp_file when Map was loaded
+
+
+class Synonym_map:
+    r'''The synonyms of each Word, and the Word.id of each text.
+
+    words is (text, id, synonym_group) for each Word.
+    '''
+    def __init__(self, words):
+        self.word_ids = {}     # {text: word_id}
+        self.texts = {}        # {word_id: text}
+        self.group_ids = {}    # {word_id: synonym_group}
+        groups = {}            # {synonym_group: set(word_id)}
+        for text, id, synonym_group in words:
+            self.word_ids[text] = id
+            self.texts[id] = text
+            if synonym_group is not None:
+                self.group_ids[id] = synonym_group
+                groups.setdefault(synonym_group, set()).add(id)
+        # {word_id: frozenset(word_id)}, all of the words in a group share its frozenset
+        self.groups = {}
+        for group in map(frozenset, groups.values()):
+            for word_id in group:
+                self.groups[word_id] = group
+
+    def synonyms(self, word_id):
+        r'''Returns a frozenset of Word.ids (including word_id).
+        '''
+        group = self.groups.get(word_id)
+        if group is None:
+            return frozenset((word_id,))
+        return group
+
+    def synonym_group(self, word_id):
+        r'''Returns the same id for all of the synonyms of word_id (word_id itself if it
+        has no synonyms).
+        '''
+        return self.group_ids.get(word_id, word_id)
+
+    def word_id(self, text):
+        r'''Returns the Word.id of text, creating a new Word if necessary.
+
+        Converts text to lowercase.
+        '''
+        text = text.lower()
+        word_id = self.word_ids.get(text)
+        if word_id is None:
+            word_id = models.Word.lookup_word(text).id
+            self.word_ids[text] = word_id
+            self.texts[word_id] = text
+        return word_id
+
+    def text(self, word_id):
+        text = self.texts.get(word_id)
+        if text is None:
+            text = models.Word.get_text(word_id)
+            self.word_ids[text] = word_id
+            self.texts[word_id] = text
+        return text
+
+
+def get_generation():
+    try:
+        return Stamp_file.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def get_map():
+    r'''Returns the Synonym_map, loading it if this process doesn't have a current one.
+    '''
+    global Map, Generation
+    generation = get_generation()
+    if Map is None or generation != Generation:
+        Map = Synonym_map(models.Word.objects.values_list('text', 'id', 'synonym_group'))
+        Generation = generation
+    return Map
+
+def invalidate():
+    r'''Called when the synonym groups change, so that every process reloads its map.
+    '''
+    global Map
+    Map = None
+    Stamp_file.parent.mkdir(exist_ok=True)
+    Stamp_file.touch()
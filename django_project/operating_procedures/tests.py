@@ -1,3 +1,323 @@
-from django.test import TestCase
+from contextlib import redirect_stdout
+import io
+from pathlib import Path
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from operating_procedures import fts, models, query, result_cache, segments, synonym_map
+from operating_procedures.scripts import load_definitions, load_words, scrape_html
+from operating_procedures.scripts.bulk_writer import Bulk_writer
+from operating_procedures.scripts.sources import *
+
+
+class Search_test(TestCase):
+    r'''Searches a small version of each of the Sources.
+
+    The versions are loaded the way the scripts load them (load_words, load_definitions
+    and publish), with the segment files in a temp directory.
+    '''
+    # The queries done by a search over all three sources, however many results it has
+    # (see preload.py).
+    Search_queries = 22
+
+    # The queries done by a search found in result_cache: the latest versions.
+    Cached_queries = 5
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        for patcher in (mock.patch.object(segments, 'Segments_dir', Path(temp_dir.name)),
+                        mock.patch.dict(segments.Indexes, clear=True),
+                        mock.patch.object(synonym_map, 'Stamp_file',
+                                          Path(temp_dir.name) / 'synonyms.stamp'),
+                        mock.patch.object(synonym_map, 'Map', None),
+                        mock.patch.object(result_cache, 'Stamp_file',
+                                          Path(temp_dir.name) / 'results.stamp'),
+                        mock.patch.object(result_cache, 'Results',
+                                          result_cache.Lru(result_cache.Max_entries))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add_item(self, version, citation, number, title, paragraphs, parent=None,
+                 body_order=None):
+        r'''Adds an Item, with a Paragraph for each of paragraphs.
+        '''
+        self.item_order += 1
+        item = models.Item.objects.create(version=version, citation=citation,
+                                          number=number, parent=parent,
+                                          item_order=self.item_order,
+                                          body_order=body_order,
+                                          num_elements=len(paragraphs),
+                                          has_title=title is not None)
+        if title is not None:
+            models.Paragraph.objects.create(item=item, body_order=0, text=title)
+        for body_order, text in enumerate(paragraphs, 1):
+            models.Paragraph.objects.create(item=item, body_order=body_order, text=text)
+        return item
+
+    def add_section(self, version, citation, title, sub_items, text, parent=None,
+                    body_order=None, sep=' '):
+        r'''Adds an Item with sub_items sub-items, each a paragraph of text.
+
+        Returns the first paragraph in the sub-items.
+        '''
+        section = self.add_item(version, citation, citation, title, [], parent, body_order)
+        section.num_elements = sub_items
+        section.save()
+        for i in range(1, sub_items + 1):
+            item = self.add_item(version, f"{citation}{sep}({i})", f"({i})", None, [text],
+                                 section, i)
+            if i == 1:
+                first = item.paragraph_set.get()
+        return first
+
+    def add_table(self, item, body_order, rows):
+        r'''Adds a Table to item, with a cell for each text in rows.
+        '''
+        table = models.Table.objects.create(item=item, body_order=body_order,
+                                            has_header=True)
+        for row, texts in enumerate(rows, 1):
+            for col, text in enumerate(texts, 1):
+                cell = models.TableCell.objects.create(table=table, row=row, col=col)
+                models.Paragraph.objects.create(cell=cell, body_order=1, text=text)
+        return table
+
+    def load(self, sub_items):
+        r'''Loads a version of each of the Sources, with sub_items matches in each section.
+        '''
+        self.item_order = 0
+        versions = [models.Version.objects.create(source=source) for source in Sources]
+        v719, v61B, vGG = versions
+        part = self.add_item(v719, 'PART I', 'PART I', 'GENERAL PROVISIONS', [])
+        definitions = self.add_item(v719, '719.101', '719.101', 'Definitions.', [],
+                                    part, 1)
+        for i, text in enumerate(
+                         ['"Unit owner" means a person who owns a unit in a cooperative.',
+                          '"Board" means the board of administration of an association.'],
+                         1):
+            self.add_item(v719, f"719.101 ({i})", f"({i})", None, [text], definitions, i)
+        records = self.add_section(v719, '719.104', 'Records.', sub_items,
+                                   'The unit owner may ask the board for the records.1',
+                                   part, 2)
+        records.annotation_set.create(type='note_ref', char_offset=len(records.text) - 1,
+                                      length=1, info='1')
+        note = models.Paragraph.objects.create(item=records.item.parent,
+                                               body_order=sub_items + 1,
+                                               text='1Note.--Records of the unit.')
+        note.annotation_set.create(type='note', char_offset=0, length=1, info='1')
+        self.add_table(records.item.parent, sub_items + 2,
+                       [['Meeting', 'Quorum'], ['Annual', 'Majority of the units']])
+        self.add_section(v61B, '61B-75.001', 'Notices.', sub_items,
+                         'Each unit owner shall be given notice by the board.')
+        self.add_section(vGG, 'GG 1.', 'Meetings.', sub_items,
+                         'A unit owner may attend any meeting of the board.', sep='')
+        with redirect_stdout(io.StringIO()):
+            for version in versions:
+                load_words.load_words(version.id)
+            load_definitions.load_definitions(v719.id, [version.id for version in versions])
+            for version in models.Version.objects.all():
+                version.publish()
+
+    def search(self, words):
+        with redirect_stdout(io.StringIO()):
+            response = self.client.get(reverse('search', args=[words]))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_search_queries(self):
+        self.load(2)
+        with self.assertNumQueries(self.Search_queries):
+            response = self.search('unit, owner, board')
+        content = response.content.decode()
+        for citation in ('719.104 (2)', '61B-75.001 (2)', 'GG 1.(2)'):
+            self.assertIn(reverse('cite', args=[citation]), content)
+        self.assertIn('Records of the unit.', content)             # the note
+        self.assertIn('a person who owns a unit', content)         # the definition
+
+    def test_search_queries_more_results(self):
+        self.load(6)
+        with self.assertNumQueries(self.Search_queries):
+            response = self.search('unit, owner, board')
+        self.assertIn(reverse('cite', args=['GG 1.(6)']), response.content.decode())
+
+    def test_unpublished(self):
+        for source in Sources:
+            models.Version.objects.create(source=source)
+        with redirect_stdout(io.StringIO()):
+            for url in (reverse('toc', args=['719']), reverse('cite', args=['719.104']),
+                        reverse('search', args=['unit'])):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_search_merges_trees(self):
+        self.load(2)
+        # in the title of 719.104, and in each of its sub-items
+        content = self.search('records').content.decode()
+        self.assertEqual(content.count(f'"{reverse("cite", args=["719.104"])}"'), 1)
+        self.assertIn(reverse('cite', args=['719.104 (2)']), content)
+
+    def test_search_table(self):
+        self.load(2)
+        content = self.search('quorum').content.decode()
+        self.assertIn('<table>', content)
+        self.assertIn('Majority of the units', content)          # the rest of the table
+        self.assertIn(reverse('cite', args=['719.104']), content)
+
+    def test_fts_near(self):
+        r'''The fts backend matches NEARs just as the index does.
+        '''
+        self.load(2)
+        if not fts.available():
+            self.skipTest("the database doesn't have FTS5")
+        terms = query.parse('unit near/1 owner, owner near/5 board, owns near/1 unit, '
+                            'unit near/2 board')
+        versions = list(models.Version.objects.values_list('id', flat=True))
+        word_ids = segments.lookup_words(set(w for term in terms for w in term.words),
+                                         versions)
+        for term in terms:
+            term.synonyms = [{word_ids[w]} for w in term.words]
+        num_matched = 0
+        for version in versions:
+            for term, synonyms in zip(terms, fts.synonym_texts(terms)):
+                matches = term.match([segments.get_occurrences(version, word_ids)
+                                      for word_ids in term.synonyms])
+                self.assertEqual(fts.get_matches(version, term, synonyms), matches)
+                num_matched += len(matches)
+        self.assertTrue(num_matched)
+
+    def definitions(self, version):
+        r'''Returns the (citation, text) of each 'definition' Annotation in version.
+        '''
+        return sorted((paragraph_item or cell_item, text[offset: offset + length])
+                      for paragraph_item, cell_item, text, offset, length
+                       in models.Annotation.objects
+                                 .filter(load_definitions.paragraphs_of(version),
+                                         type='definition')
+                                 .values_list('paragraph__item__citation',
+                                              'paragraph__cell__table__item__citation',
+                                              'paragraph__text', 'char_offset', 'length'))
+
+    def load_definitions(self):
+        v719 = models.Version.latest(Source_719)
+        with redirect_stdout(io.StringIO()):
+            load_definitions.load_definitions(
+              v719, [models.Version.latest(source) for source in Sources])
+
+    def test_definitions_full(self):
+        self.load(2)
+        vGG = models.Version.latest(Source_GG)
+        expected = self.definitions(vGG)
+        self.assertIn(('GG 1.(1)', 'unit owner'), expected)
+        models.Annotation.objects.filter(load_definitions.paragraphs_of(vGG),
+                                         type='definition').first().delete()
+        self.load_definitions()
+        self.assertNotEqual(self.definitions(vGG), expected)      # already annotated
+        with mock.patch.object(load_definitions, 'Incremental', False):
+            self.load_definitions()
+        self.assertEqual(self.definitions(vGG), expected)
+
+    def test_definitions_without_terms(self):
+        r'''The 'definition' Annotations made before there were Terms are replaced.
+        '''
+        self.load(2)
+        vGG = models.Version.latest(Source_GG)
+        expected = self.definitions(vGG)
+        models.Annotation.objects.filter(type='definition').update(term=None)
+        models.Term.objects.all().delete()
+        self.load_definitions()
+        self.assertEqual(self.definitions(vGG), expected)
+
+    def test_definitions_synonyms(self):
+        self.load(2)
+        vGG = models.Version.latest(Source_GG)
+        self.assertNotIn(('GG 1.(1)', 'meeting'), self.definitions(vGG))
+        models.Word.objects.filter(text__in=('board', 'meeting')) \
+                           .update(synonym_group=models.Word.objects.get(text='board').id)
+        synonym_map.invalidate()
+        self.load_definitions()
+        self.assertIn(('GG 1.(1)', 'meeting'), self.definitions(vGG))
+
+    def test_search_cached(self):
+        self.load(2)
+        first = self.search('unit, owner, board')
+        with self.assertNumQueries(self.Cached_queries):
+            second = self.search('Board,  Owner, unit')
+        self.assertEqual(first.context['blocks_html'], second.context['blocks_html'])
+        result_cache.invalidate()
+        with self.assertNumQueries(self.Search_queries):
+            self.search('unit, owner, board')
+
+
+class Tokens_test(SimpleTestCase):
+    r'''Load_words.get_tokens finds the same words as get_sentences and get_words.
+    '''
+    Texts = [
+        'As provided by ss. 719.606 and s. 719.61. Tenants shall have a right.',
+        'See s.\n719.104(2)(a). The unit owner signs it.',
+        'Subsections 61B-76.006(6), (8), F.A.C. The board, i.e. the directors, meets.',
+        'A vote of 2/3rds.  Mr. Smith and Ms. Jones.\nThe end',
+        'Ends with a period.',
+        '',
+    ]
+
+    def bylaws_texts(self):
+        r'''Returns the blocks of text in bylaws.txt, with and without their newlines.
+        '''
+        bylaws = Path(__file__).parents[1] / 'bylaws.txt'
+        lines = [line.split('##', 1)[0].rstrip()
+                 for line in bylaws.read_text(encoding='utf-8').split('\n')]
+        blocks = '\n'.join(lines).split('\n\n')
+        return blocks + [' '.join(block.split('\n')) for block in blocks]
+
+    def test_get_tokens(self):
+        for text in self.Texts + self.bylaws_texts():
+            self.assertEqual(load_words.get_tokens(text),
+                             list(load_words.get_tokens_by_sentence(text)), text)
+
+
+class Scrape_test(TestCase):
+    r'''Scrapes a new version incrementally, copying the sections that haven't changed.
+    '''
+    def add_item(self, version, citation, parent=None, source_hash=None):
+        item = models.Item.objects.create(version=version, citation=citation,
+                                          number=citation, parent=parent,
+                                          item_order=models.Item.objects.count(),
+                                          body_order=1, num_elements=1, has_title=False,
+                                          source_hash=source_hash)
+        models.Paragraph.objects.create(item=item, body_order=1, text=f"{citation} text")
+        return item
+
+    def test_copy_section_with_same_prefix(self):
+        prior = models.Version.objects.create(source=Source_719)
+        part = self.add_item(prior, 'PART I')
+        # 719.1035 starts with 719.103, but isn't in it
+        for citation in '719.103', '719.1035':
+            section = self.add_item(prior, citation, part, f"hash {citation}")
+            self.add_item(prior, f"{citation}(1)", section)
+        for patcher in (mock.patch.object(scrape_html, 'Prior_sections', {}),
+                        mock.patch.object(scrape_html, 'Sections_copied', 0)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with redirect_stdout(io.StringIO()):
+            scrape_html.load_prior_sections(Source_719)
+        new = models.Version.objects.create(source=Source_719)
+        new_part = models.Item.objects.create(version=new, citation='PART I',
+                                              number='PART I', item_order=0,
+                                              num_elements=2, has_title=False)
+        writer = Bulk_writer()
+        with mock.patch.object(scrape_html, 'version_obj', new, create=True), \
+             mock.patch.object(scrape_html, 'writer', writer, create=True), \
+             mock.patch.object(scrape_html, 'item_order', 1, create=True):
+            self.assertTrue(scrape_html.copy_section('719.103', 'hash 719.103',
+                                                     new_part, 1))
+            self.assertFalse(scrape_html.copy_section('719.1035', 'changed', new_part, 2))
+        writer.flush()
+        self.assertEqual(
+          list(models.Item.objects.filter(version=new).order_by('item_order')
+                                  .values_list('citation', 'parent__citation')),
+          [('PART I', None), ('719.103', 'PART I'), ('719.103(1)', '719.103')])
+        self.assertEqual(
+          models.Paragraph.objects.get(item__version=new, item__citation='719.103(1)').text,
+          '719.103(1) text')
@@ -3,17 +3,32 @@ from django.shortcuts import render
 # Create your views here.
 
 from itertools import groupby, chain
-from operator import methodcaller, attrgetter, itemgetter
+from urllib.parse import urlencode
+from operator import attrgetter, methodcaller, itemgetter
 
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.views.decorators.http import require_GET, require_safe
-from django.db.models import Q
 
-from operating_procedures import models
+from operating_procedures import (
+    fts, models, preload, query, ranking, result_cache, segments, synonym_map
+)
 from operating_procedures.chunks import chunk, Little_stuff
 from operating_procedures.scripts.sources import *
 
 
+def published_version(source):
+    r'''Returns the id of the latest published version of source.
+
+    Raises Http404 if none of its versions have been published yet.
+    '''
+    try:
+        return models.Version.latest(source)
+    except models.Version.DoesNotExist as e:
+        raise Http404(str(e))
+
+
 @require_safe
 def toc(request, source='719'):
     r'''Creates a table-of-contents of the 'leg.state.fl.us' Chapter 719 code.
@@ -21,7 +36,7 @@ def toc(request, source='719'):
     The context created for the template is a list of blocks (see chunks.py).
     '''
     if source in Source_map:
-        latest_law = models.Version.latest(Source_map[source])
+        latest_law = published_version(Source_map[source])
     else:
         return HttpResponse(f"Invalid source: {source}.",
                             content_type='text/plain; charset=utf-8',
@@ -58,11 +73,11 @@ def toc(request, source='719'):
 @require_safe
 def cite(request, citation='719'):
     if citation.startswith('719') or citation.upper().startswith('PART '):
-        latest_law = models.Version.latest(Source_719)
+        latest_law = published_version(Source_719)
     elif citation.upper().startswith('61B-'):
-        latest_law = models.Version.latest(Source_61B)
+        latest_law = published_version(Source_61B)
     elif citation.startswith('GG '):
-        latest_law = models.Version.latest(Source_GG)
+        latest_law = published_version(Source_GG)
     else:
         return HttpResponse(f"Unknown citation: {citation}.",
                             content_type='text/plain; charset=utf-8',
@@ -113,36 +128,57 @@ def cite(request, citation='719'):
                   context=dict(citation=citation, blocks=blocks, little_tags=Little_stuff))
 
 
+def shown_element(para):
+    r'''Returns what search shows for para: para itself, or the whole Table if para is in
+    a table cell.
+    '''
+    if para.item_id is not None:
+        return para
+    return para.cell.table
+
+
 @require_safe
 def search(request, words):
     trace = True
 
+    query_text = words
+    after = request.GET.get('after')    # cursor of the last result on the prior page
+    try:
+        terms = query.parse(words)
+        if after is not None:
+            ranking.parse_cursor(after)
+    except ValueError as e:
+        return HttpResponse(f"Bad search: {e}", status=400,
+                            content_type='text/plain; charset=utf-8')
+
     # stripped, lowercase
     words = list(map(methodcaller('lower'),
                      map(methodcaller('strip'), words.split(','))))
 
-    # list of sets of synonyms: [set(word.id)]
-    word_groups = list(map(methodcaller('get_synonyms'),
-                           models.Word.objects.filter(text__in=words).all()))
+    latest_versions = [published_version(source) for source in Sources]
+
+    # Terms with words that aren't Words are dropped.  Each word gets its set of
+    # synonyms: set(word.id)
+    word_ids = segments.lookup_words(set(chain.from_iterable(map(attrgetter('words'),
+                                                                 terms))),
+                                     latest_versions)
+    terms = [term for term in terms if all(w in word_ids for w in term.words)]
+    words_map = synonym_map.get_map()
+    for term in terms:
+        term.synonyms = [words_map.synonyms(word_ids[w]) for w in term.words]
 
     #if trace:
-    print(f"search got {words=}, expands to {word_groups=}")
-
-    latest_versions = [models.Version.latest(source) for source in Sources]
-
-    def search_document(latest_version):
-        # list of (para, wordrefs, word_group_index), para repeated for each word_group_index
-        para_list1 = [(para, list(wordrefs), word_group_index)
-                      for word_group_index, words in enumerate(word_groups)
-                      for para, wordrefs
-                       in groupby(models.WordRef.objects
-                                    .select_related('paragraph__item')
-                                    .filter(
-                                       Q(paragraph__item__version_id=latest_version)
-                      ,  # FIX:      | Q(paragraph__cell__table__item__version_id=latest_version),
-                                       word_id__in=words)
-                                    .order_by('paragraph__id'),
-                                  key=attrgetter('paragraph'))]
+    print(f"search got {words=}, expands to "
+          f"{[(term, term.synonyms) for term in terms]}")
+
+    def search_document(result):
+        # list of (para, wordrefs, word_group_index), para repeated for each
+        # word_group_index (the index of the term matched).  For a paragraph in a table
+        # cell, para is the whole Table.
+        para_list1 = [(shown_element(para), wordrefs, word_group_index)
+                      for word_group_index, term_matches in enumerate(result.matches)
+                      for para, wordrefs in models.Posting.make_wordrefs(term_matches,
+                                                                         paragraphs)]
         if not para_list1:
             return []
         if trace:
@@ -278,7 +314,7 @@ def search(request, words):
                         children = []
                     else:
                         first_children = []
-                    if len(first_item_word_groups) == len(word_groups) or first_children:
+                    if len(first_item_word_groups) == len(terms) or first_children:
                         if trace:
                             print(f"sift appending {first_paras=}, {first_children=} to tree")
                         tree.append((first_item, combine_elements(first_item, first_paras,
@@ -294,7 +330,7 @@ def search(request, words):
                 first_children = sift(children, first_item_word_groups, trace)
             else:
                 first_children = []
-            if len(first_item_word_groups) == len(word_groups) or first_children:
+            if len(first_item_word_groups) == len(terms) or first_children:
                 if trace:
                     print(f"sift, appending last item {first_paras=}, {first_children=}")
                 tree.append((first_item, combine_elements(first_item, first_paras,
@@ -312,24 +348,21 @@ def search(request, words):
             children is sequence of (item, [elements])
             '''
             #print(f"combine_elements({parent_item=}, ...)")
+            item_body_orders = body_orders.get(parent_item.id, ())
             ans = []
             next = 1
             for first, second in sorted(chain(paras, children), key=lambda x: x[0].body_order):
                 #print(f"  next element {first=}, {first.body_order=}, {next=}")
                 if first.body_order > next and \
-                   models.Paragraph.objects.filter(item=parent_item,
-                                                   body_order__range=(next,
-                                                                      first.body_order - 1)) \
-                                           .exists():
+                   any(next <= body_order < first.body_order
+                       for body_order in item_body_orders):
                     #print("  appending 'omitted'")
                     ans.append(('omitted', None))
                 ans.append((first, second))
                 next = first.body_order + 1
             #print(f"  done: {first=}, {first.body_order=}, {parent_item.num_elements=}")
             if first.body_order < parent_item.num_elements and \
-               models.Paragraph.objects.filter(item=parent_item,
-                                               body_order__gt=first.body_order) \
-                                       .exists():
+               any(body_order > first.body_order for body_order in item_body_orders):
                 #print("  appending 'omitted'")
                 ans.append(('omitted', None))
             return ans
@@ -376,7 +409,7 @@ def search(request, words):
                     if isinstance(element[0], models.Paragraph):
                         blocks.append(element[0].get_block(wordrefs=element[1]))
                     elif isinstance(element[0], models.Table):
-                        blocks.append(element[0].get_block())  # FIX: How should this work?
+                        blocks.append(element[0].get_block(wordrefs=element[1]))
                     elif element[0] == 'omitted':
                         blocks.append(chunk('omitted')) 
             if sub_items:
@@ -387,22 +420,73 @@ def search(request, words):
 
         return prepare_blocks(tree)
 
-    blocks = []
-    for latest_version in latest_versions:
-        blocks.extend(search_document(latest_version))
+    # What's shown comes from the database the first time, then from result_cache
+    cache_key = result_cache.make_key(terms, latest_versions, after)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        blocks_html, num_results, next_cursor = cached
+        if trace:
+            print(f"got {num_results} results from result_cache")
+    else:
+        # Ranked results, best first, one page (plus one to see if there's another page)
+        if fts.Enabled:
+            fts_synonyms = fts.synonym_texts(terms)
+        results = []
+        for latest_version in latest_versions:
+            if fts.Enabled and fts.has_table(latest_version):
+                matches = [fts.get_matches(latest_version, term, synonyms)
+                           for term, synonyms in zip(terms, fts_synonyms)]
+            else:
+                matches = [term.match([segments.get_occurrences(latest_version, synonyms)
+                                       for synonyms in term.synonyms])
+                           for term in terms]
+            results.extend(ranking.score_version(latest_version, terms, matches))
+        num_results = len(results)
+        results = ranking.top_results(results, after, ranking.Results_per_page + 1)
+        if len(results) > ranking.Results_per_page:
+            del results[ranking.Results_per_page:]
+            next_cursor = results[-1].cursor()
+        else:
+            next_cursor = None
+        if trace:
+            print(f"got {num_results} results, showing {results}")
+
+        # Everything shown for results, loaded in a bounded number of queries
+        paragraphs, body_orders = preload.load_results(results)
+
+        blocks = []
+        for result in results:
+            blocks.extend(search_document(result))
+
+        # rendering the blocks takes most of the time, so the html is what's cached
+        if blocks:
+            #blocks[0].dump(depth=10)
+            blocks_html = render_to_string('opp/blocks.html',
+                                           context=dict(blocks=blocks,
+                                                        little_tags=Little_stuff))
+        else:
+            blocks_html = None
+        result_cache.put(cache_key, (blocks_html, num_results, next_cursor))
+
+    if next_cursor is None:
+        next_page = None
+    else:
+        next_page = reverse('search', args=[query_text]) \
+                  + '?' + urlencode(dict(after=next_cursor))
 
-    if not blocks:
+    if blocks_html is None:
         return HttpResponse(f"No results found for {words}.",
                             content_type='text/plain; charset=utf-8')
 
-    #blocks[0].dump(depth=10)
     return render(request, 'opp/search.html',
-                  context=dict(words=words, blocks=blocks, little_tags=Little_stuff))
+                  context=dict(words=words, blocks_html=blocks_html,
+                               num_results=num_results, next_page=next_page))
 
 
 def synonyms(request, word):
     w = models.Word.objects.get(text=word)
-    syns = sorted(models.Word.get_text(syn) for syn in w.get_synonyms())
+    words_map = synonym_map.get_map()
+    syns = sorted(words_map.text(syn) for syn in words_map.synonyms(w.id))
     return render(request, 'opp/synonyms.html',
                   context=dict(word=w.text, syns=syns))
 
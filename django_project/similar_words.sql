@@ -6,8 +6,7 @@ select a.id, a.text, b.id, b.text
              and length(a.text) <= length(b.text)
              and length(b.text) <= length(a.text) + 4
              and b.text like substr(a.text, 1, length(a.text) - 1) || '%'
- where not exists (select null
-                     from opp_synonym
-                    where word_id = a.id and synonym_id = b.id)
+ where a.synonym_group is null
+    or b.synonym_group is null
+    or a.synonym_group != b.synonym_group
  order by a.text;
-
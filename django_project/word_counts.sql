@@ -1,3 +1,3 @@
-select text, count(*) from opp_wordref r inner join opp_word w on r.word_id = w.id
- group by text having count(*) > 2
+select text, sum(count) from opp_posting p inner join opp_word w on p.word_id = w.id
+ group by text having sum(count) > 2
  order by 2;